@@ -0,0 +1,135 @@
+"""
+This module contains the aggregation of search engine counts and shares:
+- the columns of interned engine and label ids of a history
+- counting the searches of each engine over ranges of the columns
+- which records the search log shows by default
+
+Nothing here changes the records: the counts of a period are a pure function
+of its columns, so they can be cached and shared between threads, and which
+records are hidden is decided when they are shown.
+"""
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from records import ENGINES, LABELS
+from sp_types import SearchHistoryItem
+
+# Searches logged with these labels are never counted toward the percentages
+SITE_SEARCH_LABEL = "site_search"
+# ...and these are not counted when complements are hidden
+CHAT_BASED_SEARCH_COMPLEMENT_LABEL = "chat-based-search-complement"
+
+
+def get_uncounted_labels(hide_complements: bool = True) -> List[str]:
+    if hide_complements:
+        return [SITE_SEARCH_LABEL, CHAT_BASED_SEARCH_COMPLEMENT_LABEL]
+    return [SITE_SEARCH_LABEL]
+
+
+def is_default_visible(entry: SearchHistoryItem, hide_complements: bool = True) -> bool:
+    """Whether the search log shows a record unless asked to show everything."""
+    return entry["search_label"] not in get_uncounted_labels(hide_complements)
+
+
+class EngineShares(NamedTuple):
+    # The engines and their number of searches, most searched first
+    search_engines: List[Tuple[str, int]]
+    # The percentage of the searches made with each engine
+    shares: Dict[str, float]
+    total_searches: int
+
+
+class HistoryColumns:
+    """
+    The interned engine and label ids of a history's records, in the same
+    order, as compact integer arrays (-1 when a record has none).
+    """
+
+    def __init__(self, search_history: Sequence[SearchHistoryItem]) -> None:
+        self.engine_ids = array("i", (entry.engine for entry in search_history))
+        self.label_ids = array("i", (entry.label for entry in search_history))
+        self.included = array(
+            "b", (entry.included_search_entry for entry in search_history)
+        )
+        self.counted_engine_ids: Dict[bool, array] = {}
+
+    def __len__(self) -> int:
+        return len(self.engine_ids)
+
+    def get_counted_engine_ids(self, hide_complements: bool = True) -> array:
+        """The engine id of each record that counts as a search, and -1 for the others."""
+        if hide_complements not in self.counted_engine_ids:
+            uncounted_label_ids = {
+                LABELS.indexes[label]
+                for label in get_uncounted_labels(hide_complements)
+                if label in LABELS.indexes
+            }
+            unnamed_engine_id = ENGINES.indexes.get("", -1)
+            self.counted_engine_ids[hide_complements] = array(
+                "i",
+                (
+                    engine_id
+                    if included
+                    and engine_id != unnamed_engine_id
+                    and label_id not in uncounted_label_ids
+                    else -1
+                    for engine_id, label_id, included in zip(
+                        self.engine_ids, self.label_ids, self.included
+                    )
+                ),
+            )
+        return self.counted_engine_ids[hide_complements]
+
+
+def count_engines(engine_ids: array) -> EngineShares:
+    """
+    Counts the searches of each engine id, like a bincount. Ties keep the
+    order the engines are first seen in.
+    """
+    counts = Counter(engine_ids)
+    counts.pop(-1, None)
+    return get_engine_shares(
+        {ENGINES.value(engine_id): count for engine_id, count in counts.items()}
+    )
+
+
+def get_engine_shares(counts: Dict[str, int]) -> EngineShares:
+    total_searches = sum(counts.values())
+    search_engines = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    return EngineShares(
+        search_engines=search_engines,
+        shares={engine: count / total_searches * 100 for engine, count in search_engines},
+        total_searches=total_searches,
+    )
+
+
+def update_engine_shares(engine_shares: EngineShares, changes: Dict[str, int]) -> EngineShares:
+    """
+    The engine shares of a period after searches were added to it (positive
+    changes) or removed from it (negative ones), without counting it again.
+    """
+    counts = Counter(dict(engine_shares.search_engines))
+    counts.update(changes)
+    # Drops the engines with no searches left
+    return get_engine_shares(+counts)
+
+
+def aggregate_engine_shares(
+    columns: HistoryColumns,
+    hide_complements: bool = True,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> EngineShares:
+    return count_engines(columns.get_counted_engine_ids(hide_complements)[start:end])
+
+
+def aggregate_periods(
+    columns: HistoryColumns,
+    ranges: Iterable[Tuple[int, int]],
+    hide_complements: bool = True,
+) -> List[EngineShares]:
+    """The engine shares of several (start, end) ranges of the columns at once."""
+    counted_engine_ids = columns.get_counted_engine_ids(hide_complements)
+    return [count_engines(counted_engine_ids[start:end]) for start, end in ranges]
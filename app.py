@@ -1,5 +1,6 @@
 import argparse
 from main import (
+    process_all_histories,
     process_history,
     process_test_history,
     get_available_sources,
@@ -15,10 +16,29 @@ if __name__ == "__main__":
     parser.add_argument("--date", help="Specify the date to process.")
     parser.add_argument("--test", action="store_true", help="Run tests.")
     parser.add_argument("--fzf", action="store_true", help="Use fzf to select the browser.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process history added since the last incremental run.",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep the week's percentages up to date as the browser writes new history.",
+    )
+
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Process all available sources together as one timeline.",
+    )
 
     args = parser.parse_args()
 
-    if args.browser or args.htu:
+    if args.all:
+        process_all_histories(args)
+    elif args.browser or args.htu:
         if args.browser:
             browser_choice = args.browser
             data_path = get_data_path(browser_choice)
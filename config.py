@@ -56,3 +56,44 @@ CHAT_BASED_SEARCH_COMPLEMENTS = [
 ]
 
 LANDING_PAGE_ONLY_SEARCH_SYSTEMS = ["https://andisearch.com/"]
+
+# The query parameters that hold the search query, tried in this order.
+DEFAULT_SEARCH_QUERY_PARAMETERS = ["q", "query", "p"]
+
+# Search engines that keep the query in other parameters, by URL prefix. Their
+# parameters are tried before the default ones.
+SEARCH_QUERY_PARAMETERS = {
+    "https://search.yahoo.com/": ["p"],
+    "https://www.baidu.com/": ["wd", "word"],
+    "https://yandex.com/": ["text"],
+    "https://yandex.ru/": ["text"],
+}
+
+# Cache Configurations
+
+# The processed history cache is a set of append-only segments. They are
+# compacted into one when there are more than this many.
+CACHE_MAX_SEGMENTS = 8
+
+# Segments whose newest record is older than this many days are dropped
+# (None keeps them regardless of age)
+CACHE_MAX_AGE_DAYS = None
+
+# The oldest segments are dropped while the cache is larger than this
+# (None keeps them regardless of size)
+CACHE_MAX_SIZE_MB = 500
+
+# In --watch mode, new history is read once the database has not been written
+# to for this many seconds, since the browser writes a visit in several steps
+WATCH_SETTLE_SECONDS = 2
+
+# A search session (one search path) ends when nothing was visited for this
+# many minutes
+SESSION_INACTIVITY_GAP_MINUTES = 30
+
+# Two searches are linked as a reformulation (a retry, possibly on another
+# engine) when the second comes within this many minutes of the first and
+# their queries are at least this similar (Jaccard similarity of their words
+# and character trigrams), or when one query's words contain the other's
+REFORMULATION_WINDOW_MINUTES = 10
+REFORMULATION_SIMILARITY = 0.5
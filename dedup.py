@@ -0,0 +1,96 @@
+"""
+This module contains the index of recent candidate searches used to spot
+duplicates and redirects while classifying history:
+- adding a candidate search and evicting the ones outside the time window
+- looking up a URL, or a query on an engine, among the recent candidates
+
+History is classified in visit order (newest or oldest first), so the
+candidates that matter are always the last few seconds of it. Holding only
+those keeps every lookup O(1) and memory flat however long the history is.
+"""
+
+import hashlib
+from collections import Counter, deque
+from typing import Deque, Iterator, NamedTuple, Optional, Tuple
+
+# Candidates further apart than this, in seconds, are never duplicates
+DEDUP_WINDOW_SECONDS = 10
+
+# Consecutive visits of the same page within this many seconds are logged once
+REVISIT_SECONDS = 1
+
+
+def normalize_url(url: str) -> str:
+    return url.replace("www.", "")
+
+
+def get_query_key(engine: str, search_query: str) -> Tuple[str, str]:
+    return engine, hashlib.sha1(search_query.encode()).hexdigest()
+
+
+class DedupEntry(NamedTuple):
+    url: str
+    normalized_url: str
+    query_key: Optional[Tuple[str, str]]
+    timestamp: float
+
+
+class DedupIndex:
+    """The candidate searches of the last DEDUP_WINDOW_SECONDS, oldest added first."""
+
+    def __init__(self, window_seconds: float = DEDUP_WINDOW_SECONDS) -> None:
+        self.window_seconds = window_seconds
+        self.entries: Deque[DedupEntry] = deque()
+        self.url_counts: Counter = Counter()
+        self.query_counts: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def evict(self, timestamp: float) -> None:
+        """Drops the candidates outside the window around timestamp."""
+        while self.entries and abs(timestamp - self.entries[0].timestamp) > self.window_seconds:
+            entry = self.entries.popleft()
+            self.url_counts[entry.normalized_url] -= 1
+            if not self.url_counts[entry.normalized_url]:
+                del self.url_counts[entry.normalized_url]
+            if entry.query_key is not None:
+                self.query_counts[entry.query_key] -= 1
+                if not self.query_counts[entry.query_key]:
+                    del self.query_counts[entry.query_key]
+
+    def add(
+        self, url: str, timestamp: float, engine: str = "", search_query: Optional[str] = None
+    ) -> None:
+        self.evict(timestamp)
+        if self.entries:
+            last_entry = self.entries[-1]
+            if (
+                url.split("?")[0] == last_entry.url.split("?")[0]
+                and abs(timestamp - last_entry.timestamp) <= REVISIT_SECONDS
+            ):
+                return
+        entry = DedupEntry(
+            url=url,
+            normalized_url=normalize_url(url),
+            query_key=get_query_key(engine, search_query) if search_query else None,
+            timestamp=timestamp,
+        )
+        self.entries.append(entry)
+        self.url_counts[entry.normalized_url] += 1
+        if entry.query_key is not None:
+            self.query_counts[entry.query_key] += 1
+
+    def last(self) -> DedupEntry:
+        return self.entries[-1]
+
+    def recent(self, count: int) -> Iterator[DedupEntry]:
+        """The last count candidates, newest added first."""
+        for index in range(1, min(count, len(self.entries)) + 1):
+            yield self.entries[-index]
+
+    def contains_url(self, url: str) -> bool:
+        return normalize_url(url) in self.url_counts
+
+    def contains_query(self, engine: str, search_query: str) -> bool:
+        return get_query_key(engine, search_query) in self.query_counts
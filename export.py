@@ -2,13 +2,13 @@ import csv
 import os
 import json
 from datetime import datetime
-from urllib.parse import urlparse
+
+from urls import get_parsed_url
 
 
 def format_entry_for_file(entry):
     if entry["search_query"]:
-        parsed_url = urlparse(entry["url"])
-        root_domain = "{uri.netloc}".format(uri=parsed_url)
+        root_domain = get_parsed_url(entry).netloc
         formatted_date = entry["last_visit_time"]
         # Include the full URL in the formatted entry
         formatted_entry = {
@@ -20,6 +20,8 @@ def format_entry_for_file(entry):
 
 def save_to_json(history, timestamp, dir):
     json_filename = f"search_queries_{timestamp}.json"
+    # The parsed URLs are only kept in memory
+    history = [{key: value for key, value in entry.items() if key != "parsed_url"} for entry in history]
     # Convert datetime objects to strings
     for entry in history:
         if 'last_visit_time' in entry and isinstance(entry['last_visit_time'], datetime):
@@ -1,14 +1,19 @@
 # See https://sites.google.com/view/history-trends-unlimited/faq#h.p_Ierouyo2Q6LA
 
+import json
 import os
-import shutil
 import sqlite3
-from datetime import datetime
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 from config import HTU_PROFILE_PATH
 from sp_types import HistoryItem
-from utils import convert_chrome_time
+from utils import (
+    connect_for_reading,
+    convert_epoch_times,
+    iter_cursor_batches,
+    open_history_database,
+)
 
 # Change the threshold to the size you expect of the HTU database
 # See chrome-extension://pnmchffiealhkdloeffcdnbgdnedheme/options.html
@@ -16,54 +21,137 @@ from utils import convert_chrome_time
 # Database Size:	__ MB
 THRESHOLD = 10 * 1024 * 1024  # 10 MB
 
-# This is the path to the folder where the database will be copied to and
-# where the filepath will be cached
+# This is the path to the folder where the database filepath will be cached
 EXTERNAL_DATA_PATH: str = "external_data/htu"
 
 
+# Every SQLite database file starts with this 16-byte header string
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# Number of threads scanning the File System directory in parallel
+SCAN_WORKERS = 8
+
+
+def get_filepath_cache() -> str:
+    return os.path.join(EXTERNAL_DATA_PATH, "htu_database_filepath.txt")
+
+
 def cache_filepath(filepath: str) -> None:
-    htu_database_filepath = os.path.join(
-        EXTERNAL_DATA_PATH, "htu_database_filepath.txt"
-    )
-    with open(htu_database_filepath, "w") as f:
-        f.write(filepath)
+    stat = os.stat(filepath)
+    os.makedirs(EXTERNAL_DATA_PATH, exist_ok=True)
+    with open(get_filepath_cache(), "w") as f:
+        json.dump(
+            {"filepath": filepath, "size": stat.st_size, "mtime": stat.st_mtime}, f
+        )
+
+
+def load_cached_filepath() -> Optional[Dict[str, Any]]:
+    if not os.path.exists(get_filepath_cache()):
+        return None
+    with open(get_filepath_cache(), "r") as f:
+        contents = f.read()
+    try:
+        return json.loads(contents)
+    except ValueError:
+        # Older versions cached only the filepath
+        return {"filepath": contents.strip(), "size": None, "mtime": None}
+
+
+def is_sqlite_database(file_path: str) -> bool:
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
 
 
-# Function to recursively find large files
-def find_large_files(directory: str, large_files: List[str] = []) -> List[str]:
+def scan_large_files(directory: str) -> List[Tuple[str, int, float]]:
+    """Returns (path, size, mtime) for the SQLite files over THRESHOLD below a directory."""
+    large_files = []
+    directories = [directory]
+    while directories:
+        try:
+            entries = list(os.scandir(directories.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                if stat.st_size > THRESHOLD and is_sqlite_database(entry.path):
+                    large_files.append((entry.path, stat.st_size, stat.st_mtime))
+    return large_files
+
+
+def find_large_files(directory: str) -> List[Tuple[str, int, float]]:
+    """Scans the subdirectories of a directory in parallel for large SQLite files."""
+    subdirectories = []
+    large_files = []
     for entry in os.scandir(directory):
-        if entry.is_dir():
-            find_large_files(entry.path, large_files)
-        elif entry.is_file():
-            if entry.stat().st_size > THRESHOLD:
-                large_files.append(entry.path)
-                size_in_mb = entry.stat().st_size / (1024 * 1024)
-                print(f"Found large file: {entry.path} ({size_in_mb:.2f} MB)")
+        if entry.is_dir(follow_symlinks=False):
+            subdirectories.append(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            stat = entry.stat()
+            if stat.st_size > THRESHOLD and is_sqlite_database(entry.path):
+                large_files.append((entry.path, stat.st_size, stat.st_mtime))
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        for files in executor.map(scan_large_files, subdirectories):
+            large_files.extend(files)
+
+    for path, size, _ in large_files:
+        print(f"Found large file: {path} ({size / (1024 * 1024):.2f} MB)")
     return large_files
 
 
 def has_required_tables(file_path: str) -> bool:
+    if not is_sqlite_database(file_path):
+        return False
+    try:
+        conn = connect_for_reading(file_path)
+    except sqlite3.Error:
+        return False
     try:
-        conn = sqlite3.connect(file_path)
         cursor = conn.cursor()
         # Check for 'urls' and 'visits' tables
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = [row[0] for row in cursor.fetchall()]
         return "urls" in tables and "visits" in tables
-    except sqlite3.Error as e:
+    except sqlite3.Error:
         return False
     finally:
         conn.close()
 
 
+def get_valid_cached_filepath() -> Optional[str]:
+    """
+    Returns the cached HTU database filepath if it still points to the HTU
+    database. A file that changed size or mtime since it was cached is checked
+    again before it is trusted.
+    """
+    cached = load_cached_filepath()
+    if cached is None:
+        return None
+    filepath = cached["filepath"]
+    if not os.path.isfile(filepath):
+        print(f"The cached HTU database no longer exists: {filepath}")
+        return None
+    stat = os.stat(filepath)
+    if stat.st_size == cached["size"] and stat.st_mtime == cached["mtime"]:
+        return filepath
+    if not has_required_tables(filepath):
+        print(f"The cached HTU database is no longer valid: {filepath}")
+        return None
+    cache_filepath(filepath)
+    return filepath
+
+
 def find_htu_history_database(profile_path: str) -> Union[None, str]:
     # Check for cached filepath
-    htu_database_filepath = os.path.join(
-        EXTERNAL_DATA_PATH, "htu_database_filepath.txt"
-    )
-    if os.path.exists(htu_database_filepath):
-        with open(htu_database_filepath, "r") as f:
-            return f.read()
+    cached_filepath = get_valid_cached_filepath()
+    if cached_filepath is not None:
+        return cached_filepath
 
     # Navigate to the profile path + File System
     file_system_path = os.path.join(profile_path, "File System")
@@ -73,13 +161,11 @@ def find_htu_history_database(profile_path: str) -> Union[None, str]:
 
     large_files = find_large_files(file_system_path)
     # Sort files by modification time
-    large_files_sorted = sorted(
-        large_files, key=lambda x: os.path.getmtime(x), reverse=True
-    )
+    large_files_sorted = sorted(large_files, key=lambda x: x[2], reverse=True)
 
     # Try opening each file with sqlite to check for 'urls' and 'visits' tables
     print(f"Checking {len(large_files_sorted)} files for HTU database")
-    for file_path in large_files_sorted:
+    for file_path, _, _ in large_files_sorted:
         if has_required_tables(file_path):
             print(f"Found HTU database: {file_path}")
             cache_filepath(file_path)
@@ -88,58 +174,76 @@ def find_htu_history_database(profile_path: str) -> Union[None, str]:
     return None
 
 
-def get_htu_history() -> List[HistoryItem]:
-    # Ensure the target directory exists
-    os.makedirs(EXTERNAL_DATA_PATH, exist_ok=True)
+def get_htu_history(since_visit_time: float = 0) -> Iterator[HistoryItem]:
+    database_path = find_htu_history_database(HTU_PROFILE_PATH)
+    if database_path is None:
+        return
+
+    yield from iter_htu_history(database_path, since_visit_time)
+
+
+def get_incremental_htu_history(
+    high_water_mark: Optional[float] = None,
+) -> Tuple[Iterator[HistoryItem], float]:
+    """
+    Returns only the visits made after the given visits.visit_time high-water
+    mark (in milliseconds, which HTU stores as REAL), along with the new mark.
+    """
+    since_visit_time = high_water_mark or 0
 
     database_path = find_htu_history_database(HTU_PROFILE_PATH)
     if database_path is None:
-        return []
+        return iter([]), since_visit_time
+
+    # Read the new mark first and stop the read at it: visits written after it
+    # are picked up next run, and not read twice
+    with open_history_database(database_path) as connection:
+        (newest,) = connection.execute("SELECT MAX(visit_time) FROM visits").fetchone()
+    # Kept as it is stored: rounding it down would leave the newest visit out of the read
+    new_high_water_mark = newest if newest is not None else since_visit_time
 
-    # Copy it to the external data folder
-    shutil.copy(database_path, EXTERNAL_DATA_PATH)
+    history = iter_htu_history(database_path, since_visit_time, new_high_water_mark)
+    return history, new_high_water_mark
 
-    # Connect to the copied database
-    copied_db_path = os.path.join(EXTERNAL_DATA_PATH, "copied_extension_database")
-    shutil.copy(database_path, copied_db_path)
-    connection = sqlite3.connect(copied_db_path)
-    cursor = connection.cursor()
 
-    # Combine data from the urls and visits tables to create a history list
+def iter_htu_history(
+    database_path: str, since_visit_time: float = 0, until_visit_time: Optional[float] = None
+) -> Iterator[HistoryItem]:
+    # Combine data from the urls and visits tables to create a history list,
+    # with the number of visits per urlid counted by SQLite, only for the
+    # urlids of the visits read
     query = """
-    SELECT urls.urlid, urls.url, urls.title, visits.visit_time
-    FROM urls
-    JOIN visits ON urls.urlid = visits.urlid
+    SELECT urls.url, urls.title, visit_counts.visit_count, visits.visit_time
+    FROM visits
+    JOIN urls ON urls.urlid = visits.urlid
+    JOIN (
+        SELECT urlid, COUNT(*) AS visit_count FROM visits
+        WHERE urlid IN (
+            SELECT urlid FROM visits
+            WHERE visit_time > :since AND (:until IS NULL OR visit_time <= :until)
+        )
+        GROUP BY urlid
+    ) AS visit_counts ON visit_counts.urlid = visits.urlid
+    WHERE visits.visit_time > :since AND (:until IS NULL OR visits.visit_time <= :until)
     ORDER BY visits.visit_time DESC
     """
-    cursor.execute(query)
-    data = cursor.fetchall()
-
-    # Create a dictionary to count visits per urlid
-    visit_counts: dict[int, int] = {}
-    for urlid, _, _, _ in data:
-        if urlid in visit_counts:
-            visit_counts[urlid] += 1
-        else:
-            visit_counts[urlid] = 1
-
-    # Create a list of history items using the precomputed visit counts
-    history_items: List[HistoryItem] = []
-    for urlid, url, title, visit_time in data:
-        title = title if title else ""
-        formatted_visit_time = datetime.fromtimestamp(
-            float(visit_time) / 1000
-        ).strftime("%Y-%m-%d %H:%M:%S")
-        history_item = HistoryItem(
-            url=url,
-            title=title,
-            visit_count=visit_counts.get(urlid, 1),
-            last_visit_time=formatted_visit_time,
-            last_visit_time_datetime=datetime.fromtimestamp(
-            float(visit_time) / 1000)
+    with open_history_database(database_path) as connection:
+        cursor = connection.execute(
+            query, {"since": since_visit_time, "until": until_visit_time}
         )
-        history_items.append(history_item)
-
-    history_items.sort(key=lambda item: item["last_visit_time"], reverse=True)
 
-    return history_items
+        # The query is already newest first, so items can be yielded as they are read
+        for rows in iter_cursor_batches(cursor):
+            # visit_time is in milliseconds, the datetimes are naive local time
+            visit_datetimes = convert_epoch_times(
+                [row[3] for row in rows], units_per_second=1000, naive=True
+            )
+            for (url, title, visit_count, _), visit_datetime in zip(rows, visit_datetimes):
+                title = title if title else ""
+                yield HistoryItem(
+                    url=url,
+                    title=title,
+                    visit_count=visit_count,
+                    last_visit_time=visit_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+                    last_visit_time_datetime=visit_datetime,
+                )
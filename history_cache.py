@@ -0,0 +1,202 @@
+"""
+This module contains the binary cache format for processed search history:
+- writing a search history to a cache file
+- opening a cache file with mmap and decoding its rows lazily
+
+A cache file is laid out as:
+- a header: magic, version, row count and the length of every section
+- a JSON table of the interned search engines, labels and timezones
+- typed columns: visit time, visit count, engine, label, timezone and flags
+- the offsets of each row's url, title and search_query
+- a blob with all of those strings, UTF-8 encoded
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Sequence
+from datetime import timedelta, timezone
+from typing import Iterable, List, Tuple, Union, overload
+
+from sp_types import SearchHistoryItem
+from records import (
+    DEFAULT_VISIBLE,
+    INCLUDED_SEARCH_ENTRY,
+    MICROSECOND,
+    NAIVE_EPOCH,
+    UTC_EPOCH,
+    Interner,
+    SearchRecord,
+)
+
+CACHE_MAGIC = b"SPHC"
+CACHE_VERSION = 2
+# magic, version, row count, and the byte length of the tables, each column,
+# the string offsets and the string blob
+HEADER = struct.Struct("<4sHxxQ9Q")
+
+# (array typecode, name) of each column, in file order
+COLUMNS = [
+    ("q", "visit_time"),  # microseconds since the epoch, wall clock if naive
+    ("q", "visit_count"),
+    ("h", "engine"),  # index into the engines table, -1 for None
+    ("h", "label"),  # index into the labels table, -1 for None
+    ("h", "zone"),  # index into the timezones table, -1 for naive datetimes
+    ("B", "flags"),
+]
+# last_visit_time is formatted from the visit time when it is read
+STRING_FIELDS = ["url", "title", "search_query"]
+
+HAS_SEARCH_QUERY = 4
+
+
+def pad(length: int) -> int:
+    """Sections start on 8-byte boundaries so columns can be cast in place."""
+    return -length % 8
+
+
+def write_history_cache(path: str, history: Iterable[SearchHistoryItem]) -> None:
+    engines, labels, zones = Interner(), Interner(), Interner()
+    columns = {name: array(typecode) for typecode, name in COLUMNS}
+    string_offsets = array("Q", [0])
+    blob = bytearray()
+
+    for entry in history:
+        visit_datetime = entry["last_visit_time_datetime"]
+        if visit_datetime.tzinfo is None:
+            columns["visit_time"].append((visit_datetime - NAIVE_EPOCH) // MICROSECOND)
+            columns["zone"].append(-1)
+        else:
+            columns["visit_time"].append((visit_datetime - UTC_EPOCH) // MICROSECOND)
+            offset = visit_datetime.utcoffset() or timedelta(0)
+            zone_key = (int(offset.total_seconds()), visit_datetime.tzname())
+            columns["zone"].append(zones.index(zone_key))
+        columns["visit_count"].append(int(entry["visit_count"]))
+        columns["engine"].append(engines.index(entry["search_engine"]))
+        columns["label"].append(labels.index(entry["search_label"]))
+        columns["flags"].append(
+            (INCLUDED_SEARCH_ENTRY if entry["included_search_entry"] else 0)
+            | (DEFAULT_VISIBLE if entry["default_visible"] else 0)
+            | (HAS_SEARCH_QUERY if entry["search_query"] is not None else 0)
+        )
+        for field in STRING_FIELDS:
+            blob += (entry[field] or "").encode()  # type: ignore[literal-required]
+            string_offsets.append(len(blob))
+
+    tables = json.dumps(
+        {"engines": engines.values, "labels": labels.values, "zones": zones.values}
+    ).encode()
+    sections = [tables] + [columns[name].tobytes() for _, name in COLUMNS]
+    sections += [string_offsets.tobytes(), bytes(blob)]
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(
+            HEADER.pack(
+                CACHE_MAGIC,
+                CACHE_VERSION,
+                len(columns["visit_time"]),
+                *[len(section) for section in sections],
+            )
+        )
+        for section in sections:
+            f.write(section)
+            f.write(b"\0" * pad(len(section)))
+    os.replace(path + ".tmp", path)
+
+
+class CachedSearchHistory(Sequence):
+    """
+    A read-only search history backed by a memory-mapped cache file. Opening it
+    only reads the header and the small tables; rows are decoded when accessed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.row_count, *lengths = HEADER.unpack_from(self.mmap)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            raise ValueError(f"Not a search history cache: {path}")
+
+        view = memoryview(self.mmap)
+        position = HEADER.size
+        sections = []
+        for length in lengths:
+            sections.append(view[position : position + length])
+            position += length + pad(length)
+
+        tables = json.loads(bytes(sections[0]))
+        self.engines: List[str] = tables["engines"]
+        self.labels: List[str] = tables["labels"]
+        self.zones = [
+            timezone(timedelta(seconds=offset), name) for offset, name in tables["zones"]
+        ]
+        self.columns = {
+            name: section.cast(typecode)
+            for (typecode, name), section in zip(COLUMNS, sections[1:])
+        }
+        self.string_offsets = sections[-2].cast("Q")
+        self.blob = sections[-1]
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def __reduce__(self) -> Tuple[type, Tuple[str]]:
+        # Sent to another process as its path, which is memory-mapped again there
+        return CachedSearchHistory, (self.path,)
+
+    def get_string(self, row: int, field: int) -> str:
+        index = row * len(STRING_FIELDS) + field
+        start, end = self.string_offsets[index], self.string_offsets[index + 1]
+        return str(self.blob[start:end], "utf-8")
+
+    def get_url(self, row: int) -> str:
+        """The URL of a row, without decoding the rest of it."""
+        return self.get_string(row, STRING_FIELDS.index("url"))
+
+    def get_row(self, row: int) -> SearchHistoryItem:
+        visit_time = timedelta(microseconds=self.columns["visit_time"][row])
+        zone = self.columns["zone"][row]
+        if zone < 0:
+            visit_datetime = NAIVE_EPOCH + visit_time
+        else:
+            visit_datetime = (UTC_EPOCH + visit_time).astimezone(self.zones[zone])
+        engine = self.columns["engine"][row]
+        label = self.columns["label"][row]
+        flags = self.columns["flags"][row]
+        return SearchRecord(
+            self.get_string(row, 0),
+            self.get_string(row, 1),
+            self.columns["visit_count"][row],
+            visit_datetime,
+            self.get_string(row, 2) if flags & HAS_SEARCH_QUERY else None,
+            self.engines[engine] if engine >= 0 else None,
+            self.labels[label] if label >= 0 else None,
+            bool(flags & INCLUDED_SEARCH_ENTRY),
+            bool(flags & DEFAULT_VISIBLE),
+        )
+
+    @overload
+    def __getitem__(self, index: int) -> SearchHistoryItem: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[SearchHistoryItem]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[SearchHistoryItem, List[SearchHistoryItem]]:
+        if isinstance(index, slice):
+            return [self.get_row(row) for row in range(*index.indices(self.row_count))]
+        row = index + self.row_count if index < 0 else index
+        if not 0 <= row < self.row_count:
+            raise IndexError("cached history index out of range")
+        return self.get_row(row)
+
+    def close(self) -> None:
+        for column in self.columns.values():
+            column.release()
+        self.string_offsets.release()
+        self.blob.release()
+        self.mmap.close()
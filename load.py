@@ -1,153 +1,466 @@
 import csv
-import glob
+import gzip
+import hashlib
 import json
 import os
-import shutil
+import re
 import sqlite3
-from datetime import datetime, timedelta
-from typing import List, Optional
+import threading
+from datetime import datetime
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, TextIO, Tuple
 from urllib.parse import urlparse
 
 import pytz
 
-from config import SKIP_DOMAINS
-from extract_htu import get_htu_history
-from sp_types import HistoryItem
-from utils import convert_chrome_time
+from config import HTU_PROFILE_PATH, SKIP_DOMAINS
+from extract_htu import find_htu_history_database, get_htu_history
+from segments import (
+    MANIFEST_LOCK,
+    SegmentedSearchHistory,
+    append_segment,
+    clear_segments,
+    load_manifest,
+    load_segments,
+)
+from sp_types import HistoryItem, IngestState, SearchHistoryItem
+from rules import get_rules_fingerprint, get_search_candidate_filter
+from utils import (
+    convert_chrome_time,
+    convert_chrome_times,
+    get_chrome_time,
+    iter_cursor_batches,
+    open_history_database,
+)
 
+# Suffixes of exported histories, which may be stored gzipped
+TSV_SUFFIXES = (".tsv", ".tsv.gz")
+NDJSON_SUFFIXES = (".ndjson", ".jsonl", ".ndjson.gz", ".jsonl.gz")
+JSON_SUFFIXES = (".json", ".json.gz") + NDJSON_SUFFIXES
+GZIP_MAGIC = b"\x1f\x8b"
 
-def load_cache():
-    import glob
+# TSV exports are converted this many rows at a time
+TSV_CHUNK_SIZE = 5000
 
-    cache_files = glob.glob("cached_histories/cache_*.json")
-    if cache_files:
-        most_recent_file = max(cache_files, key=os.path.getctime)
-        with open(most_recent_file, "r") as f:
-            return json.load(f)
-    else:
-        return []
+# JSON exports are parsed incrementally, this many characters at a time
+JSON_READ_SIZE = 64 * 1024
+JSON_ARRAY_TOKEN = re.compile(r"[^\s,]")
 
+# Where the per-profile high-water marks and processed histories for
+# incremental ingestion are kept
+INGEST_STATE_DIR = "cached_histories/incremental"
 
-def clear_old_cache():
-    cache_files = glob.glob("cached_histories/cache_*.json")
-    if len(cache_files) > 3:
-        # Sort files by creation time
-        sorted_files = sorted(cache_files, key=os.path.getctime)
-        # Delete the oldest files, keeping only the 3 most recent
-        for file_to_delete in sorted_files[:-3]:
-            os.remove(file_to_delete)
+# Where processed histories are kept, as segments in one directory per source
+PROCESSED_CACHE_DIR = "cached_histories/processed"
 
 
 def save_cache(history):
-    def datetime_serializer(o):
-        if isinstance(o, datetime):
-            return o.isoformat()
-        raise TypeError("Object of type '{}' is not JSON serializable".format(type(o).__name__))
-
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    cache_dir = "cached_histories"
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-    with open(f"{cache_dir}/cache_{timestamp}.json", "w") as f:
-        json.dump(history, f, default=datetime_serializer)
-    clear_old_cache()
-
-
-def get_tsv_history(data_path: str) -> List[HistoryItem]:
-    with open(data_path, "r") as f:
+    # Only the records newer than the cache are written, as a new segment
+    return append_segment(history)
+
+
+def open_text_export(data_path: str) -> TextIO:
+    """Opens an exported history file, decompressing it if it is gzipped."""
+    with open(data_path, "rb") as f:
+        is_gzipped = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    if is_gzipped:
+        return gzip.open(data_path, "rt", newline="")
+    return open(data_path, "r", newline="")
+
+
+def get_source_fingerprint(data_path: str) -> Optional[str]:
+    """
+    Returns a fingerprint of a source and of the classification rules, or
+    None if the source cannot be found. The source part is the size and mtime
+    of its file and, for databases, the newest visit time in it.
+    """
+    newest_query = None
+    if data_path == "htu_sync":
+        source_path = find_htu_history_database(HTU_PROFILE_PATH)
+        newest_query = "SELECT MAX(visit_time) FROM visits"
+    elif is_chromium_profile(data_path):
+        source_path = os.path.join(data_path, "History")
+        newest_query = "SELECT MAX(last_visit_time) FROM urls"
+    else:
+        source_path = data_path
+    if source_path is None or not os.path.exists(source_path):
+        return None
+
+    fingerprint: List[Any] = [os.path.abspath(source_path)]
+    for suffix in ["", "-wal"]:
+        if os.path.exists(source_path + suffix):
+            stat = os.stat(source_path + suffix)
+            fingerprint += [stat.st_size, stat.st_mtime_ns]
+    if newest_query:
+        with open_history_database(source_path) as c:
+            fingerprint.append(c.execute(newest_query).fetchone()[0])
+    fingerprint.append(get_rules_fingerprint())
+    return hashlib.sha1(json.dumps(fingerprint).encode()).hexdigest()
+
+
+def get_processed_cache_dir(data_path: str) -> str:
+    source_key = hashlib.sha1(data_path.encode()).hexdigest()[:16]
+    return os.path.join(PROCESSED_CACHE_DIR, source_key)
+
+
+def load_processed_cache(
+    data_path: str, fingerprint: str
+) -> Optional[SegmentedSearchHistory]:
+    """
+    Opens the processed cache of a source if it was saved for this source
+    fingerprint, without decoding it: its rows are decoded once, as the store
+    reads them.
+    """
+    segment_dir = get_processed_cache_dir(data_path)
+    with MANIFEST_LOCK:
+        manifest = load_manifest(segment_dir)
+    if manifest.get("source_fingerprint") != fingerprint or not manifest["segments"]:
+        return None
+    return SegmentedSearchHistory(manifest, segment_dir)
+
+
+def save_processed_cache(
+    data_path: str, fingerprint: str, search_history: List[SearchHistoryItem]
+) -> None:
+    """
+    Replaces the processed cache of a source with the history just processed
+    from it. A hit returns the cache as the whole history, so it must match
+    the source: visits deleted from it are dropped, and retention does not
+    apply.
+    """
+    segment_dir = get_processed_cache_dir(data_path)
+    clear_segments(segment_dir)
+    append_segment(
+        search_history,
+        replace_revisited=is_chromium_profile(data_path),
+        segment_dir=segment_dir,
+        metadata={"source_fingerprint": fingerprint},
+        retention=False,
+    )
+
+
+def get_tsv_history(data_path: str) -> Iterator[HistoryItem]:
+    # Rows are converted a chunk at a time, never holding the whole export
+    with open_text_export(data_path) as f:
         data_reader = csv.reader(f, delimiter="\t")
-        data = [row for row in data_reader]
-
-    raw_history = []
-    for entry in data:
-        (
-            url,
-            host,
-            domain,
-            visit_time,
-            visit_time_string,
-            day_of_visit,
-            transition,
-            title,
-        ) = entry
-        history_item = HistoryItem(
-            url=url,
-            title=title,
-            visit_count=1,
-            last_visit_time=visit_time_string,
-            last_visit_time_datetime=convert_chrome_time(visit_time),
-        )
-        raw_history.append(history_item)
-
-    return raw_history
-
-
-def get_chromium_history(data_path: str) -> List[HistoryItem]:
+        while True:
+            data = list(islice(data_reader, TSV_CHUNK_SIZE))
+            if not data:
+                break
+            visit_datetimes = convert_chrome_times([entry[3] for entry in data])
+            for entry, visit_datetime in zip(data, visit_datetimes):
+                (
+                    url,
+                    host,
+                    domain,
+                    visit_time,
+                    visit_time_string,
+                    day_of_visit,
+                    transition,
+                    title,
+                ) = entry
+                yield HistoryItem(
+                    url=url,
+                    title=title,
+                    visit_count=1,
+                    last_visit_time=visit_time_string,
+                    last_visit_time_datetime=visit_datetime,
+                )
+
+
+def get_ingest_state_path(data_path: str) -> str:
+    profile_key = hashlib.sha1(os.path.abspath(data_path).encode()).hexdigest()[:16]
+    return os.path.join(INGEST_STATE_DIR, f"state_{profile_key}.json")
+
+
+def get_ingest_segment_dir(data_path: str) -> str:
+    profile_key = hashlib.sha1(os.path.abspath(data_path).encode()).hexdigest()[:16]
+    return os.path.join(INGEST_STATE_DIR, profile_key)
+
+
+def load_ingest_state(data_path: str) -> Optional[IngestState]:
+    state_path = get_ingest_state_path(data_path)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    # States that held the whole history predate its segments, and the segments
+    # are dropped when the cache format changes, so the history is ingested again
+    if "search_history" in state or load_ingested_history(data_path) is None:
+        return None
+    return state
+
+
+def save_ingest_state(data_path: str, state: IngestState) -> None:
+    os.makedirs(INGEST_STATE_DIR, exist_ok=True)
+    state_path = get_ingest_state_path(data_path)
+    # Write to a temporary file first so an interrupted run keeps the old state
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def load_ingested_history(data_path: str) -> Optional[SegmentedSearchHistory]:
+    """The search history ingested so far from a profile, newest first, decoded lazily."""
+    return load_segments(get_ingest_segment_dir(data_path))
+
+
+def append_ingested_history(
+    data_path: str, new_search_history: List[SearchHistoryItem]
+) -> Optional[threading.Thread]:
+    """
+    Appends newly ingested records as a segment. Only the mark in the state
+    file and this segment are written, however long the history is.
+    """
+    return append_segment(
+        new_search_history,
+        replace_revisited=data_path != "htu_sync",
+        segment_dir=get_ingest_segment_dir(data_path),
+        retention=False,
+    )
+
+
+def get_chromium_history_db(data_path: str) -> str:
     if not os.path.exists(data_path):
         raise FileNotFoundError(f"The specified path does not exist: {data_path}")
-    history_db = os.path.join(data_path, "History")
-
-    copied_db = os.path.join(data_path, "Copied_History")
-    shutil.copyfile(history_db, copied_db)
-
-    c = sqlite3.connect(copied_db)
-    cursor = c.cursor()
-    query = "SELECT url, title, visit_count, last_visit_time FROM urls ORDER BY last_visit_time DESC"
-
-    cursor.execute(query)
-    data = cursor.fetchall()
-    cursor.close()
-    c.close()
-
-    raw_history = []
-    for entry in data:
-        url, title, visit_count, last_visit_time = entry
-        history_item = HistoryItem(
-            url=url,
-            title=title,
-            visit_count=int(visit_count),
-            last_visit_time=last_visit_time,
-            last_visit_time_datetime=convert_chrome_time(last_visit_time),
-        )
-        raw_history.append(history_item)
-
-    return raw_history
-
-
-def get_json_history(data_path: str) -> List[HistoryItem]:
-    with open(data_path, "r") as f:
-        data = json.load(f)
+    return os.path.join(data_path, "History")
+
+
+def get_chromium_history(
+    data_path: str, candidates_only: bool = False
+) -> Iterator[HistoryItem]:
+    """
+    With candidates_only, only the URLs that may be searches are read
+    (see rules.get_search_candidate_filter).
+    """
+    predicate, parameters = get_search_candidate_filter() if candidates_only else ("1", [])
+    query = f"""
+    SELECT url, title, visit_count, last_visit_time FROM urls
+    WHERE {predicate}
+    ORDER BY last_visit_time DESC
+    """
+    return iter_chromium_history(get_chromium_history_db(data_path), query, tuple(parameters))
+
+
+def get_incremental_chromium_history(
+    data_path: str,
+    high_water_mark: Optional[Tuple[int, int]] = None,
+    candidates_only: bool = False,
+) -> Tuple[Iterator[HistoryItem], Tuple[int, int]]:
+    """
+    Returns only the rows of the `urls` table that were visited after the
+    given (last_visit_time, id) high-water mark, along with the new mark.
+
+    Chromium keeps one row per URL and bumps its last_visit_time on every
+    revisit, so revisited URLs are returned again and should replace their
+    previous entry when merged.
+    """
+    last_visit_time, last_id = high_water_mark if high_water_mark else (0, 0)
+    predicate, parameters = get_search_candidate_filter() if candidates_only else ("1", [])
+    query = f"""
+    SELECT url, title, visit_count, last_visit_time FROM urls
+    WHERE (last_visit_time > ? OR (last_visit_time = ? AND id > ?)) AND {predicate}
+    ORDER BY last_visit_time DESC
+    """
+    history = iter_marked_chromium_history(
+        get_chromium_history_db(data_path),
+        query,
+        (last_visit_time, last_visit_time, last_id, *parameters),
+    )
+    newest = next(history)
+    new_high_water_mark = (int(newest[0]), int(newest[1])) if newest else (last_visit_time, last_id)
+    return history, new_high_water_mark
+
+
+def iter_marked_chromium_history(
+    history_db: str, query: str, parameters: Tuple = ()
+) -> Iterator[Any]:
+    """
+    Yields the newest (last_visit_time, id) of the `urls` table (None when
+    it is empty), then the history items of the query, read on one connection.
+
+    The mark is read first: rows written after it are picked up again next run.
+    """
+    with open_history_database(history_db) as c:
+        yield c.execute(
+            "SELECT last_visit_time, id FROM urls ORDER BY last_visit_time DESC, id DESC LIMIT 1"
+        ).fetchone()
+        yield from iter_history_items(c.execute(query, parameters))
+
+
+def get_chromium_context(
+    data_path: str, url: str, context_window: int = 3
+) -> Iterator[HistoryItem]:
+    """
+    Reads the history around the last visit of a URL straight from the
+    database: the `context_window` newer rows, the visit itself and the
+    `context_window` older rows, newest first.
+    """
+    query = """
+    SELECT * FROM (
+        SELECT url, title, visit_count, last_visit_time FROM urls
+        WHERE last_visit_time > (SELECT last_visit_time FROM urls WHERE url = ?)
+        ORDER BY last_visit_time ASC LIMIT ?
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT url, title, visit_count, last_visit_time FROM urls
+        WHERE last_visit_time <= (SELECT last_visit_time FROM urls WHERE url = ?)
+        ORDER BY last_visit_time DESC LIMIT ?
+    )
+    ORDER BY last_visit_time DESC
+    """
+    history = iter_chromium_history(
+        get_chromium_history_db(data_path),
+        query,
+        (url, context_window, url, context_window + 1),
+    )
+    return clean_history(history)
+
+
+def get_chromium_pages(
+    data_path: str, start_time: datetime, end_time: datetime
+) -> Iterator[HistoryItem]:
+    """
+    Reads the rows that can never be searches (those outside the candidate
+    filter) last visited between two times, oldest first: the pages a store
+    of search candidates leaves out.
+    """
+    predicate, parameters = get_search_candidate_filter()
+    query = f"""
+    SELECT url, title, visit_count, last_visit_time FROM urls
+    WHERE NOT {predicate} AND last_visit_time BETWEEN ? AND ?
+    ORDER BY last_visit_time ASC
+    """
+    history = iter_chromium_history(
+        get_chromium_history_db(data_path),
+        query,
+        (*parameters, get_chrome_time(start_time), get_chrome_time(end_time)),
+    )
+    return clean_history(history)
+
+
+def iter_chromium_history(
+    history_db: str, query: str, parameters: Tuple = ()
+) -> Iterator[HistoryItem]:
+    with open_history_database(history_db) as c:
+        yield from iter_history_items(c.execute(query, parameters))
+
+
+def iter_history_items(cursor: sqlite3.Cursor) -> Iterator[HistoryItem]:
+    """The rows of a (url, title, visit_count, last_visit_time) query as history items."""
+    for rows in iter_cursor_batches(cursor):
+        visit_datetimes = convert_chrome_times([row[3] for row in rows])
+        for (url, title, visit_count, last_visit_time), visit_datetime in zip(
+            rows, visit_datetimes
+        ):
+            yield HistoryItem(
+                url=url,
+                title=title,
+                visit_count=int(visit_count),
+                last_visit_time=last_visit_time,
+                last_visit_time_datetime=visit_datetime,
+            )
+
+
+def iter_json_array(f: TextIO, read_size: int = JSON_READ_SIZE) -> Iterator[Any]:
+    """
+    Yields the elements of a top-level JSON array as they are parsed, reading
+    the file `read_size` characters at a time instead of loading it whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    opened = False
+    eof = False
+    while True:
+        # Skip the whitespace and commas between elements
+        next_token = JSON_ARRAY_TOKEN.search(buffer, position)
+        position = next_token.start() if next_token else len(buffer)
+        if position < len(buffer):
+            if not opened:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number at the very end of the buffer may continue in the next read
+                if end < len(buffer) or eof:
+                    yield item
+                    position = end
+                    continue
+        if eof:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = f.read(read_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def get_json_history(data_path: str) -> Iterator[HistoryItem]:
+    """
+    Streams the entries of a JSON array export, or of an NDJSON export with
+    one entry per line.
+    """
+    with open_text_export(data_path) as f:
+        if data_path.endswith(NDJSON_SUFFIXES):
+            entries: Iterator[Any] = (json.loads(line) for line in f if line.strip())
+        else:
+            entries = iter_json_array(f)
         # add last_visit_time_datetime
-        for entry in data:
+        for entry in entries:
             entry["last_visit_time_datetime"] = convert_chrome_time(
                 entry["last_visit_time"]
             )
-        return data
+            yield entry
 
 
-def remove_invalid_history(history: List[HistoryItem]) -> List[HistoryItem]:
+def remove_invalid_history(history: Iterable[HistoryItem]) -> Iterator[HistoryItem]:
     def is_valid_history_item(item: HistoryItem) -> bool:
         stat = item["last_visit_time_datetime"].year != 1600
         return stat
-    return [
+    return (
         item
         for item in history
         if is_valid_history_item(item)
-    ]
+    )
 
-def update_last_visit_time(history: List[HistoryItem]) -> List[HistoryItem]:
+def update_last_visit_time(history: Iterable[HistoryItem]) -> Iterator[HistoryItem]:
     for item in history:
         item["last_visit_time"] = item["last_visit_time_datetime"].strftime('%Y-%m-%d %H:%M:%S')
-    return history
+        yield item
+
+def clean_history(raw_history: Iterable[HistoryItem]) -> Iterator[HistoryItem]:
+    history = update_last_visit_time(raw_history)
+    return remove_invalid_history(history)
 
-def get_history(data_path: str) -> List[HistoryItem]:
+
+def is_chromium_profile(data_path: str) -> bool:
+    return data_path != "htu_sync" and not data_path.endswith(
+        TSV_SUFFIXES + JSON_SUFFIXES
+    )
+
+
+def supports_incremental(data_path: str) -> bool:
+    return data_path == "htu_sync" or is_chromium_profile(data_path)
+
+
+def get_history(data_path: str, candidates_only: bool = False) -> Iterator[HistoryItem]:
+    raw_history: Iterable[HistoryItem]
     if data_path == "htu_sync":
         raw_history = get_htu_history()
-    elif data_path.endswith(".tsv"):
+    elif data_path.endswith(TSV_SUFFIXES):
         raw_history = get_tsv_history(data_path)
-    elif data_path.endswith(".json"):
+    elif data_path.endswith(JSON_SUFFIXES):
         raw_history = get_json_history(data_path)
     else:
-        raw_history = get_chromium_history(data_path)
-    history = update_last_visit_time(raw_history)
-    return remove_invalid_history(history)
+        raw_history = get_chromium_history(data_path, candidates_only)
+    return clean_history(raw_history)
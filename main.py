@@ -1,41 +1,143 @@
 import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from pyfzf.pyfzf import FzfPrompt   # type: ignore
 
 from config import HISTORY_DATABASE_PATHS, HTU_PROFILE_PATH
 from extract import get_random_search_url, get_search_entry_by_datetime
-from load import get_history, save_cache
-from process import get_search_history
+from load import (
+    append_ingested_history,
+    get_history,
+    get_source_fingerprint,
+    load_ingest_state,
+    load_ingested_history,
+    load_processed_cache,
+    save_cache,
+    save_ingest_state,
+    save_processed_cache,
+    supports_incremental,
+)
+from process import get_search_history, merge_search_histories, seed_dedup_index
+from store import HistoryStore
 from show import (
     dive_into_search_context,
     fzf_search_queries,
     interact_with_user_for_search_data
 )
+from watch import get_new_search_history, watch_search_history
+
+def get_incremental_search_history(data_path):
+    """
+    Processes only the history added since the last incremental run for this
+    source and returns it along with the search history processed before.
+    """
+    return update_ingest_state(data_path)[1]
+
+def update_ingest_state(data_path):
+    """
+    Ingests the history added since the last incremental run and returns the
+    new state and the whole search history ingested, newest first.
+    """
+    state = load_ingest_state(data_path)
+    search_history = load_ingested_history(data_path) if state else None
+    new_search_history, last_visit_time, last_id = get_new_search_history(
+        data_path,
+        state["last_visit_time"] if state else None,
+        state["last_id"] if state else 0,
+        seed_dedup_index(search_history, newest_first=True) if search_history else None,
+    )
+    print(f"Ingested {len(new_search_history)} new history items.")
+
+    # The records are appended before the mark moves past them
+    append_ingested_history(data_path, new_search_history)
+    state = {"data_path": data_path, "last_visit_time": last_visit_time, "last_id": last_id}
+    save_ingest_state(data_path, state)
+    return state, load_ingested_history(data_path) or []
 
 def process_history(browser_choice, data_path, args):
     print(f"Processing history from {browser_choice} database...")
-    history = get_history(data_path)
+    if args.watch:
+        if supports_incremental(data_path):
+            # Catch up from the last incremental run, then follow new visits
+            watch_search_history(data_path, *update_ingest_state(data_path))
+            return
+        print("Watch mode is only available for Chromium profiles and HTU sync.")
+    if args.incremental and supports_incremental(data_path):
+        search_history = get_incremental_search_history(data_path)
+    else:
+        if args.incremental:
+            print("Incremental mode is only available for Chromium profiles and HTU sync.")
+        search_history = load_search_history(data_path)
+    show_search_history(search_history, data_path, args)
+
+def load_search_history(data_path):
+    """
+    Loads and classifies a source, unless neither the source nor the rules
+    changed since the last run, in which case the processed cache is used.
+    """
+    fingerprint = get_source_fingerprint(data_path)
+    if fingerprint is not None:
+        search_history = load_processed_cache(data_path, fingerprint)
+        if search_history is not None:
+            print("Nothing changed since the last run, using the processed history.")
+            return search_history
+
+    # Only URLs that may be searches are read, context is fetched on demand
+    history = get_history(data_path, candidates_only=True)
     search_history = get_search_history(history)
+    if fingerprint is not None:
+        save_processed_cache(data_path, fingerprint, search_history)
+    return search_history
+
+def process_all_histories(args):
+    """
+    Processes every available source at once, each in its own process, and
+    merges them into a single timeline.
+    """
+    available_sources = get_available_sources()
+    if not available_sources:
+        print("No available sources found. Exiting...")
+        exit(1)
+    print(f"Processing history from {', '.join(available_sources)}...")
+
+    search_histories = []
+    with ProcessPoolExecutor(max_workers=len(available_sources)) as executor:
+        futures = {
+            source: executor.submit(load_search_history, get_data_path(source))
+            for source in available_sources
+        }
+        for source, future in futures.items():
+            try:
+                search_histories.append(future.result())
+            except (OSError, sqlite3.Error, ValueError) as e:
+                print(f"Skipping {source}: {e}")
+
+    search_history = merge_search_histories(search_histories)
+    show_search_history(search_history, None, args)
 
+def show_search_history(search_history, data_path, args):
+    # Every view reads from this store from here on
+    store = HistoryStore(search_history, data_path)
     if args.random:
-        random_url = get_random_search_url(search_history)
+        random_url = get_random_search_url(store.searches)
         if random_url:
-            dive_into_search_context(random_url)
+            dive_into_search_context(random_url, store)
     elif args.date:
-        search_entry = get_search_entry_by_datetime(search_history, args.date)
+        search_entry = get_search_entry_by_datetime(store.searches, args.date)
         if search_entry:
-            dive_into_search_context(search_entry)
+            dive_into_search_context(search_entry, store)
         else:
             print(f"No entries found for {args.date}")
     elif args.fzf:
-        fzf_search_queries(search_history)
+        fzf_search_queries(store)
     else:
-        interact_with_user_for_search_data(search_history)
+        interact_with_user_for_search_data(store)
 
 def process_test_history():
     history = get_history("tests/mock_history_simple.json")
     search_history = get_search_history(history)
     save_cache(search_history)
-    interact_with_user_for_search_data(search_history)
+    interact_with_user_for_search_data(HistoryStore(search_history))
 
 def get_available_sources():
     available_sources = []
@@ -3,224 +3,148 @@ This module contains functions for processing search history data:
 - adding search metadata to history
 - cleaning up search history
 - getting search engine percentages
+- merging incrementally processed search history
 """
 
-from collections import Counter
+import heapq
 from datetime import datetime, timedelta
-from typing import Any, Dict, List
-from urllib.parse import parse_qs, unquote, urlparse
-
-from config import (
-    CHAT_BASED_SEARCH_COMPLEMENTS,
-    INCLUDED_SEARCH_SYSTEMS,
-    LANDING_PAGE_ONLY_SEARCH_SYSTEMS,
-    SITE_SEARCH_DOMAINS,
-    SKIP_DOMAINS,
-)
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import unquote
+
+from aggregate import EngineShares, HistoryColumns, aggregate_engine_shares
+from dedup import DedupIndex, normalize_url
+from rules import UrlClassification, compile_rules
+from records import SearchRecord
 from sp_types import HistoryItem, ScopedHistory, SearchHistoryItem
-from utils import (
-    convert_chrome_time,
-    get_filtered_history,
-    get_time_diff,
-    get_total_timespan_logged,
-)
+from urls import ParsedURL, get_parsed_url, parse_url
+from utils import TimeIndex, get_filtered_history, get_total_timespan_logged
 
 
-def perplexity_cleanup(url, temp_history: List[HistoryItem]):
+def perplexity_cleanup(
+    url, dedup_index: DedupIndex, parsed_url: Optional[ParsedURL] = None
+):
     """Returns false for perplexity cleanup pairs, true if the addition is countable."""
-    if len(temp_history) <= 1:
+    # Nothing to pair with; a single recent candidate is still checked below
+    if not dedup_index:
         return True
-    if url.replace("www.", "") == temp_history[-1]["url"].replace("www.", ""):
+    if normalize_url(url) == dedup_index.last().normalized_url:
+        return False
+    # Perplexity redirects a search to another URL for it, moments later
+    if any("perplexity.ai" in entry.url for entry in dedup_index.recent(3)):
+        return False
+    if dedup_index.contains_url(url):
         return False
 
-    if not any("perplexity.ai" in entry["url"] for entry in temp_history[-3:]):
-        if url not in {entry["url"] for entry in temp_history}:
-            return True
-
-    # Parse the URLs to compare their base parts and query parameters
-    last_url_parsed = urlparse(temp_history[-1]["url"])
-    current_url_parsed = urlparse(url)
-
-    # Remove query parameters to just compare the base URL
-    last_url_base = last_url_parsed._replace(query="").geturl()
-    current_url_base = current_url_parsed._replace(query="").geturl()
-
-    # Check if the base URLs are the same after removing the trailing slash if any
-    if last_url_base.rstrip("/") == current_url_base.rstrip("/"):
-        # Compare the query parameters
-        last_url_query = parse_qs(last_url_parsed.query)
-        current_url_query = parse_qs(current_url_parsed.query)
-
-        # Remove 'copilot' parameter from the current URL's query if it exists
-        current_url_query.pop("copilot", None)
-
-        # If the query parameters are the same after removing 'copilot', return False
-        last_url_q = last_url_query.get("q", [""])[0].replace("+", "%20")
-        current_url_q = current_url_query.get("q", [""])[0].replace("+", "%20")
-        if last_url_q == current_url_q:
-            return False
-        else:
-            return False
-
-    if is_guid_version_of_query(url, temp_history[-1]["url"]):
+    # The same query on the same engine, e.g. with a 'copilot' parameter added
+    parsed_url = parsed_url or parse_url(url)
+    search_query = parsed_url.params.get("q", [None])[0]
+    if search_query and dedup_index.contains_query(parsed_url.engine, search_query):
         return False
-    return False
+    return True
 
 
 SITE_SPECIFIC_SEARCH_CLEANUP = {"https://www.perplexity.ai/search/": perplexity_cleanup}
 
+# Every rule is compiled into one matcher, once, when the module is loaded
+URL_RULES = compile_rules(SITE_SPECIFIC_SEARCH_CLEANUP)
 
-def is_landing_page(url):
-    for item in INCLUDED_SEARCH_SYSTEMS:
-        if url == item:
-            return True
-    return False
 
+def classify(url: str) -> UrlClassification:
+    return URL_RULES.classify(url)
 
-def is_included_search_system(url):
-    """This captures urls that may not have query params."""
-    for item in INCLUDED_SEARCH_SYSTEMS:
-        if url.startswith(item):
-            return True
-    return False
 
-
-def cleanup(url, temp_history):
-    for key, cleanup in SITE_SPECIFIC_SEARCH_CLEANUP.items():
-        if url.startswith(key):
-            return cleanup(url, temp_history)
-    else:
+def cleanup(
+    url,
+    dedup_index: DedupIndex,
+    classification: Optional[UrlClassification] = None,
+    parsed_url: Optional[ParsedURL] = None,
+):
+    cleanup_site = (classification or classify(url)).cleanup_site
+    if cleanup_site is None:
         return True
+    return SITE_SPECIFIC_SEARCH_CLEANUP[cleanup_site](url, dedup_index, parsed_url)
 
 
-def update_temp_history(temp_history, url, title, visit_count, last_visit_time):
-    visit_time = convert_chrome_time(last_visit_time)
-    if temp_history and url.split("?")[0] == temp_history[-1]["url"].split("?")[0]:
-        time_diff = get_time_diff(visit_time, temp_history[-1]["last_visit_time_raw"])
-        if time_diff.total_seconds() <= 1:
-            return temp_history
-
-    temp_history.append(
-        {
-            "url": url,
-            "title": title,
-            "visit_count": visit_count,
-            "last_visit_time": visit_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "last_visit_time_raw": last_visit_time,
-        }
-    )
-    return temp_history
-
-
-def is_likely_countable_search_url(temp_history, url, visit_count):
+def is_likely_countable_search_url(
+    dedup_index: DedupIndex,
+    url,
+    visit_count,
+    classification: Optional[UrlClassification] = None,
+    parsed_url: Optional[ParsedURL] = None,
+):
     """
     Determines if a URL should be kept based on various criteria.
 
+    :param dedup_index: The recent candidate searches.
     :param url: The URL to check.
     :param visit_count: The visit count of the URL.
+    :param classification: The URL's classification, if it is already known.
+    :param parsed_url: The parsed URL, if it is already known.
     :return: True if the URL should be kept, False otherwise.
     """
-    # Define a list of common search engine query patterns
-    search_patterns = [
-        "search?q=",  # Common for many search engines like Google
-        "search/web?q=",  # Another common pattern
-        "query=",  # Used by some search engines
-        "search?p=",  # Yahoo
-        "q=",  # Short and common, but be careful as it might match non-search URLs
-    ]
-
-    site_specific_search_exclusion_rule = {
-        # this is how Google safeloads URLs from Gmail, perhaps?
-        "https://www.google.com/": "https://www.google.com/url?q=",
-    }
-
-    site_specific_search_inclusion_rule = {
-        "https://www.tiktok.com": "https://www.tiktok.com/search?q=",
-        "https://www.perplexity.ai": "https://www.perplexity.ai/search",
-    }
-
-    if is_included_search_system(url):
-        return True
-    if visit_count > 0 and any(pattern in url for pattern in search_patterns):
-        for site, pattern in site_specific_search_inclusion_rule.items():
-            if url.startswith(site) and not url.startswith(pattern):
-                return False
-        for site, pattern in site_specific_search_exclusion_rule.items():
-            if url.startswith(site) and url.startswith(pattern):
-                return False
-        for skip_domain in SKIP_DOMAINS:
-            if url.startswith(skip_domain):
-                return False
-            if skip_domain.startswith("*"):
-                if skip_domain.replace("*", "") in url:
-                    return False
-        for key, cleanup in SITE_SPECIFIC_SEARCH_CLEANUP.items():
-            if url.startswith(key):
-                return cleanup(url, temp_history)
+    classification = classification or classify(url)
+    if classification.included_search_system:
         return True
+    if visit_count > 0 and classification.matches_search_pattern:
+        if classification.excluded:
+            return False
+        return cleanup(url, dedup_index, classification, parsed_url)
     return False
 
 
 def add_search_metadata_to_history(
-    history: List[HistoryItem], full_history: bool = False
+    history: Iterable[HistoryItem],
+    full_history: bool = False,
+    dedup_index: Optional[DedupIndex] = None,
 ) -> List[SearchHistoryItem]:
-    temp_history: List[HistoryItem] = []
+    """
+    dedup_index can be passed to classify the history against the candidate
+    searches of history classified before (see seed_dedup_index).
+    """
+    dedup_index = DedupIndex() if dedup_index is None else dedup_index
     search_history = []
     for entry in history:
-        updated_entry: SearchHistoryItem = {
-            **entry,
-            "included_search_entry": False,
-            "search_query": None,
-            "search_engine": None,
-            "search_label": None,
-            "default_visible": True,
-        }
-        if not is_likely_countable_search_url(temp_history, entry["url"], entry["visit_count"]):
+        updated_entry = SearchRecord(
+            entry["url"], entry["title"], entry["visit_count"], entry["last_visit_time_datetime"]
+        )
+        url = entry["url"]
+        # Parsed once here and reused by the views and exports
+        parsed_url = updated_entry.parsed_url
+        timestamp = updated_entry.timestamp
+        dedup_index.evict(timestamp)
+        classification = classify(url)
+        if not is_likely_countable_search_url(
+            dedup_index, url, entry["visit_count"], classification, parsed_url
+        ):
             search_history.append(updated_entry)
             continue
-        url = entry["url"]
-        parsed_url = urlparse(url)
-        query = parse_qs(parsed_url.query)
-        if "q" in query:
-            updated_entry["search_query"] = unquote(query["q"][0])
-        elif "query" in query:
-            updated_entry["search_query"] = unquote(query["query"][0])
-        elif "p" in query:
-            updated_entry["search_query"] = unquote(query["p"][0])
-        elif is_included_search_system(url):
-            for site in CHAT_BASED_SEARCH_COMPLEMENTS:
-                if url.startswith(site):
-                    updated_entry["search_label"] = "chat-based-search-complement"
-                    updated_entry["search_query"] = "..."
-                    break
+        search_query = classification.query_extractor.extract(parsed_url.query)
+        if search_query is not None:
+            updated_entry["search_query"] = unquote(search_query)
+        elif classification.included_search_system:
+            if classification.chat_based_search_complement:
+                updated_entry["search_label"] = "chat-based-search-complement"
             else:
                 updated_entry["search_label"] = "not-url-based"
-                updated_entry["search_query"] = "..."
+            updated_entry["search_query"] = "..."
         else:
             updated_entry["search_query"] = None
 
-        if any(url.startswith(site) for site in SITE_SEARCH_DOMAINS):
+        if classification.site_search:
             updated_entry["search_label"] = "site_search"
-        if not cleanup(url, temp_history):
+        if not cleanup(url, dedup_index, classification, parsed_url):
             updated_entry["search_label"] = "redirect"
 
         if "search_query" in updated_entry and updated_entry["search_query"]:
-            updated_entry["search_engine"] = parsed_url.netloc.replace("www.", "")
-        if "search_query" in updated_entry:
-            temp_history = update_temp_history(
-                temp_history,
-                url,
-                updated_entry["title"],
-                updated_entry["visit_count"],
-                updated_entry["last_visit_time"],
-            )
-        if is_landing_page(url):
+            updated_entry["search_engine"] = parsed_url.engine
+        dedup_index.add(url, timestamp, parsed_url.engine, search_query)
+        if classification.landing_page:
             updated_entry["search_label"] = "landing_page"
         
         if updated_entry["search_label"] in ["redirect"]:
             updated_entry["included_search_entry"] = False
         elif updated_entry["search_label"] == "landing_page":
-            if url in LANDING_PAGE_ONLY_SEARCH_SYSTEMS:
+            if classification.landing_page_only:
                 updated_entry["included_search_entry"] = True
                 updated_entry["search_label"] = "landing_page_only_search_system"
             else:
@@ -242,10 +166,11 @@ def is_guid_version_of_query(url, url_to_check_against):
     return hyphenated_url_query.startswith(url_string_to_check_against)
 
 
-def get_history_by_month(
-    search_history: List[SearchHistoryItem], month_num: int = 0
-) -> ScopedHistory:
-    current_date = datetime.now()
+def get_month_dates(
+    month_num: int = 0, current_date: Optional[datetime] = None
+) -> Tuple[datetime, datetime]:
+    """The first and last day of the month month_num months before current_date's."""
+    current_date = datetime.now() if current_date is None else current_date
 
     # Calculate the target year and month considering month_num
     target_year = current_date.year - (month_num // 12)
@@ -260,14 +185,52 @@ def get_history_by_month(
     end_date = (start_date.replace(day=28) + timedelta(days=4)).replace(
         day=1
     ) - timedelta(days=1)
+    return start_date, end_date
+
+
+def get_week_dates(
+    week_num: int = 0, start_on_monday: bool = True, current_date: Optional[datetime] = None
+) -> Tuple[datetime, datetime]:
+    """The first and last day of the week week_num weeks before current_date's."""
+    current_date = datetime.now() if current_date is None else current_date
+
+    # Adjust the start day of the week based on user preference
+    if start_on_monday:
+        start_day_adjustment = (current_date.weekday() + 7) % 7
+
+    else:  # If start_on_monday is False, the week starts on Sunday
+        start_day_adjustment = (current_date.weekday() + 1) % 7
+
+    week_start_day = current_date - timedelta(days=start_day_adjustment)
+
+    start_date = week_start_day - timedelta(days=7 * week_num)
+    end_date = start_date + timedelta(days=6)
+    return start_date, end_date
+
+
+def get_history_by_month(
+    search_history: List[SearchHistoryItem],
+    month_num: int = 0,
+    total_timespan_periods_logged: Optional[int] = None,
+    time_index: Optional[TimeIndex] = None,
+) -> ScopedHistory:
+    start_date, end_date = get_month_dates(month_num)
 
     month_search_data: ScopedHistory = {
         "start_date": start_date,
         "end_date": end_date,
-        "search_history": get_filtered_history(search_history, start_date, end_date),
+        "search_history": (
+            time_index.get_filtered_history(start_date, end_date)
+            if time_index is not None
+            else get_filtered_history(search_history, start_date, end_date)
+        ),
         "timespan_period_num": month_num,
-        "total_timespan_periods_logged": get_total_timespan_logged(
-            search_history, "month"
+        "total_timespan_periods_logged": (
+            total_timespan_periods_logged
+            if total_timespan_periods_logged is not None
+            else time_index.get_total_timespan_logged("month")
+            if time_index is not None
+            else get_total_timespan_logged(search_history, "month")
         ),
     }
     return month_search_data
@@ -277,92 +240,227 @@ def get_history_by_week(
     search_history: List[SearchHistoryItem],
     week_num: int = 0,
     start_on_monday: bool = True,
+    total_timespan_periods_logged: Optional[int] = None,
+    time_index: Optional[TimeIndex] = None,
 ) -> ScopedHistory:
-    current_date = datetime.now()
-
-    # Adjust the start day of the week based on user preference
-    if start_on_monday:
-        start_day_adjustment = (current_date.weekday() + 7) % 7
-
-    else:  # If start_on_monday is False, the week starts on Sunday
-        start_day_adjustment = (current_date.weekday() + 1) % 7
-
-    week_start_day = current_date - timedelta(days=start_day_adjustment)
-
-    start_date = week_start_day - timedelta(days=7 * week_num)
-    end_date = start_date + timedelta(days=6)
+    start_date, end_date = get_week_dates(week_num, start_on_monday)
 
     week_search_data: ScopedHistory = {
         "timespan_period_num": week_num,
         "start_date": start_date,
         "end_date": end_date,
-        "search_history": get_filtered_history(search_history, start_date, end_date),
-        "total_timespan_periods_logged": get_total_timespan_logged(
-            search_history, "week", start_on_monday
+        "search_history": (
+            time_index.get_filtered_history(start_date, end_date)
+            if time_index is not None
+            else get_filtered_history(search_history, start_date, end_date)
+        ),
+        "total_timespan_periods_logged": (
+            total_timespan_periods_logged
+            if total_timespan_periods_logged is not None
+            else time_index.get_total_timespan_logged("week", start_on_monday)
+            if time_index is not None
+            else get_total_timespan_logged(search_history, "week", start_on_monday)
         ),
     }
     return week_search_data
 
 
-def get_search_engine_percentages(
+def get_scoped_history(
     search_history: List[SearchHistoryItem],
     week_num: int = 0,
     start_on_monday: bool = True,
     full_history: bool = False,
     by_month: bool = False,
     month_num: int = 0,
-    hide_complements: bool = True,
-) -> Dict[str, Any]:
+    total_timespan_periods_logged: Optional[int] = None,
+    time_index: Optional[TimeIndex] = None,
+) -> ScopedHistory:
     if full_history:
-        scoped_history: ScopedHistory = {
+        return {
             "search_history": search_history,
             "start_date": search_history[0]["last_visit_time_datetime"],
             "end_date": search_history[-1]["last_visit_time_datetime"],
             "timespan_period_num": 0,
-            "total_timespan_periods_logged": get_total_timespan_logged(
-                search_history, "day"
+            "total_timespan_periods_logged": (
+                total_timespan_periods_logged
+                if total_timespan_periods_logged is not None
+                else time_index.get_total_timespan_logged("day")
+                if time_index is not None
+                else get_total_timespan_logged(search_history, "day")
             ),
         }
-    elif by_month:
-        scoped_history = get_history_by_month(search_history, month_num)
-    else:
-        scoped_history = get_history_by_week(search_history, week_num, start_on_monday)
-    search_engines: Dict[str, int] = Counter()
-    for entry in scoped_history["search_history"]:
-        # These are entries that will be visible in the search history log but not counted
-        # toward the search engine percentages
-        if entry["search_label"] == "site_search":
-            entry["default_visible"] = False
-            continue
-        if hide_complements and entry["search_label"] == "chat-based-search-complement":
-            entry["default_visible"] = False
-            continue
-        if entry["included_search_entry"] and entry["search_engine"]:
-            search_engines[entry["search_engine"]] += 1
-    
-    total_searches = sum(search_engines.values())
-
-    sorted_search_engines = sorted(
-        search_engines.items(),
-        key=lambda x: (x[1] / total_searches) * 100,
-        reverse=True,
+    if by_month:
+        return get_history_by_month(
+            search_history, month_num, total_timespan_periods_logged, time_index
+        )
+    return get_history_by_week(
+        search_history, week_num, start_on_monday, total_timespan_periods_logged, time_index
     )
 
-    sorted_search_engines = [(engine, count) for engine, count in sorted_search_engines]
 
+def get_search_engine_data(
+    scoped_history: ScopedHistory,
+    label: str,
+    engine_shares: EngineShares,
+    hide_complements: bool = True,
+) -> Dict[str, Any]:
     return {
-        "label": "month" if by_month else "day" if full_history else "week",
+        "label": label,
         "start_date": scoped_history["start_date"],
         "end_date": scoped_history["end_date"],
-        "total_searches": total_searches,
+        "total_searches": engine_shares.total_searches,
         "search_history": scoped_history["search_history"],
-        "search_engines": sorted_search_engines,
+        "search_engines": engine_shares.search_engines,
+        "shares": engine_shares.shares,
+        # The search log hides what was not counted (see aggregate.is_default_visible)
+        "hide_complements": hide_complements,
         "total_timespan_periods_logged": scoped_history[
             "total_timespan_periods_logged"
         ],
     }
 
 
-def get_search_history(history: List[HistoryItem]) -> List[SearchHistoryItem]:
-    search_history = add_search_metadata_to_history(history)
+def get_search_engine_percentages(
+    search_history: List[SearchHistoryItem],
+    week_num: int = 0,
+    start_on_monday: bool = True,
+    full_history: bool = False,
+    by_month: bool = False,
+    month_num: int = 0,
+    hide_complements: bool = True,
+    total_timespan_periods_logged: Optional[int] = None,
+    time_index: Optional[TimeIndex] = None,
+) -> Dict[str, Any]:
+    """
+    total_timespan_periods_logged can be passed when it is already known for
+    the history, to skip computing it again, and time_index when the history
+    is indexed, to find the records of a week or month by bisection.
+
+    The records are left as they are: site searches, and chat-based search
+    complements when hide_complements is set, are not counted, and the search
+    log hides them when it shows them.
+    """
+    scoped_history = get_scoped_history(
+        search_history,
+        week_num,
+        start_on_monday,
+        full_history,
+        by_month,
+        month_num,
+        total_timespan_periods_logged,
+        time_index,
+    )
+    engine_shares = aggregate_engine_shares(
+        HistoryColumns(scoped_history["search_history"]), hide_complements
+    )
+    return get_search_engine_data(
+        scoped_history,
+        "month" if by_month else "day" if full_history else "week",
+        engine_shares,
+        hide_complements,
+    )
+
+
+def get_search_history(
+    history: Iterable[HistoryItem], dedup_index: Optional[DedupIndex] = None
+) -> List[SearchHistoryItem]:
+    search_history = add_search_metadata_to_history(history, dedup_index=dedup_index)
     return search_history
+
+
+def seed_dedup_index(
+    search_history: Sequence[SearchHistoryItem], newest_first: bool = False
+) -> DedupIndex:
+    """
+    Returns a dedup index holding the candidate searches of the last
+    DEDUP_WINDOW_SECONDS of an already classified history, in chronological
+    order (as in HistoryStore.records) unless newest_first, so that the
+    duplicates and redirects that span it and history added after it are
+    still caught.
+    """
+    dedup_index = DedupIndex()
+    if not search_history:
+        return dedup_index
+    newest_entries = iter(search_history) if newest_first else reversed(search_history)
+    newest_timestamp = search_history[0 if newest_first else -1][
+        "last_visit_time_datetime"
+    ].timestamp()
+    window = []
+    for entry in newest_entries:
+        timestamp = entry["last_visit_time_datetime"].timestamp()
+        if newest_timestamp - timestamp > dedup_index.window_seconds:
+            break
+        # Only the visits that passed is_likely_countable_search_url are included or labelled
+        if entry["included_search_entry"] or entry["search_label"] is not None:
+            window.append((entry, timestamp))
+    # Oldest first, so the window is evicted from the front as newer visits come in
+    for entry, timestamp in reversed(window):
+        search_query = entry["search_query"] if entry["search_query"] != "..." else None
+        dedup_index.add(entry["url"], timestamp, get_parsed_url(entry).engine, search_query)
+    return dedup_index
+
+
+def merge_search_histories(
+    search_histories: List[List[SearchHistoryItem]], duplicate_window_seconds: float = 1
+) -> List[SearchHistoryItem]:
+    """
+    Merges the search histories of several sources into one timeline, newest
+    first, with a k-way heap merge.
+
+    The same URL logged by two sources within duplicate_window_seconds (e.g. a
+    browser profile and the HTU database synced from it) is kept only once.
+    """
+
+    def get_timestamp(entry: SearchHistoryItem) -> float:
+        return entry["last_visit_time_datetime"].timestamp()
+
+    sorted_histories = []
+    for search_history in search_histories:
+        timestamps = [get_timestamp(entry) for entry in search_history]
+        # Each source should already be newest first, but exports may not be
+        if any(newer < older for newer, older in zip(timestamps, timestamps[1:])):
+            search_history = sorted(search_history, key=get_timestamp, reverse=True)
+        sorted_histories.append(search_history)
+
+    merged_history = []
+    # The (timestamp, source) each URL was last logged with
+    last_logged: Dict[str, Tuple[float, int]] = {}
+    sources = [
+        [(source, entry) for entry in search_history]
+        for source, search_history in enumerate(sorted_histories)
+    ]
+    for source, entry in heapq.merge(
+        *sources, key=lambda pair: get_timestamp(pair[1]), reverse=True
+    ):
+        timestamp = get_timestamp(entry)
+        logged = last_logged.get(entry["url"])
+        if (
+            logged is not None
+            and logged[1] != source
+            and logged[0] - timestamp <= duplicate_window_seconds
+        ):
+            continue
+        last_logged[entry["url"]] = (timestamp, source)
+        merged_history.append(entry)
+    return merged_history
+
+
+def merge_search_history(
+    previous_search_history: List[SearchHistoryItem],
+    new_search_history: List[SearchHistoryItem],
+    replace_revisited: bool = True,
+) -> List[SearchHistoryItem]:
+    """
+    Merges newly processed entries into a previously processed search history.
+
+    Both histories are newest first and every new entry is newer than the
+    previous ones. With replace_revisited (one entry per URL, as in Chromium's
+    `urls` table), entries for a URL that was visited again are replaced by
+    the new entry; otherwise (one entry per visit, as in HTU) all are kept.
+    """
+    if not replace_revisited:
+        return new_search_history + previous_search_history
+    new_urls = {entry["url"] for entry in new_search_history}
+    return new_search_history + [
+        entry for entry in previous_search_history if entry["url"] not in new_urls
+    ]
@@ -0,0 +1,244 @@
+"""
+This module contains the compact record of a processed history item:
+- the interned tables of search engines, labels and timezones
+- the slotted record, with its visit time as an integer epoch
+- dict-style access to the record for the views, exports and caches
+
+A record keeps only what cannot be derived: the URL, title, visit count, visit
+time, search query, interned engine, label and timezone, and a byte of flags.
+The visit datetime, its formatted string and the parsed URL are derived when
+they are read.
+"""
+
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from urls import ParsedURL
+
+INCLUDED_SEARCH_ENTRY = 1
+DEFAULT_VISIBLE = 2
+
+UTC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class Interner:
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+        self.indexes: Dict[Any, int] = {}
+
+    def index(self, value: Any) -> int:
+        if value is None:
+            return -1
+        if value not in self.indexes:
+            self.indexes[value] = len(self.values)
+            self.values.append(value)
+        return self.indexes[value]
+
+    def value(self, index: int) -> Any:
+        return self.values[index] if index >= 0 else None
+
+
+# Shared by every record of the process; a record carries its names when pickled
+ENGINES = Interner()
+LABELS = Interner()
+ZONES = Interner()
+
+
+def to_epoch(visit_datetime: datetime) -> Tuple[int, int]:
+    """Returns the microseconds since the epoch and the interned timezone (-1 if naive)."""
+    if visit_datetime.tzinfo is None:
+        return (visit_datetime - NAIVE_EPOCH) // MICROSECOND, -1
+    return (visit_datetime - UTC_EPOCH) // MICROSECOND, ZONES.index(visit_datetime.tzinfo)
+
+
+def from_epoch(visit_time: int, zone: int) -> datetime:
+    if zone < 0:
+        return NAIVE_EPOCH + timedelta(microseconds=visit_time)
+    return (UTC_EPOCH + timedelta(microseconds=visit_time)).astimezone(ZONES.values[zone])
+
+
+class SearchRecord(Mapping):
+    """
+    A processed history item. Its fields can be read and set like the keys
+    of a SearchHistoryItem dict, e.g. record["search_engine"].
+    """
+
+    __slots__ = (
+        "url",
+        "title",
+        "visit_count",
+        "visit_time",
+        "zone",
+        "search_query",
+        "engine",
+        "label",
+        "flags",
+        "_parsed_url",
+    )
+
+    def __init__(
+        self,
+        url: str,
+        title: str,
+        visit_count: int,
+        visit_datetime: datetime,
+        search_query: Optional[str] = None,
+        search_engine: Optional[str] = None,
+        search_label: Optional[str] = None,
+        included_search_entry: bool = False,
+        default_visible: bool = True,
+    ) -> None:
+        self.url = url
+        self.title = title
+        self.visit_count = visit_count
+        self.visit_time, self.zone = to_epoch(visit_datetime)
+        self.search_query = search_query
+        self.engine = ENGINES.index(search_engine)
+        self.label = LABELS.index(search_label)
+        self.flags = (INCLUDED_SEARCH_ENTRY if included_search_entry else 0) | (
+            DEFAULT_VISIBLE if default_visible else 0
+        )
+        self._parsed_url: Optional[ParsedURL] = None
+
+    @classmethod
+    def from_item(cls, item: Any) -> "SearchRecord":
+        """Builds a record from a dict, or anything else with the same keys."""
+        return cls(
+            item["url"],
+            item["title"],
+            item["visit_count"],
+            item["last_visit_time_datetime"],
+            item.get("search_query"),
+            item.get("search_engine"),
+            item.get("search_label"),
+            item.get("included_search_entry", False),
+            item.get("default_visible", True),
+        )
+
+    @property
+    def visit_datetime(self) -> datetime:
+        return from_epoch(self.visit_time, self.zone)
+
+    @visit_datetime.setter
+    def visit_datetime(self, visit_datetime: datetime) -> None:
+        self.visit_time, self.zone = to_epoch(visit_datetime)
+
+    @property
+    def timestamp(self) -> float:
+        """Seconds since the epoch, comparable across records like datetime.timestamp()."""
+        if self.zone < 0:
+            return self.visit_datetime.timestamp()
+        return self.visit_time / 1000000
+
+    @property
+    def parsed_url(self) -> ParsedURL:
+        if self._parsed_url is None:
+            self._parsed_url = ParsedURL(self.url)
+        return self._parsed_url
+
+    @property
+    def search_engine(self) -> Optional[str]:
+        return ENGINES.value(self.engine)
+
+    @search_engine.setter
+    def search_engine(self, search_engine: Optional[str]) -> None:
+        self.engine = ENGINES.index(search_engine)
+
+    @property
+    def search_label(self) -> Optional[str]:
+        return LABELS.value(self.label)
+
+    @search_label.setter
+    def search_label(self, search_label: Optional[str]) -> None:
+        self.label = LABELS.index(search_label)
+
+    @property
+    def included_search_entry(self) -> bool:
+        return bool(self.flags & INCLUDED_SEARCH_ENTRY)
+
+    @included_search_entry.setter
+    def included_search_entry(self, included: bool) -> None:
+        if included:
+            self.flags |= INCLUDED_SEARCH_ENTRY
+        else:
+            self.flags &= ~INCLUDED_SEARCH_ENTRY
+
+    @property
+    def default_visible(self) -> bool:
+        return bool(self.flags & DEFAULT_VISIBLE)
+
+    @default_visible.setter
+    def default_visible(self, visible: bool) -> None:
+        if visible:
+            self.flags |= DEFAULT_VISIBLE
+        else:
+            self.flags &= ~DEFAULT_VISIBLE
+
+    def __getitem__(self, key: str) -> Any:
+        getter = GETTERS.get(key)
+        if getter is None:
+            raise KeyError(key)
+        return getter(self)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in SETTABLE_KEYS:
+            raise KeyError(key)
+        setattr(self, SETTABLE_KEYS[key], value)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(GETTERS)
+
+    def __len__(self) -> int:
+        return len(GETTERS)
+
+    def __repr__(self) -> str:
+        return f"SearchRecord({dict(self)!r})"
+
+    def __reduce__(self) -> Tuple[Callable, Tuple]:
+        # The interned tables differ between processes, so names are pickled
+        return (
+            SearchRecord,
+            (
+                self.url,
+                self.title,
+                self.visit_count,
+                self.visit_datetime,
+                self.search_query,
+                self.search_engine,
+                self.search_label,
+                self.included_search_entry,
+                self.default_visible,
+            ),
+        )
+
+
+# The dict-style keys of a record, in the order of SearchHistoryItem
+GETTERS: Dict[str, Callable[[SearchRecord], Any]] = {
+    "url": lambda record: record.url,
+    "title": lambda record: record.title,
+    "visit_count": lambda record: record.visit_count,
+    "last_visit_time": lambda record: record.visit_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+    "last_visit_time_datetime": lambda record: record.visit_datetime,
+    "search_query": lambda record: record.search_query,
+    "search_engine": lambda record: record.search_engine,
+    "search_label": lambda record: record.search_label,
+    "included_search_entry": lambda record: record.included_search_entry,
+    "default_visible": lambda record: record.default_visible,
+    "parsed_url": lambda record: record.parsed_url,
+}
+
+# The keys that can be set, and the attribute each one sets
+SETTABLE_KEYS = {
+    "title": "title",
+    "visit_count": "visit_count",
+    "last_visit_time_datetime": "visit_datetime",
+    "search_query": "search_query",
+    "search_engine": "search_engine",
+    "search_label": "search_label",
+    "included_search_entry": "included_search_entry",
+    "default_visible": "default_visible",
+}
+
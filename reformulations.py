@@ -0,0 +1,264 @@
+"""
+This module contains the detection of query reformulations:
+- shingling a query into its words and character trigrams
+- MinHash signatures of the shingles, and an LSH index over a time window
+- linking each search to the earlier search in the window it reformulates,
+  on the same engine or on another one
+- statistics over the reformulations
+
+Only searches whose signatures share an LSH band, or that share a word, are
+compared, so the cost grows with the number of searches rather than the number
+of pairs in a window. The words catch refinements that add many words to a
+short query, whose similarity is too low for them to share a band.
+"""
+
+import hashlib
+import re
+import struct
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from config import REFORMULATION_SIMILARITY, REFORMULATION_WINDOW_MINUTES
+from sp_types import ReformulationStats, SearchHistoryItem
+
+# The same query, searched again
+REPEAT = "repeat"
+# A query that adds words to the earlier one, or keeps only some of them
+REFINEMENT = "refinement"
+# Any other query with most of its words and trigrams in common with the earlier one
+NEAR_DUPLICATE = "near_duplicate"
+
+# A query refines another when this share of the shorter one's words are in both
+REFINEMENT_CONTAINMENT = 0.8
+
+# 16 bands of 2 rows: pairs about 0.25 similar or more share a band
+SIGNATURE_SIZE = 32
+BAND_ROWS = 2
+
+# Shingles repeat across queries (trigrams especially), so their hashes are kept
+SHINGLE_HASH_CACHE_SIZE = 1 << 16
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def get_shingles(normalized_query: str) -> FrozenSet[str]:
+    """The words of a query and the character trigrams of the whole of it."""
+    words = {"#" + word for word in normalized_query.split()}
+    padded = f" {normalized_query} "
+    trigrams = {padded[i : i + 3] for i in range(len(padded) - 2)}
+    return frozenset(words | trigrams)
+
+
+@lru_cache(maxsize=SHINGLE_HASH_CACHE_SIZE)
+def get_shingle_hashes(shingle: str) -> Tuple[int, ...]:
+    """
+    SIGNATURE_SIZE independent 16-bit hashes of a shingle, one for each
+    MinHash function, from a single stable digest (hash() of a str changes
+    between runs).
+    """
+    digest = hashlib.blake2b(shingle.encode(), digest_size=SIGNATURE_SIZE * 2).digest()
+    return struct.unpack(f"<{SIGNATURE_SIZE}H", digest)
+
+
+def get_signature(shingles: Iterable[str]) -> Tuple[int, ...]:
+    """The MinHash signature: the minimum of each hash function over the shingles."""
+    return tuple(map(min, zip(*map(get_shingle_hashes, shingles))))
+
+
+def get_bands(signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [
+        (band, signature[start : start + BAND_ROWS])
+        for band, start in enumerate(range(0, len(signature), BAND_ROWS))
+    ]
+
+
+def get_jaccard_similarity(first: FrozenSet[str], second: FrozenSet[str]) -> float:
+    return len(first & second) / len(first | second)
+
+
+def get_containment(first: FrozenSet[str], second: FrozenSet[str]) -> float:
+    """The share of the smaller set that is in both."""
+    return len(first & second) / min(len(first), len(second))
+
+
+class QueryEntry(NamedTuple):
+    search: SearchHistoryItem
+    engine: str
+    normalized_query: str
+    shingles: FrozenSet[str]
+    words: FrozenSet[str]
+    timestamp: float
+    bands: List[Tuple[int, Tuple[int, ...]]]
+
+
+class Reformulation(NamedTuple):
+    original: SearchHistoryItem
+    reformulation: SearchHistoryItem
+    kind: str
+    similarity: float
+    cross_engine: bool
+
+
+def get_query_entry(search: SearchHistoryItem) -> Optional[QueryEntry]:
+    normalized_query = normalize_query(search["search_query"])
+    if not normalized_query:
+        return None
+    shingles = get_shingles(normalized_query)
+    return QueryEntry(
+        search=search,
+        engine=search["search_engine"],
+        normalized_query=normalized_query,
+        shingles=shingles,
+        words=frozenset(normalized_query.split()),
+        timestamp=search["last_visit_time_datetime"].timestamp(),
+        bands=get_bands(get_signature(shingles)),
+    )
+
+
+def get_reformulation_kind(
+    original: QueryEntry, reformulation: QueryEntry, similarity_threshold: float
+) -> Optional[Tuple[str, float]]:
+    if original.normalized_query == reformulation.normalized_query:
+        return REPEAT, 1.0
+    similarity = get_jaccard_similarity(original.shingles, reformulation.shingles)
+    if (
+        len(original.words) != len(reformulation.words)
+        and get_containment(original.words, reformulation.words) >= REFINEMENT_CONTAINMENT
+    ):
+        return REFINEMENT, similarity
+    if similarity >= similarity_threshold:
+        return NEAR_DUPLICATE, similarity
+    return None
+
+
+class ReformulationIndex:
+    """
+    The searches of the last window_minutes, oldest added first, with each
+    search's signature bands as LSH buckets and its words as word buckets.
+    """
+
+    def __init__(
+        self,
+        window_minutes: float = REFORMULATION_WINDOW_MINUTES,
+        similarity_threshold: float = REFORMULATION_SIMILARITY,
+    ) -> None:
+        self.window_seconds = window_minutes * 60
+        self.similarity_threshold = similarity_threshold
+        self.entries: Deque[QueryEntry] = deque()
+        # Searches are added and evicted in time order, so each bucket is too
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], Deque[QueryEntry]] = {}
+        self.word_buckets: Dict[str, Deque[QueryEntry]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def evict(self, timestamp: float) -> None:
+        while self.entries and timestamp - self.entries[0].timestamp > self.window_seconds:
+            entry = self.entries.popleft()
+            for band in entry.bands:
+                bucket = self.buckets[band]
+                bucket.popleft()
+                if not bucket:
+                    del self.buckets[band]
+            for word in entry.words:
+                bucket = self.word_buckets[word]
+                bucket.popleft()
+                if not bucket:
+                    del self.word_buckets[word]
+
+    def add(self, entry: QueryEntry) -> None:
+        self.entries.append(entry)
+        for band in entry.bands:
+            self.buckets.setdefault(band, deque()).append(entry)
+        for word in entry.words:
+            self.word_buckets.setdefault(word, deque()).append(entry)
+
+    def find_original(self, entry: QueryEntry) -> Optional[Reformulation]:
+        """The most similar search in the window that entry reformulates, the latest on ties."""
+        candidates = {
+            id(candidate): candidate
+            for band in entry.bands
+            for candidate in self.buckets.get(band, ())
+        }
+        # A refinement shares at least one word with the search it refines
+        candidates.update(
+            (id(candidate), candidate)
+            for word in entry.words
+            for candidate in self.word_buckets.get(word, ())
+        )
+        best = None
+        for candidate in candidates.values():
+            kind = get_reformulation_kind(candidate, entry, self.similarity_threshold)
+            if kind is None:
+                continue
+            if best is None or (kind[1], candidate.timestamp) > (best[1][1], best[0].timestamp):
+                best = (candidate, kind)
+        if best is None:
+            return None
+        original, (kind_name, similarity) = best
+        return Reformulation(
+            original=original.search,
+            reformulation=entry.search,
+            kind=kind_name,
+            similarity=similarity,
+            cross_engine=original.engine != entry.engine,
+        )
+
+
+def is_query_search(entry: SearchHistoryItem) -> bool:
+    return bool(
+        entry["included_search_entry"]
+        and entry["search_engine"]
+        and entry["search_query"]
+        and entry["search_query"] != "..."
+    )
+
+
+def iter_reformulations(
+    search_history: Iterable[SearchHistoryItem],
+    window_minutes: float = REFORMULATION_WINDOW_MINUTES,
+    similarity_threshold: float = REFORMULATION_SIMILARITY,
+) -> Iterator[Reformulation]:
+    """
+    Yields each search of a history in chronological order (as in
+    HistoryStore.records) that reformulates an earlier search made within
+    window_minutes before it, linked to that search.
+    """
+    index = ReformulationIndex(window_minutes, similarity_threshold)
+    for search in search_history:
+        if not is_query_search(search):
+            continue
+        entry = get_query_entry(search)
+        if entry is None:
+            continue
+        index.evict(entry.timestamp)
+        reformulation = index.find_original(entry)
+        if reformulation is not None:
+            yield reformulation
+        index.add(entry)
+
+
+def get_reformulation_stats(
+    reformulations: Iterable[Reformulation], top_n: int = 5
+) -> ReformulationStats:
+    count = 0
+    cross_engine = 0
+    kinds: Counter = Counter()
+    engine_pairs: Counter = Counter()
+    for reformulation in reformulations:
+        count += 1
+        kinds[reformulation.kind] += 1
+        if reformulation.cross_engine:
+            cross_engine += 1
+            engine_pairs[
+                (reformulation.original["search_engine"], reformulation.reformulation["search_engine"])
+            ] += 1
+    return {
+        "reformulations": count,
+        "cross_engine": cross_engine,
+        "kinds": dict(kinds),
+        "engine_pairs": engine_pairs.most_common(top_n),
+    }
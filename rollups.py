@@ -0,0 +1,133 @@
+"""
+This module contains the per-period search engine rollups of a processed history:
+- the week and month a visit falls in, counted back from the current ones
+- the range of the time index each week, month and the full history covers
+- counting the search engines of all of them at once
+- looking up the counts of a period, with or without chat-based search complements
+- updating only the periods that records are added to or removed from
+
+The interactive views move between weeks and months one keypress at a time.
+Counting every period up front makes each move a dictionary lookup, however
+long the history is.
+"""
+
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import DefaultDict, Dict, List, Optional, Sequence, Tuple
+
+from aggregate import EngineShares, HistoryColumns, aggregate_periods, update_engine_shares
+from process import get_week_dates
+from records import ENGINES
+from sp_types import SearchHistoryItem
+from utils import TimeIndex, get_wall_clock_key
+
+# The period types a rollup is kept for; "day" is the full history, as period 0
+WEEK = "week"
+SUNDAY_WEEK = "sunday_week"
+MONTH = "month"
+FULL_HISTORY = "day"
+
+DAY_MICROSECONDS = 24 * 60 * 60 * 1000000
+EPOCH_DATE = date(1970, 1, 1)
+
+# A (period type, period number, complements hidden) key
+RollupKey = Tuple[str, int, bool]
+
+EMPTY_ROLLUP = EngineShares([], {}, 0)
+
+
+def get_period_type(timespan: str, start_on_monday: bool = True) -> str:
+    if timespan == WEEK and not start_on_monday:
+        return SUNDAY_WEEK
+    return timespan
+
+
+def get_week_num(visit_date: date, week_start_date: date) -> int:
+    """The number of weeks visit_date is before the week starting on week_start_date."""
+    return -((visit_date - week_start_date).days // 7)
+
+
+def get_month_num(visit_date: date, current_date: date) -> int:
+    return (current_date.year - visit_date.year) * 12 + current_date.month - visit_date.month
+
+
+class EngineRollups:
+    """
+    The search engine counts of every week (starting on Monday or on Sunday),
+    month and of the full history, with and without chat-based search
+    complements. Periods are numbered back from the ones current_date is in.
+    """
+
+    def __init__(self, time_index: TimeIndex, current_date: Optional[datetime] = None) -> None:
+        current_date = datetime.now() if current_date is None else current_date
+        self.current_date = current_date.date()
+        self.week_start_dates = {
+            WEEK: get_week_dates(0, True, current_date)[0].date(),
+            SUNDAY_WEEK: get_week_dates(0, False, current_date)[0].date(),
+        }
+        self.rollups: Dict[RollupKey, EngineShares] = {}
+        self.build(time_index)
+
+    def get_periods(self, visit_date: date) -> List[Tuple[str, int]]:
+        return [
+            (WEEK, get_week_num(visit_date, self.week_start_dates[WEEK])),
+            (SUNDAY_WEEK, get_week_num(visit_date, self.week_start_dates[SUNDAY_WEEK])),
+            (MONTH, get_month_num(visit_date, self.current_date)),
+            (FULL_HISTORY, 0),
+        ]
+
+    def get_period_ranges(self, time_index: TimeIndex) -> Dict[Tuple[str, int], Tuple[int, int]]:
+        """
+        The (start, end) positions of each period in the time index. Records
+        are in wall-clock order, so every period is one contiguous range.
+        """
+        ranges: Dict[Tuple[str, int], Tuple[int, int]] = {}
+        day_start = 0
+        keys = time_index.keys
+        for position in range(1, len(keys) + 1):
+            day = keys[day_start] // DAY_MICROSECONDS
+            if position < len(keys) and keys[position] // DAY_MICROSECONDS == day:
+                continue
+            for period in self.get_periods(EPOCH_DATE + timedelta(days=day)):
+                start = ranges[period][0] if period in ranges else day_start
+                ranges[period] = (start, position)
+            day_start = position
+        return ranges
+
+    def build(self, time_index: TimeIndex) -> None:
+        columns = HistoryColumns(time_index.records)
+        ranges = self.get_period_ranges(time_index)
+        for hide_complements in (True, False):
+            rollups = aggregate_periods(columns, ranges.values(), hide_complements)
+            for (period_type, period_num), rollup in zip(ranges, rollups):
+                self.rollups[(period_type, period_num, hide_complements)] = rollup
+
+    def update(
+        self,
+        added: Sequence[SearchHistoryItem],
+        removed: Sequence[SearchHistoryItem] = (),
+    ) -> None:
+        """
+        Adds the searches of added to the rollups of the periods they fall
+        in and takes those of removed out of theirs. No other period is counted.
+        """
+        changes: DefaultDict[RollupKey, Counter] = defaultdict(Counter)
+        for records, sign in ((added, 1), (removed, -1)):
+            columns = HistoryColumns(records)
+            days = [
+                get_wall_clock_key(record["last_visit_time_datetime"]) // DAY_MICROSECONDS
+                for record in records
+            ]
+            for hide_complements in (True, False):
+                counted_engine_ids = columns.get_counted_engine_ids(hide_complements)
+                for day, engine_id in zip(days, counted_engine_ids):
+                    if engine_id == -1:
+                        continue
+                    engine = ENGINES.value(engine_id)
+                    for period_type, period_num in self.get_periods(EPOCH_DATE + timedelta(days=day)):
+                        changes[(period_type, period_num, hide_complements)][engine] += sign
+        for key, change in changes.items():
+            self.rollups[key] = update_engine_shares(self.get(*key), change)
+
+    def get(self, period_type: str, period_num: int = 0, hide_complements: bool = True) -> EngineShares:
+        return self.rollups.get((period_type, period_num, hide_complements), EMPTY_ROLLUP)
@@ -0,0 +1,303 @@
+"""
+This module contains the compiled URL rules that classify history URLs:
+- compiling the configured systems, domains and patterns into one matcher
+- classifying a URL against all of them at once
+- the SQL prefilter that keeps only the URLs that may be searches
+- the fingerprint of the rules, to tell when cached classifications are stale
+
+Every rule in config.py is either a URL prefix, an exact URL or a substring.
+All prefixes share one character trie, so a URL is walked once however many
+systems are configured, and all substrings share one compiled pattern.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Pattern, Set, Tuple
+
+import dedup
+import urls
+
+from config import (
+    CHAT_BASED_SEARCH_COMPLEMENTS,
+    DEFAULT_SEARCH_QUERY_PARAMETERS,
+    INCLUDED_SEARCH_SYSTEMS,
+    LANDING_PAGE_ONLY_SEARCH_SYSTEMS,
+    SEARCH_QUERY_PARAMETERS,
+    SITE_SEARCH_DOMAINS,
+    SKIP_DOMAINS,
+)
+from urls import QueryParameterExtractor
+
+# Define a list of common search engine query patterns
+SEARCH_PATTERNS = [
+    "search?q=",  # Common for many search engines like Google
+    "search/web?q=",  # Another common pattern
+    "query=",  # Used by some search engines
+    "search?p=",  # Yahoo
+    "q=",  # Short and common, but be careful as it might match non-search URLs
+]
+
+# URLs of these sites only count as searches if they start with the pattern
+SITE_SPECIFIC_SEARCH_INCLUSION_RULES = {
+    "https://www.tiktok.com": "https://www.tiktok.com/search?q=",
+    "https://www.perplexity.ai": "https://www.perplexity.ai/search",
+}
+
+# URLs of these sites never count as searches if they start with the pattern
+SITE_SPECIFIC_SEARCH_EXCLUSION_RULES = {
+    # this is how Google safeloads URLs from Gmail, perhaps?
+    "https://www.google.com/": "https://www.google.com/url?q=",
+}
+
+# The rule kinds a trie node can carry
+INCLUDED_SEARCH_SYSTEM = "included_search_system"
+CHAT_BASED_SEARCH_COMPLEMENT = "chat_based_search_complement"
+SITE_SEARCH = "site_search"
+SKIP_DOMAIN = "skip_domain"
+INCLUSION_RULE_SITE = "inclusion_rule_site"
+INCLUSION_RULE_PATTERN = "inclusion_rule_pattern"
+EXCLUSION_RULE_SITE = "exclusion_rule_site"
+EXCLUSION_RULE_PATTERN = "exclusion_rule_pattern"
+CLEANUP_SITE = "cleanup_site"
+QUERY_PARAMETER_SITE = "query_parameter_site"
+
+# The key of the rule kinds that end at a trie node
+END = ""
+
+
+class UrlClassification(NamedTuple):
+    """Everything the configured rules say about a URL, independent of its visits."""
+
+    included_search_system: bool
+    matches_search_pattern: bool
+    # Skipped, or failing a site-specific inclusion or exclusion rule
+    excluded: bool
+    # The first site-specific cleanup prefix the URL starts with
+    cleanup_site: Optional[str]
+    chat_based_search_complement: bool
+    site_search: bool
+    landing_page: bool
+    landing_page_only: bool
+    # Extracts the search query from the URL's query string
+    query_extractor: QueryParameterExtractor
+
+
+def minimal_substrings(substrings: Iterable[str]) -> List[str]:
+    """Drops the substrings that contain another one, since they never decide a match."""
+    substrings = sorted(set(substrings), key=len)
+    minimal: List[str] = []
+    for substring in substrings:
+        if not any(shorter in substring for shorter in minimal):
+            minimal.append(substring)
+    return minimal
+
+
+def compile_substrings(substrings: Iterable[str]) -> Optional[Pattern[str]]:
+    substrings = minimal_substrings(substrings)
+    if not substrings:
+        return None
+    return re.compile("|".join(re.escape(substring) for substring in substrings))
+
+
+def get_engine_search_patterns(keys: Iterable[str]) -> List[str]:
+    """The substrings of an engine's URLs that hold one of its query parameters."""
+    return [f"{separator}{key}=" for key in keys for separator in "?&"]
+
+
+class UrlRules:
+    """
+    The configured rules compiled into a matcher. Build it once with
+    compile_rules and call classify for every URL.
+    """
+
+    def __init__(self) -> None:
+        self.trie: Dict[str, Any] = {}
+        # Cleanup prefixes in the order they were configured, to keep the first match
+        self.cleanup_sites: List[str] = []
+        self.landing_pages: Set[str] = set()
+        self.landing_page_only_systems: Set[str] = set()
+        self.search_pattern: Optional[Pattern[str]] = None
+        self.default_query_extractor = QueryParameterExtractor(DEFAULT_SEARCH_QUERY_PARAMETERS)
+        # The extractor and the search patterns of each engine with its own parameters
+        self.query_extractors: Dict[str, QueryParameterExtractor] = {}
+        self.engine_search_patterns: Dict[str, List[str]] = {}
+        self.skip_substring: Optional[Pattern[str]] = None
+
+    def add_prefix(self, prefix: str, kind: str) -> None:
+        node = self.trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(END, set()).add(kind)
+
+    def match_prefixes(self, url: str) -> Dict[str, List[str]]:
+        """Returns the prefixes the URL starts with, by rule kind, shortest first."""
+        matches: Dict[str, List[str]] = {}
+        node = self.trie
+        for position, char in enumerate(url):
+            if END in node:
+                for kind in node[END]:
+                    matches.setdefault(kind, []).append(url[:position])
+            next_node = node.get(char)
+            if next_node is None:
+                return matches
+            node = next_node
+        if END in node:
+            for kind in node[END]:
+                matches.setdefault(kind, []).append(url)
+        return matches
+
+    def classify(self, url: str) -> UrlClassification:
+        matches = self.match_prefixes(url)
+        # A site's inclusion rule fails when the URL starts with the site but
+        # not with its pattern
+        failed_inclusion = any(
+            SITE_SPECIFIC_SEARCH_INCLUSION_RULES[site]
+            not in matches.get(INCLUSION_RULE_PATTERN, [])
+            for site in matches.get(INCLUSION_RULE_SITE, [])
+        )
+        # An exclusion rule applies when the URL starts with both
+        matched_exclusion = any(
+            SITE_SPECIFIC_SEARCH_EXCLUSION_RULES[site]
+            in matches.get(EXCLUSION_RULE_PATTERN, [])
+            for site in matches.get(EXCLUSION_RULE_SITE, [])
+        )
+        excluded = (
+            failed_inclusion
+            or matched_exclusion
+            or SKIP_DOMAIN in matches
+            or (self.skip_substring is not None and self.skip_substring.search(url) is not None)
+        )
+        query_extractor = self.default_query_extractor
+        matches_search_pattern = (
+            self.search_pattern is not None and self.search_pattern.search(url) is not None
+        )
+        if QUERY_PARAMETER_SITE in matches:
+            # The longest prefix is the most specific engine
+            engine = matches[QUERY_PARAMETER_SITE][-1]
+            query_extractor = self.query_extractors[engine]
+            matches_search_pattern = matches_search_pattern or any(
+                pattern in url for pattern in self.engine_search_patterns[engine]
+            )
+        cleanup_site = None
+        if CLEANUP_SITE in matches:
+            matched = set(matches[CLEANUP_SITE])
+            cleanup_site = next(site for site in self.cleanup_sites if site in matched)
+        return UrlClassification(
+            included_search_system=INCLUDED_SEARCH_SYSTEM in matches,
+            matches_search_pattern=matches_search_pattern,
+            excluded=excluded,
+            cleanup_site=cleanup_site,
+            chat_based_search_complement=CHAT_BASED_SEARCH_COMPLEMENT in matches,
+            site_search=SITE_SEARCH in matches,
+            landing_page=url in self.landing_pages,
+            landing_page_only=url in self.landing_page_only_systems,
+            query_extractor=query_extractor,
+        )
+
+
+def compile_rules(cleanup_sites: Iterable[str] = ()) -> UrlRules:
+    """
+    Compiles the rules in config.py, the search patterns and the site-specific
+    rules. cleanup_sites are the prefixes of the site-specific cleanups.
+    """
+    rules = UrlRules()
+    for system in INCLUDED_SEARCH_SYSTEMS:
+        rules.add_prefix(system, INCLUDED_SEARCH_SYSTEM)
+    for site in CHAT_BASED_SEARCH_COMPLEMENTS:
+        rules.add_prefix(site, CHAT_BASED_SEARCH_COMPLEMENT)
+    for site in SITE_SEARCH_DOMAINS:
+        rules.add_prefix(site, SITE_SEARCH)
+    for site, pattern in SITE_SPECIFIC_SEARCH_INCLUSION_RULES.items():
+        rules.add_prefix(site, INCLUSION_RULE_SITE)
+        rules.add_prefix(pattern, INCLUSION_RULE_PATTERN)
+    for site, pattern in SITE_SPECIFIC_SEARCH_EXCLUSION_RULES.items():
+        rules.add_prefix(site, EXCLUSION_RULE_SITE)
+        rules.add_prefix(pattern, EXCLUSION_RULE_PATTERN)
+    for engine, keys in SEARCH_QUERY_PARAMETERS.items():
+        rules.add_prefix(engine, QUERY_PARAMETER_SITE)
+        rules.query_extractors[engine] = QueryParameterExtractor(
+            list(keys) + DEFAULT_SEARCH_QUERY_PARAMETERS
+        )
+        rules.engine_search_patterns[engine] = get_engine_search_patterns(keys)
+    for site in cleanup_sites:
+        rules.add_prefix(site, CLEANUP_SITE)
+        rules.cleanup_sites.append(site)
+
+    # Skip domains match as a prefix, and wildcard ones also anywhere in the URL
+    for skip_domain in SKIP_DOMAINS:
+        rules.add_prefix(skip_domain, SKIP_DOMAIN)
+    rules.skip_substring = compile_substrings(
+        skip_domain.replace("*", "") for skip_domain in SKIP_DOMAINS if skip_domain.startswith("*")
+    )
+    rules.search_pattern = compile_substrings(SEARCH_PATTERNS)
+
+    rules.landing_pages = set(INCLUDED_SEARCH_SYSTEMS)
+    rules.landing_page_only_systems = set(LANDING_PAGE_ONLY_SEARCH_SYSTEMS)
+    return rules
+
+
+def escape_glob(text: str) -> str:
+    return "".join(f"[{char}]" if char in "*?[" else char for char in text)
+
+
+def get_search_candidate_filter() -> Tuple[str, List[str]]:
+    """
+    Returns a SQL predicate over the `url` and `visit_count` columns, and its
+    parameters, that keeps every URL is_likely_countable_search_url may count.
+
+    It is a prefilter: the site-specific rules are still applied in Python, but
+    URLs that can never be searches are dropped before they leave SQLite.
+    """
+    included = [escape_glob(system) + "*" for system in INCLUDED_SEARCH_SYSTEMS]
+    patterns = ["*" + escape_glob(pattern) + "*" for pattern in SEARCH_PATTERNS]
+    patterns += [
+        escape_glob(engine) + "*" + escape_glob(pattern) + "*"
+        for engine, keys in SEARCH_QUERY_PARAMETERS.items()
+        for pattern in get_engine_search_patterns(keys)
+    ]
+    skipped = [
+        "*" + escape_glob(skip_domain.replace("*", "")) + "*"
+        if skip_domain.startswith("*")
+        else escape_glob(skip_domain) + "*"
+        for skip_domain in SKIP_DOMAINS
+    ]
+
+    def any_glob(globs: List[str]) -> str:
+        return "(" + " OR ".join(["url GLOB ?"] * len(globs) or ["0"]) + ")"
+
+    predicate = (
+        f"({any_glob(included)} OR (visit_count > 0 AND {any_glob(patterns)}"
+        f" AND NOT {any_glob(skipped)}))"
+    )
+    return predicate, included + patterns + skipped
+
+
+def get_rules_fingerprint() -> str:
+    """
+    Returns a hash of everything that drives classification: the configured
+    lists of systems and domains, the search patterns, this rule engine,
+    the URL parsing, the dedup window and the classification in process.py.
+    """
+    rules = [
+        DEFAULT_SEARCH_QUERY_PARAMETERS,
+        SEARCH_QUERY_PARAMETERS,
+        INCLUDED_SEARCH_SYSTEMS,
+        SKIP_DOMAINS,
+        SITE_SEARCH_DOMAINS,
+        CHAT_BASED_SEARCH_COMPLEMENTS,
+        LANDING_PAGE_ONLY_SEARCH_SYSTEMS,
+        SEARCH_PATTERNS,
+    ]
+    digest = hashlib.sha1(json.dumps(rules).encode())
+    module_paths = [
+        __file__,
+        dedup.__file__,
+        urls.__file__,
+        os.path.join(os.path.dirname(__file__), "process.py"),
+    ]
+    for module_path in module_paths:
+        with open(module_path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
@@ -0,0 +1,345 @@
+"""
+This module contains the append-only, segmented cache of processed search history:
+- appending only the records that are newer than the cache as a new segment
+- the manifest listing the live segments
+- compacting the segments into one, in the background, when there are too many
+- the retention policy, by age and by total size
+- reading all the live segments as a single history
+- one directory of segments per cache, e.g. per source
+
+Each segment is a binary cache file (see history_cache). The manifest is the
+only source of truth: a segment file that is not listed in it is not live.
+Segments being compacted carry a lease in the manifest, and retention leaves
+them alone until the compaction replaces them.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, overload
+
+from config import CACHE_MAX_AGE_DAYS, CACHE_MAX_SEGMENTS, CACHE_MAX_SIZE_MB
+from history_cache import CACHE_VERSION, CachedSearchHistory, write_history_cache
+from sp_types import SearchHistoryItem
+
+# The default segment directory; each source's processed cache has its own
+SEGMENT_DIR = "cached_histories/segments"
+MANIFEST_NAME = "manifest.json"
+
+# A compaction that has not finished by then is assumed to have died
+COMPACTION_LEASE_SECONDS = 10 * 60
+
+# Guards every read-modify-write of the manifest, since compaction runs in a thread
+MANIFEST_LOCK = threading.Lock()
+
+
+def get_manifest_path(segment_dir: Optional[str] = None) -> str:
+    return os.path.join(segment_dir or SEGMENT_DIR, MANIFEST_NAME)
+
+
+def read_manifest(segment_dir: Optional[str] = None) -> Dict[str, Any]:
+    manifest_path = get_manifest_path(segment_dir)
+    if not os.path.exists(manifest_path):
+        return {"segments": []}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def load_manifest(segment_dir: Optional[str] = None) -> Dict[str, Any]:
+    manifest = read_manifest(segment_dir)
+    # Segments written in another cache format cannot be read, so the cache starts over
+    if manifest["segments"] and manifest.get("cache_version") != CACHE_VERSION:
+        return {"segments": []}
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, Any], segment_dir: Optional[str] = None) -> None:
+    manifest["cache_version"] = CACHE_VERSION
+    manifest_path = get_manifest_path(segment_dir)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def write_segment(
+    history: List[SearchHistoryItem], segment_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """Writes a segment file and returns its manifest entry."""
+    name = f"segment_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.spc"
+    path = os.path.join(segment_dir or SEGMENT_DIR, name)
+    write_history_cache(path, history)
+    visit_times = [entry["last_visit_time_datetime"].timestamp() for entry in history]
+    newest_visit_time = max(visit_times)
+    return {
+        "name": name,
+        "rows": len(history),
+        "bytes": os.path.getsize(path),
+        "created": time.time(),
+        "oldest_visit_time": min(visit_times),
+        "newest_visit_time": newest_visit_time,
+        # The URLs visited at the newest time, so ties are not appended twice
+        "newest_urls": sorted(
+            {
+                entry["url"]
+                for entry, visit_time in zip(history, visit_times)
+                if visit_time == newest_visit_time
+            }
+        ),
+    }
+
+
+def get_high_water_mark(manifest: Dict[str, Any]) -> Tuple[Optional[float], set]:
+    if not manifest["segments"]:
+        return None, set()
+    newest_visit_time = max(segment["newest_visit_time"] for segment in manifest["segments"])
+    newest_urls: set = set()
+    for segment in manifest["segments"]:
+        if segment["newest_visit_time"] == newest_visit_time:
+            newest_urls.update(segment["newest_urls"])
+    return newest_visit_time, newest_urls
+
+
+def is_leased(segment: Dict[str, Any], now: float) -> bool:
+    return "lease" in segment and segment["lease"]["expires"] > now
+
+
+def apply_retention(manifest: Dict[str, Any], now: Optional[float] = None) -> List[str]:
+    """
+    Drops the segments that fall outside the retention policy from the
+    manifest and returns their names: first every segment whose newest record
+    is older than CACHE_MAX_AGE_DAYS, then the oldest segments until the total
+    size is within CACHE_MAX_SIZE_MB. The newest segment is always kept, and
+    so are the segments being compacted.
+    """
+    now = time.time() if now is None else now
+    segments = sorted(manifest["segments"], key=lambda segment: segment["newest_visit_time"])
+    droppable = [segment for segment in segments[:-1] if not is_leased(segment, now)]
+    dropped = []
+    if CACHE_MAX_AGE_DAYS is not None:
+        cutoff = now - CACHE_MAX_AGE_DAYS * 86400
+        while droppable and droppable[0]["newest_visit_time"] < cutoff:
+            dropped.append(droppable.pop(0))
+    if CACHE_MAX_SIZE_MB is not None:
+        max_bytes = CACHE_MAX_SIZE_MB * 1024 * 1024
+        total_bytes = sum(segment["bytes"] for segment in segments if segment not in dropped)
+        while droppable and total_bytes > max_bytes:
+            dropped.append(droppable.pop(0))
+            total_bytes -= dropped[-1]["bytes"]
+    manifest["segments"] = [
+        segment for segment in manifest["segments"] if segment not in dropped
+    ]
+    return [segment["name"] for segment in dropped]
+
+
+def remove_segments(names: Iterable[str], segment_dir: Optional[str] = None) -> None:
+    for name in names:
+        path = os.path.join(segment_dir or SEGMENT_DIR, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def append_segment(
+    history: Iterable[SearchHistoryItem],
+    replace_revisited: bool = False,
+    segment_dir: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    retention: bool = True,
+) -> Optional[threading.Thread]:
+    """
+    Appends the records that are newer than everything in the cache as a new
+    segment. When there are then more than CACHE_MAX_SEGMENTS live segments,
+    they are compacted in a background thread, which is returned.
+
+    With replace_revisited (one record per URL, as in Chromium's `urls`
+    table), a URL's record in a newer segment replaces those in older ones.
+    metadata is stored in the manifest along with the segments. Without
+    retention, no segment or record is ever dropped for its age or size, for
+    caches that must hold the whole history.
+    """
+    segment_dir = segment_dir or SEGMENT_DIR
+    os.makedirs(segment_dir, exist_ok=True)
+    with MANIFEST_LOCK:
+        manifest = load_manifest(segment_dir)
+        manifest.update(metadata or {})
+        manifest["replace_revisited"] = replace_revisited
+        manifest["retention"] = retention
+        newest_visit_time, newest_urls = get_high_water_mark(manifest)
+        new_history = [
+            entry
+            for entry in history
+            if newest_visit_time is None
+            or entry["last_visit_time_datetime"].timestamp() > newest_visit_time
+            or (
+                entry["last_visit_time_datetime"].timestamp() == newest_visit_time
+                and entry["url"] not in newest_urls
+            )
+        ]
+        if new_history:
+            manifest["segments"].append(write_segment(new_history, segment_dir))
+        dropped = apply_retention(manifest) if retention else []
+        save_manifest(manifest, segment_dir)
+    remove_segments(dropped, segment_dir)
+
+    if len(manifest["segments"]) <= CACHE_MAX_SEGMENTS:
+        return None
+    compaction = threading.Thread(
+        target=compact_segments, args=(segment_dir,), name="cache-compaction"
+    )
+    compaction.start()
+    return compaction
+
+
+def compact_segments(segment_dir: Optional[str] = None) -> None:
+    """
+    Merges the live segments into one, newest first, dropping records outside
+    the retention age (unless the cache has no retention) and, with replace_revisited, all but the newest record
+    of each URL. Segments appended while merging are left as they are.
+    """
+    segment_dir = segment_dir or SEGMENT_DIR
+    lease = uuid.uuid4().hex
+    with MANIFEST_LOCK:
+        manifest = load_manifest(segment_dir)
+        now = time.time()
+        segments = [segment for segment in manifest["segments"] if not is_leased(segment, now)]
+        if len(segments) < 2:
+            return
+        for segment in segments:
+            segment["lease"] = {"id": lease, "expires": now + COMPACTION_LEASE_SECONDS}
+        save_manifest(manifest, segment_dir)
+    replace_revisited = manifest.get("replace_revisited", False)
+
+    cutoff = None
+    if CACHE_MAX_AGE_DAYS is not None and manifest.get("retention", True):
+        cutoff = time.time() - CACHE_MAX_AGE_DAYS * 86400
+    merged: List[SearchHistoryItem] = []
+    for segment in segments:
+        cached_history = CachedSearchHistory(os.path.join(segment_dir, segment["name"]))
+        merged.extend(
+            entry
+            for entry in cached_history
+            if cutoff is None or entry["last_visit_time_datetime"].timestamp() >= cutoff
+        )
+        cached_history.close()
+    merged.sort(key=lambda x: x["last_visit_time_datetime"].timestamp(), reverse=True)
+    if replace_revisited:
+        urls = set()
+        newest_records = []
+        for entry in merged:
+            if entry["url"] not in urls:
+                urls.add(entry["url"])
+                newest_records.append(entry)
+        merged = newest_records
+    merged_segments = [write_segment(merged, segment_dir)] if merged else []
+
+    compacted = {segment["name"] for segment in segments}
+    with MANIFEST_LOCK:
+        manifest = load_manifest(segment_dir)
+        still_leased = {
+            segment["name"]
+            for segment in manifest["segments"]
+            if segment.get("lease", {}).get("id") == lease
+        }
+        # The lease ran out and the segments were dropped or compacted since
+        if still_leased != compacted:
+            remove_segments((segment["name"] for segment in merged_segments), segment_dir)
+            return
+        manifest["segments"] = merged_segments + [
+            segment for segment in manifest["segments"] if segment["name"] not in compacted
+        ]
+        save_manifest(manifest, segment_dir)
+    remove_segments(compacted, segment_dir)
+
+
+def clear_segments(segment_dir: Optional[str] = None) -> None:
+    """Drops every segment and the metadata, when the records in them can no longer be used."""
+    with MANIFEST_LOCK:
+        # Including the segments of a stale cache format
+        names = [segment["name"] for segment in read_manifest(segment_dir)["segments"]]
+        if os.path.exists(get_manifest_path(segment_dir)):
+            save_manifest({"segments": []}, segment_dir)
+    remove_segments(names, segment_dir)
+
+
+class SegmentedSearchHistory(Sequence):
+    """
+    A read-only view of all the live segments as one history, newest segment
+    first. Segments are memory-mapped and their rows decoded when accessed.
+    With replace_revisited, the rows of URLs that a newer segment has a row
+    for are left out.
+    """
+
+    def __init__(self, manifest: Dict[str, Any], segment_dir: Optional[str] = None) -> None:
+        self.segments = [
+            CachedSearchHistory(os.path.join(segment_dir or SEGMENT_DIR, segment["name"]))
+            for segment in reversed(manifest["segments"])
+        ]
+        # The index of the first row of each segment
+        self.starts = []
+        row_count = 0
+        for segment in self.segments:
+            self.starts.append(row_count)
+            row_count += len(segment)
+        self.row_count = row_count
+        # The (segment, row) of each row shown, when some are left out
+        self.rows: Optional[List[Tuple[int, int]]] = None
+        if manifest.get("replace_revisited") and len(self.segments) > 1:
+            self.rows = self.get_newest_rows()
+            self.row_count = len(self.rows)
+
+    def get_newest_rows(self) -> List[Tuple[int, int]]:
+        """The rows of each URL in the newest segment it is in, reading only the URLs."""
+        rows = []
+        urls: set = set()
+        for segment_index, segment in enumerate(self.segments):
+            segment_urls = set()
+            for row in range(len(segment)):
+                url = segment.get_url(row)
+                if url not in urls:
+                    segment_urls.add(url)
+                    rows.append((segment_index, row))
+            urls |= segment_urls
+        return rows
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def get_row(self, row: int) -> SearchHistoryItem:
+        if self.rows is not None:
+            segment_index, segment_row = self.rows[row]
+            return self.segments[segment_index][segment_row]
+        segment_index = bisect.bisect_right(self.starts, row) - 1
+        return self.segments[segment_index][row - self.starts[segment_index]]
+
+    @overload
+    def __getitem__(self, index: int) -> SearchHistoryItem: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[SearchHistoryItem]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[SearchHistoryItem, List[SearchHistoryItem]]:
+        if isinstance(index, slice):
+            return [self.get_row(row) for row in range(*index.indices(self.row_count))]
+        row = index + self.row_count if index < 0 else index
+        if not 0 <= row < self.row_count:
+            raise IndexError("cached history index out of range")
+        return self.get_row(row)
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
+
+
+def load_segments(segment_dir: Optional[str] = None) -> Optional[SegmentedSearchHistory]:
+    with MANIFEST_LOCK:
+        manifest = load_manifest(segment_dir)
+    if not manifest["segments"]:
+        return None
+    return SegmentedSearchHistory(manifest, segment_dir)
+
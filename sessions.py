@@ -0,0 +1,135 @@
+"""
+This module contains the segmentation of a history into search sessions:
+- splitting the timeline into sessions at gaps of inactivity
+- the engines, query chain and engine switches of each session
+- the pages visited between and after its searches
+- statistics over many sessions
+
+Everything is computed in one pass over records in chronological order, so
+the sessions of months of history cost no more than reading it once.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from config import SESSION_INACTIVITY_GAP_MINUTES
+from sp_types import SearchHistoryItem, SessionStats
+
+
+def is_session_search(entry: SearchHistoryItem) -> bool:
+    return bool(entry["included_search_entry"] and entry["search_engine"] and entry["search_query"])
+
+
+class SearchSession:
+    """
+    The searches of one search path, from its first search until the
+    history goes quiet, along with the pages visited after each search.
+    """
+
+    __slots__ = (
+        "searches",
+        "pages",
+        "engines",
+        "query_chain",
+        "engine_switches",
+        "start_time",
+        "end_time",
+    )
+
+    def __init__(self, first_search: SearchHistoryItem) -> None:
+        self.searches: List[SearchHistoryItem] = []
+        self.pages: List[SearchHistoryItem] = []
+        # The engines searched, in the order they were first used
+        self.engines: List[str] = []
+        # The (engine, query) of each search, without consecutive repeats
+        self.query_chain: List[Tuple[str, str]] = []
+        # The (from engine, to engine) of each change between consecutive searches
+        self.engine_switches: List[Tuple[str, str]] = []
+        self.start_time: datetime = first_search["last_visit_time_datetime"]
+        self.end_time: datetime = self.start_time
+        self.add_search(first_search)
+
+    def __repr__(self) -> str:
+        return f"SearchSession({self.start_time}, {len(self.searches)} searches, {self.engines})"
+
+    def add_search(self, search: SearchHistoryItem) -> None:
+        engine = search["search_engine"]
+        if self.query_chain:
+            previous_engine = self.query_chain[-1][0]
+            if engine != previous_engine:
+                self.engine_switches.append((previous_engine, engine))
+        if engine not in self.engines:
+            self.engines.append(engine)
+        if not self.query_chain or self.query_chain[-1] != (engine, search["search_query"]):
+            self.query_chain.append((engine, search["search_query"]))
+        self.searches.append(search)
+        self.end_time = search["last_visit_time_datetime"]
+
+    def add_page(self, page: SearchHistoryItem) -> None:
+        self.pages.append(page)
+        self.end_time = page["last_visit_time_datetime"]
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end_time - self.start_time
+
+
+def iter_sessions(
+    search_history: Iterable[SearchHistoryItem],
+    inactivity_gap_minutes: float = SESSION_INACTIVITY_GAP_MINUTES,
+) -> Iterator[SearchSession]:
+    """
+    Yields the search sessions of a history in chronological order (as in
+    HistoryStore.records), each as soon as it ends. A session starts at a
+    search and ends before the first visit that comes more than
+    inactivity_gap_minutes after the previous one. Pages visited before the
+    first search of a session belong to none.
+    """
+    inactivity_gap_seconds = inactivity_gap_minutes * 60
+    session: Optional[SearchSession] = None
+    last_timestamp = None
+    for entry in search_history:
+        timestamp = entry["last_visit_time_datetime"].timestamp()
+        if last_timestamp is not None and timestamp - last_timestamp > inactivity_gap_seconds:
+            if session is not None:
+                yield session
+            session = None
+        last_timestamp = timestamp
+        if is_session_search(entry):
+            if session is None:
+                session = SearchSession(entry)
+            else:
+                session.add_search(entry)
+        elif session is not None:
+            session.add_page(entry)
+    if session is not None:
+        yield session
+
+
+def get_session_stats(sessions: Iterable[SearchSession], top_n: int = 5) -> SessionStats:
+    session_count = 0
+    search_count = 0
+    page_count = 0
+    switching_sessions = 0
+    total_duration = timedelta()
+    engine_switches: Counter = Counter()
+    for session in sessions:
+        session_count += 1
+        search_count += len(session.searches)
+        page_count += len(session.pages)
+        total_duration += session.duration
+        if session.engine_switches:
+            switching_sessions += 1
+            engine_switches.update(session.engine_switches)
+    return {
+        "sessions": session_count,
+        "searches": search_count,
+        "pages": page_count,
+        "mean_searches_per_session": search_count / session_count if session_count else 0.0,
+        "mean_duration_minutes": (
+            total_duration.total_seconds() / 60 / session_count if session_count else 0.0
+        ),
+        "sessions_with_engine_switches": switching_sessions,
+        "engine_switches": engine_switches.most_common(top_n),
+    }
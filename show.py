@@ -1,16 +1,17 @@
 import textwrap
 from datetime import datetime, timedelta
 from typing import List
-from urllib.parse import urlparse
 
 from pyfzf.pyfzf import FzfPrompt  # type: ignore
 from termcolor import cprint
 
+from aggregate import is_default_visible
 from export import export_searches
-from extract import get_surrounding_history
-from load import load_cache
-from process import get_search_engine_percentages
+from reformulations import get_reformulation_stats, iter_reformulations
+from sessions import get_session_stats, iter_sessions
 from sp_types import SearchHistoryItem
+from store import HistoryStore
+from urls import get_parsed_url
 
 
 def print_search_lines(history_item: SearchHistoryItem):
@@ -32,7 +33,9 @@ def print_search_lines(history_item: SearchHistoryItem):
             print(wrapped_query_line)
 
 
-def print_history_items(records: List[SearchHistoryItem], url=None, full_history=False):
+def print_history_items(
+    records: List[SearchHistoryItem], url=None, full_history=False, hide_complements=True
+):
     print(f"{'Index':<6}{'  Last Visit Time':<25}{'URL'}")
     divider = "-" * 80
     print(divider)
@@ -41,7 +44,7 @@ def print_history_items(records: List[SearchHistoryItem], url=None, full_history
     for history_item in records:
         if not (full_history or history_item["included_search_entry"]):
             continue
-        if history_item["default_visible"] == False:
+        if not is_default_visible(history_item, hide_complements):
             continue
         n = count
         count += 1
@@ -144,13 +147,41 @@ def print_search_engine_percentages(
     return data
 
 
-def investigate_week(timespan_data):
+def print_session_stats(timespan_data, store: HistoryStore):
+    """
+    Prints the search sessions of a week, a month or the full history: how
+    many there were, how long they lasted and which engines were switched
+    between within them, and how often searches were retried.
+    """
+    stats = get_session_stats(iter_sessions(store.get_timeline(timespan_data["search_history"])))
+    scope = "in the full history" if timespan_data["label"] == "day" else f"this {timespan_data['label']}"
+    print(f"\n  Search sessions {scope}: {stats['sessions']}")
+    print(f"   Searches per session: {stats['mean_searches_per_session']:.2f}")
+    print(f"   Minutes per session:  {stats['mean_duration_minutes']:.1f}")
+    print(f"   Pages visited in sessions: {stats['pages']}")
+    print(f"   Sessions switching engines: {stats['sessions_with_engine_switches']}")
+    for (from_engine, to_engine), count in stats["engine_switches"]:
+        print(f"    - {from_engine} -> {to_engine}: {count}")
+    reformulation_stats = get_reformulation_stats(
+        iter_reformulations(timespan_data["search_history"])
+    )
+    print(f"   Reformulated searches: {reformulation_stats['reformulations']}")
+    for kind, count in sorted(reformulation_stats["kinds"].items()):
+        print(f"    - {kind.replace('_', ' ')}: {count}")
+    print(f"   Retried on another engine: {reformulation_stats['cross_engine']}")
+    for (from_engine, to_engine), count in reformulation_stats["engine_pairs"]:
+        print(f"    - {from_engine} -> {to_engine}: {count}")
+    return stats
+
+
+def investigate_week(timespan_data, store: HistoryStore):
     """
     Initiates the investigation process for a specific week's search data.
 
     Parameters:
     - timespan_data: A dictionary containing data for a specific week, including
       search engines and their search counts.
+    - store: The processed search history of the run.
     """
     print_week_summary(timespan_data)
     user_input = (
@@ -162,9 +193,9 @@ def investigate_week(timespan_data):
         .lower()
     )
     if user_input == "all":
-        list_all_investigation(timespan_data)
+        list_all_investigation(store, timespan_data)
     else:
-        particular_investigation(timespan_data)
+        particular_investigation(timespan_data, store)
 
 
 def print_week_summary(timespan_data):
@@ -182,13 +213,13 @@ def print_week_summary(timespan_data):
     )
 
 
-def list_all_investigation(timespan_data=None, full_history=False):
+def list_all_investigation(store: HistoryStore, timespan_data=None, full_history=False):
     """
     Lists all searches in a formatted table, sorted in reverse chronological order.
     """
     
     if full_history:
-        sorted_searches = [item for item in load_cache() if "search_engine" in item]
+        sorted_searches = store.records[::-1]
         data = {
             "search_history": sorted_searches,
             "start_date": (
@@ -212,18 +243,20 @@ def list_all_investigation(timespan_data=None, full_history=False):
             "search_history": sorted_searches,
             "start_date": timespan_data["start_date"],
             "end_date": timespan_data.get("end_date", datetime.now().date()),
+            "hide_complements": timespan_data.get("hide_complements", True),
         }
 
-    print_history_items(sorted_searches)
-    investigation_user_interaction(data)
+    print_history_items(sorted_searches, hide_complements=data.get("hide_complements", True))
+    investigation_user_interaction(data, store)
 
 
-def particular_investigation(data):
+def particular_investigation(data, store: HistoryStore):
     """
     Allows the user to investigate a particular search engine's data.
 
     Parameters:
     - data: A dictionary containing data for a specific week or all searches.
+    - store: The processed search history of the run.
     """
     fzf = FzfPrompt()
     search_engine_count_string = [f"{engine} ({count})" for engine, count in data["search_engines"]]
@@ -235,7 +268,7 @@ def particular_investigation(data):
     selected_engine_searches = [
         entry
         for entry in data["search_history"]
-        if urlparse(entry["url"]).netloc.replace("www.", "") == selected_engine
+        if get_parsed_url(entry).engine == selected_engine
     ]
 
     # Calculate the time range from the start date to the end date or current date
@@ -271,24 +304,24 @@ def particular_investigation(data):
         )
     
     print(f"\nSearches made with {selected_engine} {time_phrase}:")
-    print_history_items(selected_engine_searches)
-    investigation_user_interaction(data, selected_engine_searches)
+    print_history_items(
+        selected_engine_searches, hide_complements=data.get("hide_complements", True)
+    )
+    investigation_user_interaction(data, store, selected_engine_searches)
 
 
 def dive_into_search_context(
-    search: SearchHistoryItem, context_window: int = 3
+    search: SearchHistoryItem, store: HistoryStore, context_window: int = 3
 ) -> None:
     """
     Allows the user to dive into the context of a search for a specific week.
 
     Parameters:
     - search: A dictionary containing data for a specific search.
+    - store: The processed search history of the run.
     """
     url = search["url"]
-    history = load_cache()
-    surrounding_history = get_surrounding_history(
-        url, history, context_window=context_window
-    )
+    surrounding_history = store.get_context(search, context_window=context_window)
     print("\nSurrounding History\n")
     print_history_items(surrounding_history, url=url)
     print(
@@ -298,15 +331,16 @@ def dive_into_search_context(
     input_window_size = input()
     if input_window_size.isdigit() and int(input_window_size) < 50:
         context_window = int(input_window_size)
-        return dive_into_search_context(search, context_window)
+        return dive_into_search_context(search, store, context_window)
 
 
-def investigation_user_interaction(data, selected_engine_searches=None):
+def investigation_user_interaction(data, store: HistoryStore, selected_engine_searches=None):
     """
     Handles user interaction during the investigation of a specific engine's searches.
 
     Parameters:
     - data: Data for a specific week or all searches.
+    - store: The processed search history of the run.
     - selected_engine_searches: Searches related to the selected engine.
     """
 
@@ -322,7 +356,7 @@ def investigation_user_interaction(data, selected_engine_searches=None):
         if user_choice == "r":
             break
         elif user_choice == "i":
-            particular_investigation(data)
+            particular_investigation(data, store)
             break
         elif user_choice == "e":
             export_searches(data)
@@ -346,20 +380,20 @@ def investigation_user_interaction(data, selected_engine_searches=None):
                     "\nWould you like to see the " "surrounding context? (Y/N): "
                 ).lower()
                 if surrounding_context == "y":
-                    dive_into_search_context(search)
+                    dive_into_search_context(search, store)
                 else:
                     print("Invalid query number. Please try again.")
             except ValueError:
                 print("Invalid option. Please try again.")
 
 
-def fzf_search_queries(search_history: List[SearchHistoryItem]):
+def fzf_search_queries(store: HistoryStore):
     """
     Allows the user to select a search query from the history using fzf (fuzzy finder),
     and then dives into the search context of the selected query.
 
     Parameters:
-    - search_history (list of SearchHistoryItem): The search history containing search queries and labels.
+    - store (HistoryStore): The search history containing search queries and labels.
 
     This function filters out entries with certain labels such as 'redirect', 'duplicate', and
     others, and then presents the remaining queries to the user to select using fzf. If multiple
@@ -368,7 +402,7 @@ def fzf_search_queries(search_history: List[SearchHistoryItem]):
     fzf = FzfPrompt()
     filtered_search_history = [
         entry
-        for entry in search_history
+        for entry in store.searches
         if entry.get("search_query")
         and entry.get("search_label", None)
         not in [
@@ -418,11 +452,11 @@ def fzf_search_queries(search_history: List[SearchHistoryItem]):
             else:
                 selected_entry = selected_entries[0]
 
-            dive_into_search_context(selected_entry)
+            dive_into_search_context(selected_entry, store)
 
 
 def interact_with_user_for_search_data(
-    search_history, week_num=None, hide_complements=True
+    store: HistoryStore, week_num=None, hide_complements=True
 ):
     """
     Engages the user to present search engine usage percentages for a given
@@ -431,21 +465,15 @@ def interact_with_user_for_search_data(
     """
 
     # Determine the total number of searches logged
-    total_searches_logged = len(
-        [
-            item
-            for item in search_history
-            if "search_query" in item and item["search_query"] is not None
-        ]
-    )
+    total_searches_logged = len(store.searches)
     # Determine the total number of weeks logged
 
     if week_num is None:
         current_timespan_num = 0
     else:
         current_timespan_num = week_num
-    timespan_data = get_search_engine_percentages(
-        search_history, week_num=current_timespan_num, hide_complements=hide_complements
+    timespan_data = store.get_search_engine_percentages(
+        week_num=current_timespan_num, hide_complements=hide_complements
     )
     print_search_engine_percentages(timespan_data)
     
@@ -477,6 +505,7 @@ def interact_with_user_for_search_data(
             "S": f"to jump to a Specific {timespan_data['label']}",
             "C": f"to {'exclude' if hide_complements else 'include'} chat-based search Complements",
             "I": f"to Investigate the {timespan_data['label']}",
+            "G": f"for the search sessions of the {timespan_data['label']}",
             "E": f"to Export the {timespan_data['label']}",
             "Q": "to Quit",
         }
@@ -508,76 +537,78 @@ def interact_with_user_for_search_data(
                 continue
             current_timespan_num -= 1
             if context == "month_view":
-                timespan_data = get_search_engine_percentages(
-                    search_history, month_num=current_timespan_num, by_month=True
+                timespan_data = store.get_search_engine_percentages(
+                    month_num=current_timespan_num, by_month=True
                 )
             else:
-                timespan_data = get_search_engine_percentages(
-                    search_history, week_num=current_timespan_num
+                timespan_data = store.get_search_engine_percentages(
+                    week_num=current_timespan_num
                 )
             print_search_engine_percentages(timespan_data)
         elif user_choice == "f":
             context = "full_view"
-            timespan_data = get_search_engine_percentages(
-                search_history, full_history=True
+            timespan_data = store.get_search_engine_percentages(
+                full_history=True
             )
             print_search_engine_percentages(timespan_data, full_history=True)
         elif user_choice == "a":
-            list_all_investigation(full_history=True)
+            list_all_investigation(store, full_history=True)
             context = "list_all"
         elif user_choice == "m":
             # convert current_timespan_num to a month
             # Adjust current_timespan_num to month number using modulo division
             current_timespan_num = (current_timespan_num - 1) // 4 + 1
-            timespan_data = get_search_engine_percentages(
-                search_history, by_month=True, month_num=current_timespan_num
+            timespan_data = store.get_search_engine_percentages(
+                by_month=True, month_num=current_timespan_num
             )
             print_search_engine_percentages(timespan_data, by_month=True)
             context = "month_view"
         elif user_choice == "w":
-            timespan_data = get_search_engine_percentages(
-                search_history, week_num=current_timespan_num
+            timespan_data = store.get_search_engine_percentages(
+                week_num=current_timespan_num
             )
             print_search_engine_percentages(timespan_data)
             context = "week_view"
         elif user_choice == "v":
             return interact_with_user_for_search_data(
-                search_history,
+                store,
                 week_num=current_timespan_num,
                 hide_complements=hide_complements,
             )
         elif user_choice == "c":
             return interact_with_user_for_search_data(
-                search_history,
+                store,
                 week_num=current_timespan_num,
                 hide_complements=not hide_complements,
             )
         elif user_choice == "l":
-            list_all_investigation(timespan_data)
+            list_all_investigation(store, timespan_data)
             context = "list"
         elif user_choice == "p":
             current_timespan_num += 1
             if context == "month_view":
-                timespan_data = get_search_engine_percentages(
-                    search_history, month_num=current_timespan_num, by_month=True
+                timespan_data = store.get_search_engine_percentages(
+                    month_num=current_timespan_num, by_month=True
                 )
                 print_search_engine_percentages(timespan_data, by_month=True)
             else:
-                timespan_data = get_search_engine_percentages(
-                    search_history, week_num=current_timespan_num
+                timespan_data = store.get_search_engine_percentages(
+                    week_num=current_timespan_num
                 )
                 print_search_engine_percentages(timespan_data)
         elif user_choice == "s":
             week_num = int(input("Enter the number of weeks back to view: "))
             current_timespan_num = week_num
-            timespan_data = get_search_engine_percentages(
-                search_history, week_num=week_num
+            timespan_data = store.get_search_engine_percentages(
+                week_num=week_num
             )
             print_search_engine_percentages(timespan_data)
             context = "specific_week"
         elif user_choice == "i":
-            investigate_week(timespan_data)
+            investigate_week(timespan_data, store)
             context = "investigate_week"
+        elif user_choice == "g":
+            print_session_stats(timespan_data, store)
         elif user_choice == "e":
             data_scope = input(
                 "Export data for:\n1: This week\n2: All history\n: "
@@ -585,7 +616,7 @@ def interact_with_user_for_search_data(
             if data_scope == "1":
                 export_searches(timespan_data)
             elif data_scope == "2":
-                export_searches(search_history)
+                export_searches(store.records)
             elif user_choice == "q":
                 break
             else:
@@ -1,5 +1,7 @@
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple, TypedDict
+from typing import Any, Dict, List, Tuple, TypedDict
+
+from records import SearchRecord
 
 
 class HistoryItem(TypedDict):
@@ -10,18 +12,19 @@ class HistoryItem(TypedDict):
     last_visit_time_datetime: datetime
 
 
-class SearchHistoryItem(TypedDict):
-    url: str
-    title: str
-    visit_count: int
-    last_visit_time: str
-    last_visit_time_datetime: datetime
+# Processed history items are compact records that can also be read and set
+# like a dict with the keys url, title, visit_count, last_visit_time,
+# last_visit_time_datetime, search_query, search_engine, search_label,
+# included_search_entry, default_visible and parsed_url (see records.py)
+SearchHistoryItem = SearchRecord
 
-    search_query: Optional[str]
-    search_engine: Optional[str]
-    search_label: Optional[str]
-    included_search_entry: bool
-    default_visible: bool
+
+class IngestState(TypedDict):
+    # This is what load.save_ingest_state persists per profile
+    data_path: str
+    # Chrome time for Chromium profiles, REAL milliseconds for HTU
+    last_visit_time: float
+    last_id: int
 
 
 class ScopedHistory(TypedDict):
@@ -40,3 +43,25 @@ class HistoryByWeekAnalyzed(TypedDict):
     total_searches: int
     search_history: List[Dict[str, Any]]
     search_engines: List[Tuple[str, int]]
+
+
+class SessionStats(TypedDict):
+    # This is the output from sessions.get_session_stats
+    sessions: int
+    searches: int
+    pages: int
+    mean_searches_per_session: float
+    mean_duration_minutes: float
+    sessions_with_engine_switches: int
+    # The most common (from engine, to engine) switches and their counts
+    engine_switches: List[Tuple[Tuple[str, str], int]]
+
+
+class ReformulationStats(TypedDict):
+    # This is the output from reformulations.get_reformulation_stats
+    reformulations: int
+    cross_engine: int
+    # The number of reformulations of each kind (see reformulations.py)
+    kinds: Dict[str, int]
+    # The most common (from engine, to engine) pairs and their counts
+    engine_pairs: List[Tuple[Tuple[str, str], int]]
@@ -0,0 +1,174 @@
+"""
+This module contains the in-memory store of a run's processed search history,
+shared by all interactive views:
+- the records, sorted once in chronological order
+- the indexes derived from them
+- adding newly classified records in place, as a watched history grows
+- the search engine percentages of a week, a month or the full history,
+  looked up from rollups counted once
+- the context around a search
+- the full timeline of a period, with the pages between its searches
+"""
+
+import heapq
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from config import SESSION_INACTIVITY_GAP_MINUTES
+from load import get_chromium_context, get_chromium_pages, is_chromium_profile
+from process import get_scoped_history, get_search_engine_data, get_search_history
+from rollups import EngineRollups, get_period_type
+from sp_types import SearchHistoryItem
+from utils import TimeIndex
+
+
+class HistoryStore:
+    """
+    Holds the processed search history of a run. It is created once, after
+    processing, and every view reads from it instead of reloading or
+    re-sorting the history.
+    """
+
+    def __init__(
+        self, search_history: Iterable[SearchHistoryItem], data_path: Optional[str] = None
+    ) -> None:
+        self.data_path = data_path
+        self.records: List[SearchHistoryItem] = sorted(
+            search_history, key=lambda x: x["last_visit_time_datetime"].timestamp()
+        )
+        self.searches = [
+            record for record in self.records if record["search_query"] is not None
+        ]
+        # The position of the latest record for each URL
+        self.url_positions = {record["url"]: i for i, record in enumerate(self.records)}
+        # Weeks and months are sliced from this, by wall-clock time
+        self.time_index = TimeIndex(self.records)
+        # The engine counts of every period, numbered back from today
+        self.rollups = EngineRollups(self.time_index)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(
+        self, search_history: Iterable[SearchHistoryItem], replace_revisited: bool = True
+    ) -> None:
+        """
+        Adds newly classified records (see merge_search_history for
+        replace_revisited) without sorting the store again: each goes in at
+        its position, which is at the end for visits newer than the rest, and
+        only the rollups of the periods they and the replaced records fall
+        in are updated.
+        """
+        new_records = sorted(
+            search_history, key=lambda x: x["last_visit_time_datetime"].timestamp()
+        )
+        replaced: List[SearchHistoryItem] = []
+        if replace_revisited:
+            new_urls = {record["url"] for record in new_records}
+            if any(url in self.url_positions for url in new_urls):
+                replaced = [record for record in self.records if record["url"] in new_urls]
+                self.records = [
+                    record for record in self.records if record["url"] not in new_urls
+                ]
+        appended = not replaced
+        for record in new_records:
+            timestamp = record["last_visit_time_datetime"].timestamp()
+            position = len(self.records)
+            while (
+                position
+                and self.records[position - 1]["last_visit_time_datetime"].timestamp() > timestamp
+            ):
+                position -= 1
+            if position == len(self.records) and appended:
+                if record["search_query"] is not None:
+                    self.searches.append(record)
+                self.url_positions[record["url"]] = position
+            else:
+                appended = False
+            self.records.insert(position, record)
+        if not appended:
+            # Records moved, so the positions are taken again, still without sorting
+            self.searches = [
+                record for record in self.records if record["search_query"] is not None
+            ]
+            self.url_positions = {record["url"]: i for i, record in enumerate(self.records)}
+        for record in replaced:
+            self.time_index.remove(record)
+        for record in new_records:
+            self.time_index.insert(record)
+        self.rollups.update(new_records, replaced)
+
+    def get_total_timespan_logged(self, timespan: str = "week", start_on_monday: bool = True) -> int:
+        return self.time_index.get_total_timespan_logged(timespan, start_on_monday)
+
+    def get_search_engine_percentages(
+        self,
+        week_num: int = 0,
+        start_on_monday: bool = True,
+        full_history: bool = False,
+        by_month: bool = False,
+        month_num: int = 0,
+        hide_complements: bool = True,
+    ) -> Dict[str, Any]:
+        timespan = "month" if by_month else "day" if full_history else "week"
+        # Periods are numbered back from the current one, so recount after midnight
+        if self.rollups.current_date != date.today():
+            self.rollups = EngineRollups(self.time_index)
+        scoped_history = get_scoped_history(
+            self.records,
+            week_num=week_num,
+            start_on_monday=start_on_monday,
+            full_history=full_history,
+            by_month=by_month,
+            month_num=month_num,
+            total_timespan_periods_logged=self.get_total_timespan_logged(
+                timespan, start_on_monday
+            ),
+            time_index=self.time_index,
+        )
+        period_num = 0 if full_history else month_num if by_month else week_num
+        rollup = self.rollups.get(
+            get_period_type(timespan, start_on_monday), period_num, hide_complements
+        )
+        return get_search_engine_data(scoped_history, timespan, rollup, hide_complements)
+
+    def get_context(
+        self, search: SearchHistoryItem, context_window: int = 3
+    ) -> List[SearchHistoryItem]:
+        """
+        Returns the records around a search, newest first. For a Chromium
+        profile they are read from the database on demand, since only search
+        candidates are kept in the store.
+        """
+        if self.data_path and is_chromium_profile(self.data_path):
+            return get_search_history(
+                get_chromium_context(self.data_path, search["url"], context_window)
+            )
+        position = self.url_positions.get(search["url"])
+        if position is None:
+            return []
+        start = max(position - context_window, 0)
+        return self.records[start : position + context_window + 1][::-1]
+
+    def get_timeline(self, search_history: List[SearchHistoryItem]) -> Iterator[SearchHistoryItem]:
+        """
+        Yields the records of a period (as in HistoryStore.records) along with
+        the pages visited between them, in chronological order. For a
+        Chromium profile the pages are streamed from the database, since only
+        search candidates are kept in the store; a session still open at the
+        end of the period gets the pages of one more inactivity gap.
+        """
+        if not search_history or not (self.data_path and is_chromium_profile(self.data_path)):
+            yield from search_history
+            return
+        pages = get_chromium_pages(
+            self.data_path,
+            search_history[0]["last_visit_time_datetime"],
+            search_history[-1]["last_visit_time_datetime"]
+            + timedelta(minutes=SESSION_INACTIVITY_GAP_MINUTES),
+        )
+        yield from heapq.merge(
+            search_history,
+            get_search_history(pages),
+            key=lambda x: x["last_visit_time_datetime"].timestamp(),
+        )
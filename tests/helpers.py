@@ -0,0 +1,46 @@
+"""
+This module contains the helpers shared by the tests:
+- building a Chromium profile's History database from rows of its urls table
+- Chrome times around a fixed date
+- building the search records of a session
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from records import SearchRecord
+
+# 2024-04-20 10:00:00 UTC in Chrome time, and its units
+CHROME_TIME = 13357130400000000
+SECOND = 1000000
+MINUTE = 60 * SECOND
+HOUR = 3600 * SECOND
+
+START = datetime(2024, 4, 22, 9, 0)
+
+
+def create_chromium_profile(profile_path, rows):
+    """Writes (id, url, title, visit_count, last_visit_time) rows, replacing those with the same id."""
+    os.makedirs(profile_path, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(profile_path, "History"))
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY, url TEXT, "
+        "title TEXT, visit_count INTEGER, last_visit_time INTEGER)"
+    )
+    connection.executemany("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+def search(minutes, engine, query):
+    """A search made the given number of minutes after START."""
+    return SearchRecord(
+        f"https://{engine}/search?q={query}",
+        query,
+        1,
+        START + timedelta(minutes=minutes),
+        search_query=query,
+        search_engine=engine,
+        included_search_entry=True,
+    )
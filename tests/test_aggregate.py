@@ -0,0 +1,49 @@
+# run: p -m pytest tests/test_aggregate.py
+
+import os
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregate import (
+    HistoryColumns,
+    aggregate_engine_shares,
+    aggregate_periods,
+    is_default_visible,
+)
+from load import get_history
+from process import get_search_engine_percentages, get_search_history
+
+mock_search_history = get_search_history(get_history("tests/mock_history_systems.json"))
+
+
+def test_engine_shares_leave_the_records_unchanged():
+    before = [dict(entry) for entry in mock_search_history]
+    result = get_search_engine_percentages(mock_search_history, full_history=True)
+    assert [dict(entry) for entry in mock_search_history] == before
+    assert result["total_searches"] == sum(count for _, count in result["search_engines"])
+    assert abs(sum(result["shares"].values()) - 100) < 1e-9
+
+    # An empty period has no searches, rather than dividing by zero
+    empty = aggregate_engine_shares(HistoryColumns([]))
+    assert empty.total_searches == 0 and empty.search_engines == [] and empty.shares == {}
+
+
+def test_aggregate_periods_and_default_visibility():
+    columns = HistoryColumns(mock_search_history)
+    middle = len(columns) // 2
+    for hide_complements in (True, False):
+        periods = aggregate_periods(
+            columns, [(0, middle), (middle, len(columns))], hide_complements
+        )
+        assert periods == [
+            aggregate_engine_shares(columns, hide_complements, 0, middle),
+            aggregate_engine_shares(columns, hide_complements, middle),
+        ]
+    assert not all(is_default_visible(entry, True) for entry in mock_search_history)
+    assert all(
+        is_default_visible(entry, False)
+        for entry in mock_search_history
+        if entry["search_label"] != "site_search"
+    )
@@ -0,0 +1,38 @@
+# run: p -m pytest tests/test_dedup.py
+
+import os
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import DedupIndex
+
+
+def test_dedup_index_evicts_by_time():
+    dedup_index = DedupIndex(window_seconds=10)
+    dedup_index.add("https://www.perplexity.ai/search/?q=a", 100, "perplexity.ai", "a")
+    dedup_index.add("https://duckduckgo.com/?q=b", 95, "duckduckgo.com", "b")
+    assert dedup_index.contains_url("https://perplexity.ai/search/?q=a")
+    assert dedup_index.contains_query("perplexity.ai", "a")
+    assert [entry.url for entry in dedup_index.recent(5)] == [
+        "https://duckduckgo.com/?q=b",
+        "https://www.perplexity.ai/search/?q=a",
+    ]
+
+    dedup_index.evict(88)
+    assert len(dedup_index) == 1
+    assert not dedup_index.contains_url("https://www.perplexity.ai/search/?q=a")
+    assert not dedup_index.contains_query("perplexity.ai", "a")
+    assert dedup_index.contains_query("duckduckgo.com", "b")
+
+
+def test_dedup_index_skips_revisits():
+    dedup_index = DedupIndex()
+    dedup_index.add("https://www.google.com/search?q=a", 100)
+    dedup_index.add("https://www.google.com/search?q=b", 99.5)
+    dedup_index.add("https://www.google.com/search?q=c", 97)
+    assert [entry.url for entry in dedup_index.recent(3)] == [
+        "https://www.google.com/search?q=c",
+        "https://www.google.com/search?q=a",
+    ]
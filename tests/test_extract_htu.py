@@ -0,0 +1,105 @@
+# run: p -m pytest tests/test_extract_htu.py
+
+import os
+import sqlite3
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extract_htu
+import load
+
+
+def create_htu_database(db_path, urls, visits):
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS urls (urlid INTEGER PRIMARY KEY, url TEXT, title TEXT)"
+    )
+    connection.execute("CREATE TABLE IF NOT EXISTS visits (urlid INTEGER, visit_time REAL)")
+    connection.executemany("INSERT OR REPLACE INTO urls VALUES (?, ?, ?)", urls)
+    connection.executemany("INSERT INTO visits VALUES (?, ?)", visits)
+    connection.commit()
+    connection.close()
+
+
+# 2024-04-20 10:00:00 UTC in milliseconds
+VISIT_TIME = 1713607200000
+
+
+def test_get_incremental_htu_history(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "htu_database")
+    monkeypatch.setattr(extract_htu, "EXTERNAL_DATA_PATH", str(tmp_path / "htu"))
+    monkeypatch.setattr(extract_htu, "find_htu_history_database", lambda _: db_path)
+    create_htu_database(
+        db_path,
+        [(1, "https://duckduckgo.com/?q=one", "one"), (2, "https://duckduckgo.com/?q=two", None)],
+        [(1, VISIT_TIME), (2, VISIT_TIME + 1000), (1, VISIT_TIME + 2000)],
+    )
+    history, high_water_mark = extract_htu.get_incremental_htu_history()
+    assert [(item["title"], item["visit_count"]) for item in history] == [
+        ("one", 2),
+        ("", 1),
+        ("one", 2),
+    ]
+    assert high_water_mark == VISIT_TIME + 2000
+
+    create_htu_database(db_path, [], [(2, VISIT_TIME + 3000)])
+    history, high_water_mark = extract_htu.get_incremental_htu_history(high_water_mark)
+    assert [(item["title"], item["visit_count"]) for item in history] == [("", 2)]
+    assert high_water_mark == VISIT_TIME + 3000
+    assert not os.path.exists(tmp_path / "htu" / "copied_extension_database")
+
+    # A visit written between reading the mark and reading the visits is left for the next run
+    create_htu_database(db_path, [], [(1, VISIT_TIME + 4000)])
+    history, high_water_mark = extract_htu.get_incremental_htu_history(high_water_mark)
+    create_htu_database(db_path, [], [(1, VISIT_TIME + 5000)])
+    assert [item["title"] for item in history] == ["one"]
+    history, high_water_mark = extract_htu.get_incremental_htu_history(high_water_mark)
+    assert [item["title"] for item in history] == ["one"]
+    assert high_water_mark == VISIT_TIME + 5000
+
+    # HTU stores fractional milliseconds, and the newest visit is read at once
+    create_htu_database(db_path, [], [(2, VISIT_TIME + 6000.5)])
+    history, high_water_mark = extract_htu.get_incremental_htu_history(high_water_mark)
+    assert [(item["title"], item["visit_count"]) for item in history] == [("", 3)]
+    assert high_water_mark == VISIT_TIME + 6000.5
+    history, high_water_mark = extract_htu.get_incremental_htu_history(high_water_mark)
+    assert list(history) == []
+
+
+def test_find_htu_history_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract_htu, "EXTERNAL_DATA_PATH", str(tmp_path / "htu"))
+    monkeypatch.setattr(extract_htu, "THRESHOLD", 0)
+    os.makedirs(tmp_path / "htu")
+    database_dir = tmp_path / "Profile" / "File System" / "001" / "t" / "00"
+    os.makedirs(database_dir)
+    (database_dir / "00000001").write_bytes(b"not a database" * 100)
+    create_htu_database(str(database_dir / "00000002"), [], [])
+
+    found = extract_htu.find_htu_history_database(str(tmp_path / "Profile"))
+    assert found == str(database_dir / "00000002")
+    assert extract_htu.load_cached_filepath()["filepath"] == found
+
+    # A cached path that has moved is not trusted
+    os.rename(found, database_dir / "00000003")
+    found = extract_htu.find_htu_history_database(str(tmp_path / "Profile"))
+    assert found == str(database_dir / "00000003")
+
+
+def test_source_fingerprint_on_a_fresh_checkout(tmp_path, monkeypatch):
+    # Nothing has created external_data/ yet
+    external_data_path = tmp_path / "external_data" / "htu"
+    monkeypatch.setattr(extract_htu, "EXTERNAL_DATA_PATH", str(external_data_path))
+    monkeypatch.setattr(extract_htu, "THRESHOLD", 0)
+    monkeypatch.setattr(load, "HTU_PROFILE_PATH", str(tmp_path / "Profile"))
+    database_dir = tmp_path / "Profile" / "File System" / "001" / "t" / "00"
+    os.makedirs(database_dir)
+    create_htu_database(
+        str(database_dir / "00000001"),
+        [(1, "https://duckduckgo.com/?q=one", "one")],
+        [(1, VISIT_TIME)],
+    )
+
+    assert load.get_source_fingerprint("htu_sync") is not None
+    assert extract_htu.load_cached_filepath()["filepath"] == str(database_dir / "00000001")
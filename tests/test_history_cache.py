@@ -0,0 +1,38 @@
+# run: p -m pytest tests/test_history_cache.py
+
+import os
+import sys
+from datetime import datetime
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_cache import CachedSearchHistory, write_history_cache
+from load import get_history
+from process import get_search_history
+from records import SearchRecord
+
+mock_search_history = get_search_history(get_history("tests/mock_history_systems.json"))
+
+
+def test_history_cache_round_trip(tmp_path):
+    cache_path = str(tmp_path / "cache.spc")
+    naive_entry = SearchRecord.from_item(
+        {
+            **mock_search_history[0],
+            "title": "naïve – HTU",
+            "last_visit_time_datetime": datetime(2024, 4, 20, 10, 0, 0, 123),
+        }
+    )
+    history = mock_search_history + [naive_entry]
+    write_history_cache(cache_path, history)
+
+    cached_history = CachedSearchHistory(cache_path)
+    assert len(cached_history) == len(history)
+    assert list(cached_history) == history
+    assert [str(entry["last_visit_time_datetime"]) for entry in cached_history] == [
+        str(entry["last_visit_time_datetime"]) for entry in history
+    ]
+    assert cached_history[-1]["title"] == "naïve – HTU"
+    assert cached_history[2:5] == history[2:5]
+    cached_history.close()
@@ -0,0 +1,199 @@
+# run: p -m pytest tests/test_load.py
+
+import gzip
+import io
+import json
+import os
+import pickle
+import sqlite3
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import load
+import utils
+import main
+import segments
+from segments import SegmentedSearchHistory, load_manifest
+from main import get_incremental_search_history
+from helpers import CHROME_TIME, HOUR, create_chromium_profile
+
+
+def test_get_chromium_history_streams_items(tmp_path):
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path,
+        [(i, f"https://duckduckgo.com/?q={i}", str(i), 1, CHROME_TIME + i) for i in range(1, 12)],
+    )
+    history = load.get_history(profile_path)
+    assert next(history)["title"] == "11"
+    assert [item["title"] for item in history] == [str(i) for i in range(10, 0, -1)]
+
+
+def test_get_incremental_chromium_history(tmp_path):
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path,
+        [
+            (1, "https://www.google.com/search?q=one", "one", 1, CHROME_TIME),
+            (2, "https://duckduckgo.com/?q=two", "two", 1, CHROME_TIME + HOUR),
+        ],
+    )
+    history, high_water_mark = load.get_incremental_chromium_history(profile_path)
+    assert [item["title"] for item in history] == ["two", "one"]
+    assert high_water_mark == (CHROME_TIME + HOUR, 2)
+
+    history, _ = load.get_incremental_chromium_history(profile_path, high_water_mark)
+    assert list(history) == []
+
+
+def test_get_incremental_chromium_history_opens_the_database_once(tmp_path, monkeypatch):
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path, [(1, "https://www.google.com/search?q=one", "one", 1, CHROME_TIME)]
+    )
+    opened = []
+
+    def open_history_database(history_db):
+        opened.append(history_db)
+        return utils.open_history_database(history_db)
+
+    monkeypatch.setattr(load, "open_history_database", open_history_database)
+    history, high_water_mark = load.get_incremental_chromium_history(profile_path)
+    assert [item["title"] for item in history] == ["one"]
+    assert high_water_mark == (CHROME_TIME, 1)
+    assert len(opened) == 1
+
+
+def test_get_incremental_search_history(tmp_path, monkeypatch):
+    monkeypatch.setattr(load, "INGEST_STATE_DIR", str(tmp_path / "incremental"))
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path,
+        [
+            (1, "https://www.google.com/search?q=one", "one", 1, CHROME_TIME),
+            (2, "https://duckduckgo.com/?q=two", "two", 1, CHROME_TIME + HOUR),
+        ],
+    )
+    search_history = get_incremental_search_history(profile_path)
+    assert [entry["search_query"] for entry in search_history] == ["two", "one"]
+
+    # A new search and a revisit of the first one
+    create_chromium_profile(
+        profile_path,
+        [
+            (1, "https://www.google.com/search?q=one", "one", 2, CHROME_TIME + 3 * HOUR),
+            (3, "https://www.bing.com/search?q=three", "three", 1, CHROME_TIME + 2 * HOUR),
+        ],
+    )
+    search_history = get_incremental_search_history(profile_path)
+    assert [entry["search_query"] for entry in search_history] == ["one", "three", "two"]
+    assert search_history[0]["visit_count"] == 2
+    # Only the high-water mark is kept in the state file
+    assert "search_history" not in load.load_ingest_state(profile_path)
+
+
+def test_get_chromium_context(tmp_path):
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path,
+        [(i, f"https://example.com/{i}", str(i), 1, CHROME_TIME + i * HOUR) for i in range(1, 10)],
+    )
+    context = load.get_chromium_context(profile_path, "https://example.com/5", 2)
+    assert [item["title"] for item in context] == ["7", "6", "5", "4", "3"]
+
+
+def test_get_tsv_history_gzipped(tmp_path):
+    rows = [
+        "\t".join(
+            [
+                f"https://duckduckgo.com/?q={i}",
+                "duckduckgo.com",
+                "duckduckgo.com",
+                str(CHROME_TIME + i * HOUR),
+                "",
+                "",
+                "link",
+                f"title {i}",
+            ]
+        )
+        for i in range(3)
+    ]
+    tsv_path = str(tmp_path / "htu_analyze.tsv.gz")
+    with gzip.open(tsv_path, "wt") as f:
+        f.write("\n".join(rows) + "\n")
+
+    history = load.get_history(tsv_path)
+    assert [item["title"] for item in history] == ["title 0", "title 1", "title 2"]
+
+
+def test_iter_json_array_across_reads():
+    with open("tests/mock_history_systems.json") as f:
+        expected = json.load(f)
+    with open("tests/mock_history_systems.json") as f:
+        assert list(load.iter_json_array(f, read_size=7)) == expected
+    assert list(load.iter_json_array(io.StringIO("[1, 22, 333]"), read_size=1)) == [1, 22, 333]
+
+
+def test_get_ndjson_history(tmp_path):
+    with open("tests/mock_history_simple.json") as f:
+        entries = json.load(f)
+    ndjson_path = str(tmp_path / "history.ndjson")
+    with open(ndjson_path, "w") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    history = list(load.get_history(ndjson_path))
+    assert history == list(load.get_history("tests/mock_history_simple.json"))
+    assert history[0]["url"] == "https://www.google.com/search?q=python+testing"
+
+
+def test_load_search_history_skips_unchanged_sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(load, "PROCESSED_CACHE_DIR", str(tmp_path / "processed"))
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path, [(1, "https://www.google.com/search?q=one", "one", 1, CHROME_TIME)]
+    )
+    assert [item["search_query"] for item in main.load_search_history(profile_path)] == ["one"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the source was reprocessed")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(main, "get_history", fail)
+        # The cache is opened, not decoded, and can be sent to another process
+        cached_history = main.load_search_history(profile_path)
+        assert isinstance(cached_history, SegmentedSearchHistory)
+        assert [item["search_query"] for item in pickle.loads(pickle.dumps(cached_history))] == [
+            "one"
+        ]
+
+    # The cache is rewritten to match the source, and kept whatever its age
+    monkeypatch.setattr(segments, "CACHE_MAX_AGE_DAYS", 1)
+    create_chromium_profile(
+        profile_path,
+        [
+            (1, "https://www.google.com/search?q=one", "one", 2, CHROME_TIME + 2 * HOUR),
+            (2, "https://duckduckgo.com/?q=two", "two", 1, CHROME_TIME + HOUR),
+        ],
+    )
+    search_history = main.load_search_history(profile_path)
+    assert [item["search_query"] for item in search_history] == ["one", "two"]
+    (segment_dir,) = os.listdir(tmp_path / "processed")
+    manifest = load_manifest(str(tmp_path / "processed" / segment_dir))
+    assert [segment["rows"] for segment in manifest["segments"]] == [2]
+    with monkeypatch.context() as patched:
+        patched.setattr(main, "get_history", fail)
+        cached_history = main.load_search_history(profile_path)
+        assert [item["search_query"] for item in cached_history] == ["one", "two"]
+
+    # Visits deleted from the browser do not come back
+    connection = sqlite3.connect(os.path.join(profile_path, "History"))
+    connection.execute("DELETE FROM urls WHERE id = 2")
+    connection.commit()
+    connection.close()
+    main.load_search_history(profile_path)
+    with monkeypatch.context() as patched:
+        patched.setattr(main, "get_history", fail)
+        cached_history = main.load_search_history(profile_path)
+        assert [item["search_query"] for item in cached_history] == ["one"]
@@ -10,6 +10,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from load import get_history
 from process import (
+    merge_search_histories,
     get_search_history,
     get_history_by_week,
     get_search_engine_percentages,
@@ -90,3 +91,62 @@ def test_is_guid_version_of_query():
         "https://www.perplexity.ai/search/?q=is+there+a+kid+focused+search+engine%3F",
         "https://www.perplexity.ai/search/is-there-a-zNl4gXV4Tjmq5_FCHOORHQ?s=u",
     )
+
+
+def test_merge_search_histories():
+    browser = get_search_history(get_history("tests/mock_history_simple.json"))
+    # An HTU sync of the same profile, logged a fraction of a second later
+    htu_sync = [
+        {**entry, "last_visit_time_datetime": entry["last_visit_time_datetime"] + timedelta(seconds=0.5)}
+        for entry in browser[::-1]
+    ]
+    other_browser = [
+        {**browser[0], "url": "https://www.bing.com/search?q=python+testing"},
+        {**browser[1], "last_visit_time_datetime": browser[1]["last_visit_time_datetime"] + timedelta(hours=1)},
+    ]
+    merged = merge_search_histories([browser, htu_sync, other_browser])
+    timestamps = [entry["last_visit_time_datetime"] for entry in merged]
+    assert timestamps == sorted(timestamps, reverse=True)
+    assert len(merged) == 5
+
+
+def test_search_query_parameters_per_engine():
+    entry = next(get_history("tests/mock_history_simple.json"))
+    history = [
+        {**entry, "url": "https://www.baidu.com/s?ie=utf-8&wd=%E6%90%9C%E7%B4%A2"},
+        {**entry, "url": "https://yandex.ru/search/?lr=1&text=search+paths"},
+        {**entry, "url": "https://search.yahoo.com/search?q=ignored&p=yahoo"},
+    ]
+    search_history = get_search_history(history)
+    assert [entry["search_query"] for entry in search_history] == ["搜索", "search paths", "yahoo"]
+    assert [entry["search_engine"] for entry in search_history] == [
+        "baidu.com",
+        "yandex.ru",
+        "search.yahoo.com",
+    ]
+
+
+def test_perplexity_copilot_pair_is_a_redirect_mid_history():
+    start = datetime(2024, 4, 20, 10, 0)
+
+    def item(seconds, url):
+        return {
+            "url": url,
+            "title": "",
+            "visit_count": 1,
+            "last_visit_time": "",
+            "last_visit_time_datetime": start + timedelta(seconds=seconds),
+        }
+
+    # Newest first, with the copilot/redirect pair alone in its dedup window
+    history = [
+        item(14400, "https://duckduckgo.com/?q=later"),
+        item(7201, "https://www.perplexity.ai/search/?q=kids+search&copilot=true"),
+        item(7200, "https://www.perplexity.ai/search/?q=kids+search"),
+        item(0, "https://www.google.com/search?q=earlier"),
+    ]
+    labels = [
+        (entry["search_label"], entry["included_search_entry"])
+        for entry in get_search_history(history)
+    ]
+    assert labels == [(None, True), (None, True), ("redirect", False), (None, True)]
@@ -0,0 +1,46 @@
+# run: p -m pytest tests/test_records.py
+
+import os
+import pickle
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import records
+from records import SearchRecord
+
+PDT = timezone(timedelta(hours=-7), "PDT")
+
+
+def test_search_record_dict_access():
+    record = SearchRecord(
+        "https://www.google.com/search?q=a", "a", 2, datetime(2024, 4, 22, 9, 30, tzinfo=PDT)
+    )
+    record["search_query"] = "a"
+    record["search_engine"] = "google.com"
+    record["included_search_entry"] = True
+    record["default_visible"] = False
+
+    assert record["last_visit_time"] == "2024-04-22 09:30:00"
+    assert record["last_visit_time_datetime"].tzname() == "PDT"
+    assert record.timestamp == datetime(2024, 4, 22, 16, 30, tzinfo=timezone.utc).timestamp()
+    assert record["parsed_url"].engine == "google.com"
+    assert record.get("search_label") is None
+    assert dict(record)["included_search_entry"] is True
+    assert dict(record)["default_visible"] is False
+    assert not hasattr(record, "__dict__")
+    assert SearchRecord.from_item(dict(record)) == record
+
+
+def test_search_record_pickles_engine_names():
+    record = SearchRecord(
+        "https://duckduckgo.com/?q=b", "b", 1, datetime(2024, 4, 22, 9, 30), "b", "duckduckgo.com"
+    )
+    pickled = pickle.dumps(record)
+    # Another process interns engines in another order
+    records.ENGINES.index("bing.com")
+    unpickled = pickle.loads(pickled)
+    assert unpickled["search_engine"] == "duckduckgo.com"
+    assert unpickled["last_visit_time_datetime"] == datetime(2024, 4, 22, 9, 30)
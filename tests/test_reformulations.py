@@ -0,0 +1,72 @@
+# run: p -m pytest tests/test_reformulations.py
+
+import os
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reformulations import (
+    NEAR_DUPLICATE,
+    REFINEMENT,
+    REPEAT,
+    get_jaccard_similarity,
+    get_reformulation_stats,
+    get_shingles,
+    get_signature,
+    iter_reformulations,
+)
+from helpers import search
+
+def test_iter_reformulations_links_retries_across_engines():
+    history = [
+        search(0, "google.com", "how to center a div in css"),
+        search(1, "perplexity.ai", "How to center a div in CSS?"),
+        search(2, "google.com", "sourdough starter"),
+        search(3, "google.com", "sourdough starter feeding schedule"),
+        search(4, "duckduckgo.com", "how to centre a div in css"),
+        # Too long after the first search to be a retry of it
+        search(30, "bing.com", "how to center a div in css"),
+    ]
+    links = [
+        (link.original["search_query"], link.reformulation["search_query"], link.kind, link.cross_engine)
+        for link in iter_reformulations(history, window_minutes=10)
+    ]
+    assert links == [
+        ("how to center a div in css", "How to center a div in CSS?", REPEAT, True),
+        ("sourdough starter", "sourdough starter feeding schedule", REFINEMENT, False),
+        ("How to center a div in CSS?", "how to centre a div in css", NEAR_DUPLICATE, True),
+    ]
+
+    stats = get_reformulation_stats(iter_reformulations(history, window_minutes=10))
+    assert stats["reformulations"] == 3
+    assert stats["cross_engine"] == 2
+    assert stats["kinds"] == {REPEAT: 1, REFINEMENT: 1, NEAR_DUPLICATE: 1}
+    assert stats["engine_pairs"] == [
+        (("google.com", "perplexity.ai"), 1),
+        (("perplexity.ai", "duckduckgo.com"), 1),
+    ]
+
+
+def test_iter_reformulations_links_refinements_with_low_similarity():
+    history = [
+        search(0, "google.com", "rust"),
+        search(1, "google.com", "rust borrow checker lifetimes explained"),
+    ]
+    first, second = (get_shingles(entry["search_query"]) for entry in history)
+    assert get_jaccard_similarity(first, second) < 0.25
+    links = [
+        (link.original["search_query"], link.reformulation["search_query"], link.kind)
+        for link in iter_reformulations(history, window_minutes=10)
+    ]
+    assert links == [("rust", "rust borrow checker lifetimes explained", REFINEMENT)]
+
+
+def test_signatures_estimate_similarity():
+    first = get_shingles("best hiking trails near seattle")
+    second = get_shingles("best hiking trails near tacoma")
+    first_signature, second_signature = get_signature(first), get_signature(second)
+    estimate = sum(a == b for a, b in zip(first_signature, second_signature)) / len(first_signature)
+    assert abs(estimate - get_jaccard_similarity(first, second)) < 0.2
+    # Stable between runs, as the index relies on it
+    assert get_signature(first) == first_signature
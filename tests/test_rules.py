@@ -0,0 +1,97 @@
+# run: p -m pytest tests/test_rules.py
+
+import json
+import os
+import sqlite3
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dedup
+import rules
+import urls as url_parsing
+from dedup import DedupIndex
+from process import is_likely_countable_search_url
+from rules import (
+    compile_rules,
+    get_rules_fingerprint,
+    get_search_candidate_filter,
+    minimal_substrings,
+)
+
+
+def test_classify_matches_config_rules():
+    url_rules = compile_rules(["https://www.perplexity.ai/search/"])
+
+    chat = url_rules.classify("https://claude.ai/chat/123")
+    assert chat.included_search_system and chat.chat_based_search_complement
+    assert not chat.landing_page
+
+    landing = url_rules.classify("https://andisearch.com/")
+    assert landing.landing_page and landing.landing_page_only
+
+    assert url_rules.classify("https://github.com/search?q=x").site_search
+    assert url_rules.classify("https://www.google.com/url?q=x").excluded
+    assert url_rules.classify("https://www.tiktok.com/foryou?q=x").excluded
+    assert url_rules.classify("https://foo.vercel.app/?q=x").excluded
+    assert not url_rules.classify("https://www.google.com/search?q=x").excluded
+    assert not url_rules.classify("https://example.com/about").matches_search_pattern
+    assert (
+        url_rules.classify("https://www.perplexity.ai/search/?q=x").cleanup_site
+        == "https://www.perplexity.ai/search/"
+    )
+
+
+def test_classify_with_many_systems(monkeypatch):
+    systems = [f"https://search{i}.example.com/" for i in range(1000)]
+    monkeypatch.setattr(rules, "INCLUDED_SEARCH_SYSTEMS", systems)
+    url_rules = compile_rules()
+    assert url_rules.classify("https://search999.example.com/chat").included_search_system
+    assert url_rules.classify("https://search10.example.com/").landing_page
+    assert not url_rules.classify("https://search1000.example.com/").included_search_system
+
+
+def test_minimal_substrings():
+    assert minimal_substrings(["search?q=", "q=", "query=", "search?p="]) == [
+        "q=",
+        "query=",
+        "search?p=",
+    ]
+
+
+def test_search_candidate_filter_matches_python_rules():
+    with open("tests/mock_history_systems.json") as f:
+        urls = [entry["url"] for entry in json.load(f)]
+    urls += [
+        "https://news.ycombinator.com/item?id=1",
+        "http://localhost:3000/search?q=local",
+        "https://preview.vercel.app/search?q=preview",
+        "https://www.google.com/url?q=https://example.com",
+    ]
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE urls (url TEXT, visit_count INTEGER)")
+    connection.executemany("INSERT INTO urls VALUES (?, 1)", [(url,) for url in urls])
+    predicate, parameters = get_search_candidate_filter()
+    candidates = {
+        url for (url,) in connection.execute(f"SELECT url FROM urls WHERE {predicate}", parameters)
+    }
+
+    # The prefilter may keep more than the Python rules, but never less
+    countable = {url for url in urls if is_likely_countable_search_url(DedupIndex(), url, 1)}
+    assert countable <= candidates
+    assert "https://news.ycombinator.com/item?id=1" not in candidates
+    assert "http://localhost:3000/search?q=local" not in candidates
+    assert "https://preview.vercel.app/search?q=preview" not in candidates
+
+
+def test_rules_fingerprint_covers_dedup_and_url_parsing(tmp_path, monkeypatch):
+    fingerprint = get_rules_fingerprint()
+    for module in (dedup, url_parsing):
+        changed_path = tmp_path / os.path.basename(module.__file__)
+        with open(module.__file__) as f:
+            changed_path.write_text(f.read() + "\n# changed\n")
+        with monkeypatch.context() as m:
+            m.setattr(module, "__file__", str(changed_path))
+            assert get_rules_fingerprint() != fingerprint
+    assert get_rules_fingerprint() == fingerprint
@@ -0,0 +1,152 @@
+# run: p -m pytest tests/test_segments.py
+
+import json
+import os
+import sys
+from datetime import timedelta
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segments
+from load import get_history
+from process import get_search_history
+from records import SearchRecord
+
+mock_search_history = get_search_history(get_history("tests/mock_history_systems.json"))
+
+
+def shifted(history, hours):
+    return [
+        SearchRecord.from_item(
+            {
+                **entry,
+                "url": f"{entry['url']}#{hours}",
+                "last_visit_time_datetime": entry["last_visit_time_datetime"]
+                + timedelta(hours=hours),
+            }
+        )
+        for entry in history
+    ]
+
+
+def test_append_only_writes_new_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    segments.append_segment(mock_search_history)
+    segments.append_segment(mock_search_history)
+    assert len(segments.load_manifest()["segments"]) == 1
+
+    newer = shifted(mock_search_history[:2], 24 * 365)
+    segments.append_segment(mock_search_history + newer)
+    manifest = segments.load_manifest()
+    assert [segment["rows"] for segment in manifest["segments"]] == [
+        len(mock_search_history),
+        2,
+    ]
+    history = segments.load_segments()
+    assert list(history) == newer + mock_search_history
+    history.close()
+
+
+def test_compaction_merges_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    monkeypatch.setattr(segments, "CACHE_MAX_SEGMENTS", 2)
+    for hours in range(3):
+        compaction = segments.append_segment(shifted(mock_search_history[:2], hours * 24 * 365))
+    compaction.join()
+
+    manifest = segments.load_manifest()
+    assert [segment["rows"] for segment in manifest["segments"]] == [6]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [manifest["segments"][0]["name"], segments.MANIFEST_NAME]
+    )
+    history = segments.load_segments()
+    visit_times = [entry["last_visit_time_datetime"].timestamp() for entry in history]
+    assert visit_times == sorted(visit_times, reverse=True)
+    history.close()
+
+
+def test_retention_by_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    monkeypatch.setattr(segments, "CACHE_MAX_SIZE_MB", 0)
+    segments.append_segment(mock_search_history)
+    segments.append_segment(shifted(mock_search_history[:1], 24 * 365))
+    manifest = segments.load_manifest()
+    assert [segment["rows"] for segment in manifest["segments"]] == [1]
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_retention_skips_segments_being_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    for hours in range(2):
+        segments.append_segment(shifted(mock_search_history[:2], hours * 24 * 365))
+    open_segment = segments.CachedSearchHistory
+
+    def open_while_appending(path):
+        # Another run appends, and applies retention, while the segments are read
+        monkeypatch.setattr(segments, "CACHE_MAX_SIZE_MB", 0)
+        segments.append_segment(shifted(mock_search_history[:1], 3 * 24 * 365))
+        return open_segment(path)
+
+    monkeypatch.setattr(segments, "CachedSearchHistory", open_while_appending)
+    segments.compact_segments()
+
+    manifest = segments.load_manifest()
+    assert [segment["rows"] for segment in manifest["segments"]] == [4, 1]
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [segment["name"] for segment in manifest["segments"]] + [segments.MANIFEST_NAME]
+    )
+
+
+def test_revisited_urls_are_kept_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    older = mock_search_history[1:3]
+    revisit = SearchRecord.from_item(
+        {
+            **older[0],
+            "last_visit_time_datetime": older[0]["last_visit_time_datetime"]
+            + timedelta(days=365),
+        }
+    )
+    segments.append_segment(older, replace_revisited=True)
+    segments.append_segment([revisit], replace_revisited=True)
+    history = segments.load_segments()
+    assert list(history) == [revisit, older[1]]
+    history.close()
+
+    segments.compact_segments()
+    assert [segment["rows"] for segment in segments.load_manifest()["segments"]] == [2]
+    history = segments.load_segments()
+    assert list(history) == [revisit, older[1]]
+    history.close()
+
+
+def test_caches_without_retention_keep_everything(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    monkeypatch.setattr(segments, "CACHE_MAX_AGE_DAYS", 1)
+    monkeypatch.setattr(segments, "CACHE_MAX_SIZE_MB", 0)
+    segments.append_segment(mock_search_history, retention=False)
+    segments.append_segment(shifted(mock_search_history[:1], 24 * 365), retention=False)
+    manifest = segments.load_manifest()
+    assert [segment["rows"] for segment in manifest["segments"]] == [len(mock_search_history), 1]
+
+    segments.compact_segments()
+    manifest = segments.load_manifest()
+    assert [segment["rows"] for segment in manifest["segments"]] == [len(mock_search_history) + 1]
+
+
+def test_segments_of_another_cache_format_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", str(tmp_path))
+    segments.append_segment(mock_search_history)
+    manifest = segments.load_manifest()
+    manifest["cache_version"] = segments.CACHE_VERSION - 1
+    with open(segments.get_manifest_path(), "w") as f:
+        json.dump(manifest, f)
+    assert segments.load_segments() is None
+
+    segments.clear_segments()
+    assert os.listdir(tmp_path) == [segments.MANIFEST_NAME]
+    segments.append_segment(mock_search_history)
+    history = segments.load_segments()
+    assert list(history) == mock_search_history
+    history.close()
@@ -0,0 +1,92 @@
+# run: p -m pytest tests/test_sessions.py
+
+import os
+import sys
+from datetime import timedelta
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load import get_history
+from process import get_search_history
+from records import SearchRecord
+from sessions import get_session_stats, iter_sessions
+from store import HistoryStore
+from helpers import CHROME_TIME, MINUTE, START, create_chromium_profile, search
+
+def page(minutes, url):
+    return SearchRecord(url, "", 1, START + timedelta(minutes=minutes))
+
+
+def test_iter_sessions_splits_at_inactivity():
+    history = [
+        page(0, "https://example.com/before"),
+        search(1, "google.com", "rust borrow checker"),
+        page(3, "https://doc.rust-lang.org/book"),
+        search(10, "google.com", "rust borrow checker"),
+        search(12, "perplexity.ai", "rust borrow checker explained"),
+        search(15, "google.com", "rust lifetimes"),
+        # More than 30 minutes later
+        page(60, "https://example.com/after"),
+        search(61, "duckduckgo.com", "sourdough starter"),
+    ]
+    sessions = list(iter_sessions(history, inactivity_gap_minutes=30))
+    assert len(sessions) == 2
+
+    first, second = sessions
+    assert first.engines == ["google.com", "perplexity.ai"]
+    assert first.query_chain == [
+        ("google.com", "rust borrow checker"),
+        ("perplexity.ai", "rust borrow checker explained"),
+        ("google.com", "rust lifetimes"),
+    ]
+    assert first.engine_switches == [
+        ("google.com", "perplexity.ai"),
+        ("perplexity.ai", "google.com"),
+    ]
+    assert [entry["url"] for entry in first.pages] == ["https://doc.rust-lang.org/book"]
+    assert first.duration == timedelta(minutes=14)
+    # The page before the first search of a session belongs to none
+    assert second.pages == [] and len(second.searches) == 1
+
+
+def test_get_session_stats():
+    history = [
+        search(0, "google.com", "a"),
+        search(5, "bing.com", "b"),
+        search(100, "google.com", "c"),
+    ]
+    stats = get_session_stats(iter_sessions(history, inactivity_gap_minutes=30))
+    assert stats["sessions"] == 2
+    assert stats["searches"] == 3
+    assert stats["mean_searches_per_session"] == 1.5
+    assert stats["mean_duration_minutes"] == 2.5
+    assert stats["sessions_with_engine_switches"] == 1
+    assert stats["engine_switches"] == [(("google.com", "bing.com"), 1)]
+    assert get_session_stats([])["sessions"] == 0
+
+
+def test_chromium_sessions_include_the_pages_between_searches(tmp_path):
+    profile_path = str(tmp_path / "Default")
+    create_chromium_profile(
+        profile_path,
+        [
+            (1, "https://www.google.com/search?q=one", "one", 1, CHROME_TIME),
+            (2, "https://example.com/one", "one", 1, CHROME_TIME + 20 * MINUTE),
+            (3, "https://duckduckgo.com/?q=two", "two", 1, CHROME_TIME + 45 * MINUTE),
+            (4, "https://example.com/two", "two", 1, CHROME_TIME + 50 * MINUTE),
+            (5, "https://example.com/later", "later", 1, CHROME_TIME + 200 * MINUTE),
+        ],
+    )
+
+    # The store only holds the search candidates, so the searches look 45 minutes apart
+    store = HistoryStore(get_search_history(get_history(profile_path, candidates_only=True)))
+    assert len(list(iter_sessions(store.records))) == 2
+
+    store = HistoryStore(store.records, profile_path)
+    (session,) = iter_sessions(store.get_timeline(store.records))
+    assert [entry["search_query"] for entry in session.searches] == ["one", "two"]
+    assert [entry["url"] for entry in session.pages] == [
+        "https://example.com/one",
+        "https://example.com/two",
+    ]
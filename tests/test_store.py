@@ -0,0 +1,108 @@
+# run: p -m pytest tests/test_store.py
+
+import os
+import sys
+from datetime import timedelta
+from unittest.mock import patch
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load import get_history
+from process import get_search_engine_percentages, get_search_history, merge_search_history
+from store import HistoryStore
+from utils import get_total_timespan_logged
+
+mock_search_history = get_search_history(get_history("tests/mock_history_systems.json"))
+
+
+def test_history_store_records_are_chronological():
+    store = HistoryStore(mock_search_history)
+    timestamps = [record["last_visit_time_datetime"] for record in store.records]
+    assert timestamps == sorted(timestamps)
+    assert all(search["search_query"] is not None for search in store.searches)
+
+
+def test_history_store_answers_periods_from_its_index():
+    store = HistoryStore(mock_search_history)
+    with patch("process.get_filtered_history") as filtered_history, patch(
+        "process.get_total_timespan_logged"
+    ) as timespan_logged:
+        for week_num in range(3):
+            store.get_search_engine_percentages(week_num=week_num)
+        store.get_search_engine_percentages(by_month=True)
+        filtered_history.assert_not_called()
+        timespan_logged.assert_not_called()
+    assert store.get_total_timespan_logged("week") == get_total_timespan_logged(
+        mock_search_history, "week"
+    )
+    assert store.get_total_timespan_logged("month") == get_total_timespan_logged(
+        mock_search_history, "month"
+    )
+
+
+def test_history_store_rollups_match_counting_each_period():
+    store = HistoryStore(mock_search_history)
+    views = [{"full_history": True}]
+    for num in range(store.get_total_timespan_logged("month") + 2):
+        views.append({"by_month": True, "month_num": num})
+    for num in range(store.get_total_timespan_logged("week", False) + 2):
+        views.append({"week_num": num})
+        views.append({"week_num": num, "start_on_monday": False})
+    for view in views:
+        for hide_complements in (True, False):
+            expected = get_search_engine_percentages(
+                store.records, hide_complements=hide_complements, **view
+            )
+            with patch("process.HistoryColumns") as columns:
+                result = store.get_search_engine_percentages(
+                    hide_complements=hide_complements, **view
+                )
+                columns.assert_not_called()
+            # Week dates keep the time of day they were computed at
+            for bound in ("start_date", "end_date"):
+                assert result.pop(bound).date() == expected.pop(bound).date()
+            assert result == expected
+
+
+def get_rollup_counts(store):
+    return {
+        key: dict(rollup.search_engines)
+        for key, rollup in store.rollups.rollups.items()
+        if rollup.total_searches
+    }
+
+
+def test_history_store_add_matches_building_it_again():
+    records = HistoryStore(mock_search_history).records
+    older, newer = records[: len(records) // 2], records[len(records) // 2 :]
+    # A search from the older half, visited again after the newer one
+    search = next(record for record in older if record["included_search_entry"])
+    revisit = {
+        "url": search["url"],
+        "title": search["title"],
+        "visit_count": 2,
+        "last_visit_time_datetime": newer[-1]["last_visit_time_datetime"] + timedelta(hours=1),
+    }
+    newer = newer + get_search_history([revisit])
+    for replace_revisited in (True, False):
+        store = HistoryStore(older)
+        with patch("store.EngineRollups") as rollups, patch("rollups.aggregate_periods") as periods:
+            store.add(newer[::-1], replace_revisited)
+            rollups.assert_not_called()
+            periods.assert_not_called()
+        expected = HistoryStore(merge_search_history(older[::-1], newer[::-1], replace_revisited))
+        assert sorted(map(id, store.records)) == sorted(map(id, expected.records))
+        timestamps = [record["last_visit_time_datetime"] for record in store.records]
+        assert timestamps == sorted(timestamps)
+        assert store.searches == [r for r in store.records if r["search_query"] is not None]
+        assert store.time_index.keys == expected.time_index.keys
+        assert get_rollup_counts(store) == get_rollup_counts(expected)
+
+
+def test_history_store_get_context():
+    store = HistoryStore(mock_search_history)
+    search = store.records[10]
+    context = store.get_context(search, context_window=2)
+    assert context == store.records[8:13][::-1]
+    assert store.get_context(store.records[0], context_window=2) == store.records[0:3][::-1]
@@ -0,0 +1,38 @@
+# run: p -m pytest tests/test_urls.py
+
+import os
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from urls import QueryParameterExtractor, get_parsed_url, parse_url
+
+
+def test_parsed_url_parts():
+    parsed_url = parse_url("https://www.google.co.uk:443/search?q=a+b&q=c&hl=en#top")
+    assert parsed_url._parts is None
+    assert parsed_url.scheme == "https"
+    assert parsed_url.host == "www.google.co.uk"
+    assert parsed_url.domain == "google.co.uk"
+    assert parsed_url.engine == "google.co.uk:443"
+    assert parsed_url.path == "/search"
+    assert parsed_url.params == {"q": ["a b", "c"], "hl": ["en"]}
+    assert parsed_url.base == "https://www.google.co.uk:443/search#top"
+    assert parse_url("https://search.brave.com/search?q=x").domain == "brave.com"
+    assert parse_url("http://127.0.0.1:8000/?q=x").domain == "127.0.0.1"
+
+
+def test_get_parsed_url_parses_once():
+    entry = {"url": "https://duckduckgo.com/?q=x"}
+    parsed_url = get_parsed_url(entry)
+    assert entry["parsed_url"] is parsed_url
+    assert get_parsed_url(entry) is parsed_url
+
+
+def test_query_parameter_extractor_priority():
+    extractor = QueryParameterExtractor(["q", "query", "p"])
+    assert extractor.extract("p=third&query=second&fr=yfp") == "second"
+    assert extractor.extract("p=x&q=a+b%2Bc&q=later") == "a b+c"
+    assert extractor.extract("q=&p=fallback") == "fallback"
+    assert extractor.extract("hl=en&page") is None
@@ -1,12 +1,22 @@
 # run: p -m pytest tests/test_utils.py
 
 import os
+import sqlite3
 import sys
 from datetime import datetime
 
 from load import get_history
 from process import get_search_history
-from utils import get_filtered_history
+from utils import (
+    CHROME_EPOCH_MICROSECONDS,
+    convert_chrome_time,
+    convert_chrome_times,
+    get_filtered_history,
+    get_local_zone_transitions,
+    get_total_timespan_logged,
+    open_history_database,
+    TimeIndex,
+)
 
 
 # Add the parent directory to the Python path
@@ -34,3 +44,55 @@ def test_get_filtered_history_all():
     result = get_filtered_history(mock_search_history, start_date, end_date)
     assert len(result) == 3
 
+
+def test_time_index_matches_get_filtered_history():
+    time_index = TimeIndex(mock_search_history)
+    periods = [("2024-04-22", "2024-04-25"), ("2024-04-21", "2024-04-27"), ("2024-04-01", "2024-04-27")]
+    for start, end in periods:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d")
+        expected = get_filtered_history(mock_search_history, start_date, end_date)
+        result = time_index.get_filtered_history(start_date, end_date)
+        assert sorted(map(id, result)) == sorted(map(id, expected))
+    assert time_index.get_total_timespan_logged("day") == get_total_timespan_logged(
+        mock_search_history, "day"
+    )
+
+
+
+def test_open_history_database_in_place(tmp_path):
+    db_path = str(tmp_path / "History")
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE urls (url TEXT)")
+    connection.execute("INSERT INTO urls VALUES ('https://duckduckgo.com/?q=a')")
+    connection.commit()
+    connection.close()
+
+    with open_history_database(db_path) as c:
+        assert c.execute("SELECT count(*) FROM urls").fetchone() == (1,)
+    assert os.listdir(tmp_path) == ["History"]
+
+
+def test_open_history_database_locked_by_browser(tmp_path):
+    db_path = str(tmp_path / "History")
+    browser = sqlite3.connect(db_path, isolation_level=None)
+    browser.execute("CREATE TABLE urls (url TEXT)")
+    browser.execute("INSERT INTO urls VALUES ('https://duckduckgo.com/?q=a')")
+    browser.execute("BEGIN EXCLUSIVE")
+
+    with open_history_database(db_path) as c:
+        assert c.execute("SELECT count(*) FROM urls").fetchone() == (1,)
+    browser.close()
+
+
+def test_convert_chrome_times_matches_convert_chrome_time():
+    chrome_times = ["2024-04-20 10:00:00", "0", 13357130400123456]
+    # Every second around each UTC offset change of the local timezone
+    for start in get_local_zone_transitions(2024)[0]:
+        chrome_times += [
+            (start + seconds) * 1000000 + CHROME_EPOCH_MICROSECONDS for seconds in range(-2, 3)
+        ]
+    expected = [convert_chrome_time(str(chrome_time)) for chrome_time in chrome_times]
+    converted = convert_chrome_times(chrome_times)
+    assert converted == expected
+    assert [str(item) for item in converted] == [str(item) for item in expected]
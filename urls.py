@@ -0,0 +1,142 @@
+"""
+This module contains the parsed-URL record shared by processing, display and export:
+- splitting a URL into its scheme, host, registrable domain, path and query
+- decoding the query parameters lazily, only when they are used
+- getting the parsed URL of a record, parsing it only the first time
+- extracting one parameter from a raw query string
+"""
+
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+from urllib.parse import SplitResult, parse_qs, unquote_plus, urlsplit
+
+# Public suffixes with two labels, under which a registrable domain has three
+MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "co.jp", "ne.jp", "or.jp",
+    "com.au", "net.au", "org.au", "co.nz", "co.in", "co.kr", "co.za",
+    "com.br", "com.cn", "com.mx", "com.tr", "com.tw", "com.hk", "com.sg",
+}
+
+
+class ParsedURL:
+    """
+    A URL split into its parts. Nothing is parsed when it is created: the URL
+    is split the first time a part is read and the query parameters are
+    decoded the first time they are read, and both are then kept.
+    """
+
+    # Slotted, since one is kept on every record
+    __slots__ = ("url", "_parts", "_params")
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._parts: Optional[SplitResult] = None
+        self._params: Optional[Dict[str, List[str]]] = None
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ParsedURL) and other.url == self.url
+
+    def __hash__(self) -> int:
+        return hash(self.url)
+
+    def __repr__(self) -> str:
+        return f"ParsedURL({self.url!r})"
+
+    @property
+    def parts(self) -> SplitResult:
+        if self._parts is None:
+            self._parts = urlsplit(self.url)
+        return self._parts
+
+    @property
+    def scheme(self) -> str:
+        return self.parts.scheme
+
+    @property
+    def netloc(self) -> str:
+        return self.parts.netloc
+
+    @property
+    def host(self) -> str:
+        return self.parts.hostname or ""
+
+    @property
+    def domain(self) -> str:
+        """The registrable domain, e.g. google.co.uk for www.google.co.uk."""
+        labels = self.host.split(".")
+        if len(labels) <= 2 or all(label.isdigit() for label in labels):
+            return self.host
+        if ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+            return ".".join(labels[-3:])
+        return ".".join(labels[-2:])
+
+    @property
+    def path(self) -> str:
+        return self.parts.path
+
+    @property
+    def query(self) -> str:
+        return self.parts.query
+
+    @property
+    def params(self) -> Dict[str, List[str]]:
+        if self._params is None:
+            self._params = parse_qs(self.parts.query)
+        return self._params
+
+    @property
+    def base(self) -> str:
+        """The URL without its query string."""
+        return self.parts._replace(query="").geturl()
+
+    @property
+    def engine(self) -> str:
+        """The name search engines are counted under."""
+        return self.netloc.replace("www.", "")
+
+
+def parse_url(url: str) -> ParsedURL:
+    return ParsedURL(url)
+
+
+def get_parsed_url(entry: Mapping[str, Any]) -> ParsedURL:
+    """
+    Returns the parsed URL stored on a record. Records loaded from before it
+    was stored are parsed on the spot.
+    """
+    parsed_url = entry.get("parsed_url")
+    if parsed_url is None:
+        parsed_url = parse_url(entry["url"])
+        if isinstance(entry, dict):
+            entry["parsed_url"] = parsed_url
+    return parsed_url
+
+
+class QueryParameterExtractor:
+    """
+    Finds the first of several parameters in a raw query string. The fields
+    are scanned once, keeping the match with the highest priority and stopping
+    at a match with the first key, and only that value is decoded. Matches
+    parse_qs: fields without a value are ignored and the first one wins.
+    """
+
+    def __init__(self, keys: Sequence[str]) -> None:
+        self.keys = list(dict.fromkeys(keys))
+        self.priorities = {key: priority for priority, key in enumerate(self.keys)}
+
+    def extract(self, query: str) -> Optional[str]:
+        best_priority = len(self.keys)
+        best_value = None
+        for field in query.split("&"):
+            name, _, value = field.partition("=")
+            if not value:
+                continue
+            if "%" in name or "+" in name:
+                name = unquote_plus(name)
+            priority = self.priorities.get(name, best_priority)
+            if priority < best_priority:
+                best_priority, best_value = priority, value
+                if priority == 0:
+                    break
+        if best_value is None:
+            return None
+        return unquote_plus(best_value)
@@ -2,14 +2,101 @@
 This module contains utility functions.
 """
 
-from datetime import datetime, timedelta
-from typing import List
+import calendar
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Tuple, Union
+from urllib.parse import quote
 
 import pytz
 
 from sp_types import SearchHistoryItem
 
 
+# Pragmas for reading large history databases: memory-map up to 256 MB of the
+# file and give the page cache 64 MB
+READ_PRAGMAS = {
+    "query_only": "ON",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+def connect_for_reading(db_path: str, read_only: bool = True) -> sqlite3.Connection:
+    if read_only:
+        uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, timeout=0)
+    else:
+        connection = sqlite3.connect(db_path)
+    try:
+        for pragma, value in READ_PRAGMAS.items():
+            connection.execute(f"PRAGMA {pragma} = {value}")
+        # Touch the schema so a locked database fails here rather than mid-read
+        connection.execute("SELECT count(*) FROM sqlite_master").fetchone()
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+@contextmanager
+def open_history_database(db_path: str) -> Iterator[sqlite3.Connection]:
+    """
+    Opens a browser's SQLite database read-only where it is, without copying it.
+
+    Browsers hold a lock on their history database while they are running. In
+    that case the database (and its journal/WAL) is copied to a temporary
+    directory that is removed once the connection is closed.
+    """
+    try:
+        connection = connect_for_reading(db_path)
+    except sqlite3.OperationalError as e:
+        if "locked" not in str(e):
+            raise
+    else:
+        try:
+            yield connection
+        finally:
+            connection.close()
+        return
+
+    with tempfile.TemporaryDirectory(prefix="searchpaths_") as temp_dir:
+        copied_db = os.path.join(temp_dir, os.path.basename(db_path))
+        for suffix in ["", "-wal", "-journal"]:
+            if os.path.exists(db_path + suffix):
+                shutil.copyfile(db_path + suffix, copied_db + suffix)
+        # The copy is ours, so SQLite may roll back or checkpoint a copied journal
+        connection = connect_for_reading(copied_db, read_only=False)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+DAY_SECONDS = 24 * 60 * 60
+
+# Number of rows pulled from a SQLite cursor at a time
+FETCH_BATCH_SIZE = 5000
+
+
+def iter_cursor_batches(
+    cursor: sqlite3.Cursor, batch_size: int = FETCH_BATCH_SIZE
+) -> Iterator[List[tuple]]:
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
 def convert_chrome_time(chrome_time: str) -> datetime:
     try:
         chrome_time_int = int(chrome_time)
@@ -24,6 +111,115 @@ def convert_chrome_time(chrome_time: str) -> datetime:
         return utc_time.replace(tzinfo=pytz.utc).astimezone(tz=None)
 
 
+# Microseconds between the Chrome epoch (1601-01-01) and the Unix epoch
+CHROME_EPOCH_MICROSECONDS = 11644473600 * 1000000
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def get_chrome_time(visit_datetime: datetime) -> int:
+    """The Chrome time of an aware (or local naive) datetime."""
+    return round(visit_datetime.timestamp() * 1000000) + CHROME_EPOCH_MICROSECONDS
+
+
+def get_local_zone(seconds: int) -> timezone:
+    local = time.localtime(seconds)
+    return timezone(timedelta(seconds=local.tm_gmtoff), local.tm_zone)
+
+
+@lru_cache(maxsize=None)
+def get_local_zone_transitions(year: int) -> Tuple[List[int], List[timezone], int]:
+    """
+    Returns the start (in epoch seconds) and local timezone of every UTC offset
+    period in a year, along with the end of the year.
+    """
+    year_start = calendar.timegm((year, 1, 1, 0, 0, 0))
+    year_end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+    starts = [year_start]
+    zones = [get_local_zone(year_start)]
+    previous = year_start
+    for moment in list(range(year_start + DAY_SECONDS, year_end, DAY_SECONDS)) + [year_end - 1]:
+        zone = get_local_zone(moment)
+        if zone != zones[-1]:
+            # Offsets change at most once a day, so find the exact second in between
+            low, high = previous, moment
+            while high - low > 1:
+                middle = (low + high) // 2
+                if get_local_zone(middle) == zones[-1]:
+                    low = middle
+                else:
+                    high = middle
+            starts.append(high)
+            zones.append(get_local_zone(high))
+        previous = moment
+    return starts, zones, year_end
+
+
+class LocalZoneLookup:
+    """
+    Finds the local timezone of epoch seconds from the cached offset
+    transitions, remembering the period of the previous lookup since
+    histories are sorted by time.
+    """
+
+    def __init__(self) -> None:
+        self.start = 0
+        self.end = 0
+        self.zone = timezone.utc
+
+    def zone_at(self, seconds: int) -> timezone:
+        if not self.start <= seconds < self.end:
+            starts, zones, year_end = get_local_zone_transitions(time.gmtime(seconds).tm_year)
+            index = bisect_right(starts, seconds) - 1
+            self.start = starts[index]
+            self.end = starts[index + 1] if index + 1 < len(starts) else year_end
+            self.zone = zones[index]
+        return self.zone
+
+
+def convert_epoch_times(
+    epoch_times: Iterable[float], units_per_second: int = 1, naive: bool = False
+) -> List[datetime]:
+    """
+    Converts Unix epoch times (in seconds, or e.g. milliseconds with
+    units_per_second=1000) to local datetimes in one pass.
+    """
+    lookup = LocalZoneLookup()
+    datetimes = []
+    for epoch_time in epoch_times:
+        seconds, remainder = divmod(epoch_time, units_per_second)
+        local = datetime.fromtimestamp(int(seconds), lookup.zone_at(int(seconds))).replace(
+            microsecond=int(remainder * 1000000 // units_per_second)
+        )
+        datetimes.append(local.replace(tzinfo=None) if naive else local)
+    return datetimes
+
+
+def convert_chrome_times(chrome_times: Iterable[Union[int, str]]) -> List[datetime]:
+    """
+    Batch version of convert_chrome_time: converts Chrome times (microseconds
+    since 1601, or "%Y-%m-%d %H:%M:%S" strings in UTC) to local datetimes.
+    """
+    lookup = LocalZoneLookup()
+    datetimes = []
+    for chrome_time in chrome_times:
+        try:
+            microseconds = int(chrome_time) - CHROME_EPOCH_MICROSECONDS
+        except ValueError:
+            utc_time = datetime.fromisoformat(str(chrome_time))
+            microseconds = (utc_time - UNIX_EPOCH) // timedelta(microseconds=1)
+        seconds, remainder = divmod(microseconds, 1000000)
+        if seconds < 0:
+            # Before 1970, e.g. unset times, which remove_invalid_history drops
+            datetimes.append(convert_chrome_time(str(chrome_time)))
+            continue
+        datetimes.append(
+            datetime.fromtimestamp(seconds, lookup.zone_at(seconds)).replace(
+                microsecond=remainder
+            )
+        )
+    return datetimes
+
+
 def get_time_diff(
     current_item_visit_time: datetime, last_item_visit_time: str
 ) -> timedelta:
@@ -33,27 +229,17 @@ def get_time_diff(
     return current_item_visit_time - convert_chrome_time(last_item_visit_time)
 
 
-def get_total_timespan_logged(
-    search_history: List[SearchHistoryItem],
-    timespan: str = "week",
-    start_on_monday: bool = True,
-):
-    if not search_history:
-        return 0
+def get_wall_clock_key(visit_datetime: datetime) -> int:
+    """Microseconds since the epoch of a datetime's wall-clock time, ignoring its timezone."""
+    return (visit_datetime.replace(tzinfo=None) - UNIX_EPOCH) // timedelta(microseconds=1)
 
-    # Convert all last_visit_time to datetime objects
-    for entry in search_history:
-        entry["last_visit_time_datetime"] = convert_chrome_time(
-            entry["last_visit_time"]
-        )
-
-    # Sort history by last_visit_time
-    search_history.sort(key=lambda x: x["last_visit_time_datetime"])
-
-    # Get the most recent and earliest dates, converting them to datetime
-    most_recent_date = search_history[-1]["last_visit_time_datetime"]
-    first_date = search_history[0]["last_visit_time_datetime"]
 
+def get_timespans_between(
+    first_date: datetime,
+    most_recent_date: datetime,
+    timespan: str = "week",
+    start_on_monday: bool = True,
+) -> int:
     if timespan == "week":
         # Determine the weekday of the most recent date
         most_recent_weekday = most_recent_date.weekday()
@@ -94,19 +280,86 @@ def get_total_timespan_logged(
         raise ValueError("Unsupported timespan. Choose 'week', 'month', or 'day'.")
 
 
+def get_total_timespan_logged(
+    search_history: List[SearchHistoryItem],
+    timespan: str = "week",
+    start_on_monday: bool = True,
+):
+    if not search_history:
+        return 0
+    # Wall-clock times, as the periods are local weeks, months and days
+    visit_datetimes = [
+        entry["last_visit_time_datetime"].replace(tzinfo=None) for entry in search_history
+    ]
+    return get_timespans_between(
+        min(visit_datetimes), max(visit_datetimes), timespan, start_on_monday
+    )
+
+
 def get_filtered_history(
     search_history: List[SearchHistoryItem], start_date: datetime, end_date: datetime
 ) -> List[SearchHistoryItem]:
     # Normalize start_date to the start of the day in local time
-    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    
+    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
     # Normalize end_date to the end of the day in local time
-    end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-    
+    end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=None)
+
+    # Visits are compared by their wall-clock time
     return [
         entry
         for entry in search_history
-        if start_date.replace(tzinfo=pytz.utc)
-        <= entry["last_visit_time_datetime"].replace(tzinfo=pytz.utc)
-        <= end_date.replace(tzinfo=pytz.utc)
+        if start_date <= entry["last_visit_time_datetime"].replace(tzinfo=None) <= end_date
     ]
+
+
+class TimeIndex:
+    """
+    Records sorted once by their wall-clock visit time, so the records of a
+    period are found by bisection and the number of periods logged from the
+    first and last times alone.
+    """
+
+    def __init__(self, search_history: List[SearchHistoryItem]) -> None:
+        keys = [get_wall_clock_key(entry["last_visit_time_datetime"]) for entry in search_history]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.records = [search_history[i] for i in order]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def insert(self, entry: SearchHistoryItem) -> None:
+        """Inserts a record after those with the same wall-clock time."""
+        key = get_wall_clock_key(entry["last_visit_time_datetime"])
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.records.insert(position, entry)
+
+    def remove(self, entry: SearchHistoryItem) -> None:
+        key = get_wall_clock_key(entry["last_visit_time_datetime"])
+        position = bisect_left(self.keys, key)
+        while self.records[position] is not entry:
+            position += 1
+        del self.keys[position]
+        del self.records[position]
+
+    def get_filtered_history(
+        self, start_date: datetime, end_date: datetime
+    ) -> List[SearchHistoryItem]:
+        """The records from the start of start_date's day to the end of end_date's, oldest first."""
+        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+        start = bisect_left(self.keys, get_wall_clock_key(start_date))
+        end = bisect_right(self.keys, get_wall_clock_key(end_date))
+        return self.records[start:end]
+
+    def get_total_timespan_logged(self, timespan: str = "week", start_on_monday: bool = True) -> int:
+        if not self.keys:
+            return 0
+        return get_timespans_between(
+            UNIX_EPOCH + timedelta(microseconds=self.keys[0]),
+            UNIX_EPOCH + timedelta(microseconds=self.keys[-1]),
+            timespan,
+            start_on_monday,
+        )
@@ -0,0 +1,177 @@
+"""
+This module contains the live watch mode and the ingestion of new history:
+- reading and classifying only the visits added after a high-water mark
+- watching a Chromium profile's History database (and its WAL) or the HTU database
+- adding each batch of new visits to the store in place
+- redrawing the current week's search engine table in place
+
+New visits are classified against the dedup state of the newest visits
+already classified, so a watched history counts the same searches of each
+engine as one run would. Which visit of a redirect pair is labelled the
+redirect may differ, as new visits are classified oldest first.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+from config import HTU_PROFILE_PATH, WATCH_SETTLE_SECONDS
+from dedup import DedupIndex
+from extract_htu import find_htu_history_database, get_incremental_htu_history
+from load import (
+    append_ingested_history,
+    clean_history,
+    get_chromium_history_db,
+    get_incremental_chromium_history,
+    save_ingest_state,
+)
+from process import get_search_history, seed_dedup_index
+from show import print_search_engine_percentages
+from sp_types import IngestState, SearchHistoryItem
+from store import HistoryStore
+
+CLEAR_SCREEN = "\033[H\033[2J"
+
+
+def get_new_search_history(
+    data_path: str,
+    last_visit_time: Optional[float] = None,
+    last_id: int = 0,
+    dedup_index: Optional[DedupIndex] = None,
+) -> Tuple[List[SearchHistoryItem], float, int]:
+    """
+    Reads and classifies the visits of a Chromium profile or HTU sync made
+    after the (last_visit_time, last_id) high-water mark, and returns them
+    newest first along with the new mark.
+    """
+    if data_path == "htu_sync":
+        raw_history, new_last_visit_time = get_incremental_htu_history(last_visit_time)
+        new_last_id = 0
+    else:
+        high_water_mark = (int(last_visit_time), last_id) if last_visit_time is not None else None
+        raw_history, (new_last_visit_time, new_last_id) = get_incremental_chromium_history(
+            data_path, high_water_mark, candidates_only=True
+        )
+    if dedup_index is None:
+        return get_search_history(clean_history(raw_history)), new_last_visit_time, new_last_id
+    # A seeded window holds the newest classified visits, oldest first, so the
+    # new ones are classified oldest first too and slide it forward
+    new_search_history = get_search_history(
+        reversed(list(clean_history(raw_history))), dedup_index
+    )
+    return new_search_history[::-1], new_last_visit_time, new_last_id
+
+
+def get_watched_database(data_path: str) -> Optional[str]:
+    if data_path == "htu_sync":
+        return find_htu_history_database(HTU_PROFILE_PATH)
+    return get_chromium_history_db(data_path)
+
+
+class HistoryChangeHandler(FileSystemEventHandler):
+    """Sets changed whenever the database, its WAL or its journal is written."""
+
+    def __init__(self, database_path: str, changed: threading.Event) -> None:
+        name = os.path.basename(database_path)
+        self.watched_names = {name, name + "-wal", name + "-journal"}
+        self.changed = changed
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        if any(os.path.basename(str(path)) in self.watched_names for path in paths):
+            self.changed.set()
+
+
+class LiveHistory:
+    """
+    The store of a watched source, along with its high-water mark. Each
+    ingest reads only the visits made since the last one, and appends them
+    to the ingested history.
+    """
+
+    def __init__(
+        self, data_path: str, state: IngestState, search_history: Sequence[SearchHistoryItem]
+    ) -> None:
+        self.data_path = data_path
+        self.last_visit_time = state["last_visit_time"]
+        self.last_id = state["last_id"]
+        self.store = HistoryStore(search_history, data_path)
+
+    def ingest(self) -> int:
+        """Adds the new visits to the store and returns how many there were."""
+        new_search_history, self.last_visit_time, self.last_id = get_new_search_history(
+            self.data_path,
+            self.last_visit_time,
+            self.last_id,
+            seed_dedup_index(self.store.records),
+        )
+        if new_search_history:
+            self.store.add(new_search_history, replace_revisited=self.data_path != "htu_sync")
+            append_ingested_history(self.data_path, new_search_history)
+        save_ingest_state(self.data_path, self.get_state())
+        return len(new_search_history)
+
+    def get_state(self) -> IngestState:
+        return {
+            "data_path": self.data_path,
+            "last_visit_time": self.last_visit_time,
+            "last_id": self.last_id,
+        }
+
+
+def print_live_table(store: HistoryStore, new_count: int = 0, hide_complements: bool = True) -> None:
+    print(CLEAR_SCREEN, end="")
+    print_search_engine_percentages(
+        store.get_search_engine_percentages(hide_complements=hide_complements)
+    )
+    if new_count:
+        print(f"\n  Ingested {new_count} new history item{'s' if new_count != 1 else ''}.")
+    print("  Watching for new history, press Ctrl+C to stop.")
+
+
+def watch_search_history(
+    data_path: str,
+    state: IngestState,
+    search_history: Sequence[SearchHistoryItem],
+    hide_complements: bool = True,
+) -> None:
+    """
+    Shows the current week's search engine percentages and updates them as
+    the browser writes new history, until interrupted. Each batch is saved as
+    it is ingested, so the next incremental run starts where the watch stopped.
+    """
+    database_path = get_watched_database(data_path)
+    if database_path is None:
+        print("No history database found to watch.")
+        return
+    live_history = LiveHistory(data_path, state, search_history)
+    changed = threading.Event()
+    observer = Observer()
+    observer.schedule(
+        HistoryChangeHandler(database_path, changed), os.path.dirname(database_path) or "."
+    )
+    observer.start()
+    print_live_table(live_history.store, hide_complements=hide_complements)
+    try:
+        while True:
+            changed.wait()
+            # Wait until the browser has stopped writing before reading
+            changed.clear()
+            while changed.wait(WATCH_SETTLE_SECONDS):
+                changed.clear()
+            try:
+                new_count = live_history.ingest()
+            except sqlite3.Error as e:
+                print(f"Could not read the new history yet: {e}")
+                continue
+            if new_count:
+                print_live_table(live_history.store, new_count, hide_complements)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        observer.stop()
+        observer.join()